@@ -1,18 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from backend.extraction_and_rag_service import extract_data, run_rag
-from backend.file_ops import save_uploaded_file, delete_file
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query
+from backend import document_service as service
+from backend.errors import ServiceError
+from backend.file_ops import iter_file_chunks
+from backend.document_store import DEFAULT_WORKSPACE
+from backend.warmup import readiness, start_warmup
+from utils import telemetry
+from utils.logger_config import log_context
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.wsgi import WSGIMiddleware 
-from ui import create_dash_app
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import Request
+from contextlib import asynccontextmanager
+import threading
+import time
+import uuid
 from pathlib import Path
+from typing import List, Optional
 import os
 
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every worker warms up its clients and vector stores in the background, see /ready
+    start_warmup()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,9 +41,55 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+# Times every request and, with SERVER_TIMING=true, returns the time of its pipeline stages in a Server-Timing header.
+# The request id (X-Request-ID, given by a proxy or made here) is added to its log records and returned.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = telemetry.start_trace()
+    start = time.perf_counter()
+    status = 500
+    try:
+        with log_context(request_id=request_id):
+            response = await call_next(request)
+        status = response.status_code
+    finally:
+        seconds = time.perf_counter() - start
+        spans = telemetry.end_trace(token)
+        route = request.scope.get("route") # Route templates keep the label set small, unlike raw paths
+        telemetry.observe("request_duration_seconds", seconds, method=request.method,
+                          route=getattr(route, "path", "unmatched"), status=status)
+
+    response.headers["X-Request-ID"] = request_id
+    if telemetry.SERVER_TIMING:
+        response.headers["Server-Timing"] = telemetry.server_timing_header(spans, seconds)
+    return response
+
+
+class LazyDashApp:
+    """
+    ASGI app creating the Dash UI on its first request. Dash, its components and pandas are only
+    loaded when someone opens the UI, so importing and starting the API stays fast.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._app is None:
+                from ui import create_dash_app
+                self._app = WSGIMiddleware(create_dash_app().server)
+        return self._app
+
+    async def __call__(self, scope, receive, send):
+        dash_asgi = self._app or await run_in_threadpool(self._load)
+        await dash_asgi(scope, receive, send)
+
+
 # Mount Dash app 
-dash_app = create_dash_app()
-app.mount("/rag", WSGIMiddleware(dash_app.server))
+app.mount("/rag", LazyDashApp())
 
 
 @app.get("/")
@@ -32,80 +97,195 @@ def read_root():
     return {"message": "FastAPI root is up"}
 
 
+# Liveness: answers as soon as the process is up, without touching any dependency
+@app.get("/health")
+def health_endpoint():
+    return {"status": "ok"}
+
+
+# Readiness of this worker: 503 until its modules, OpenAI clients and recent vector stores are warm
+@app.get("/ready")
+def ready_endpoint():
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+
+# Prometheus metrics of this worker: stage and request latencies, tokens and cache hit rates
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 
 # Create a upload endpoint
 @app.post("/upload-pdf/")
-async def upload_via_api(file: UploadFile = File(...)):
-    file_bytes = await file.read()
+async def upload_via_api(file: UploadFile = File(...), workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
     try:
-        success, message = save_uploaded_file(file_bytes, file.filename)
-        if not success:
-            # return 409 for know issue
-            raise HTTPException(status_code=409, detail=message)
-        return {"success": success, "message": message}
-    except HTTPException as he:
-        raise he     
+        # Stream the spooled upload to disk in a worker thread instead of reading it at once.
+        return await run_in_threadpool(service.upload_document, iter_file_chunks(file.file), file.filename, workspace)
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
 
 
 
-# Create extraction endpoint
+# Create extraction endpoint, wait=false answers "pending" at once for an extraction precomputed in the background
 @app.get("/extract-data/")
-def extract_data_endpoint(filepath: str, schema_name:str):
+def extract_data_endpoint(filepath: str, schema_name:str, wait: bool = True,
+                          workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
     try:
-        rows, cols = extract_data(filepath, schema_name)
-        if not rows and cols:
-            raise HTTPException(status_code=204, detail="No Relevant information found.")
-        
-        return {"rows": rows, "cols": cols}
-    
-    except HTTPException as he:
-        raise he
+        return service.extract_document(filepath, schema_name, workspace, wait)
     
-    except ValueError as ve:
-        raise HTTPException(status_code=400, detail=f"Invalid request: {str(ve)}")
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
     
     
-# Create rag endpoint 
+# Which schemas of a document are extracted, being precomputed or not extracted yet
+@app.get("/extraction-status/")
+def extraction_status_endpoint(filepath: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.extraction_status(filepath, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+# The fields found by the pre-extraction rules, shown while the extraction runs
+@app.get("/pre-extracted/")
+def pre_extracted_endpoint(filepath: str, schema_name: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.pre_extract_document(filepath, schema_name, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+# Create rag endpoint, the search can be narrowed to a page, a section (e.g. "5" or "5.2") or a content type
 @app.get("/query-document/")
-def query_document_endpoint(filepath: str, query: str):
+def query_document_endpoint(filepath: str, 
+                            query: str, 
+                            page: Optional[int] = None, 
+                            section: Optional[str] = None, 
+                            content_type: Optional[str] = None,
+                            workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
     try:
-        answer = run_rag(filepath, query)
-        if not answer:
-            raise HTTPException(status_code=204, detail="No relavant information found")
-        return {"answer": str(answer)}
+        filters = {"page": page, "section": section, "content_type": content_type}
+        return service.query_document(filepath, query, workspace, filters)
     
-    except HTTPException as he:
-        raise he
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+# Conversation endpoints: a session on a document keeps its history, follow-ups re-use the chunks of their topic
+@app.post("/conversations/")
+def start_conversation_endpoint(filepath: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.start_conversation(filepath, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+@app.post("/conversations/{session_id}/messages")
+def ask_conversation_endpoint(session_id: str, query: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.ask_conversation(session_id, query, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+@app.get("/conversations/{session_id}")
+def get_conversation_endpoint(session_id: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.get_conversation(session_id, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+@app.delete("/conversations/{session_id}")
+def end_conversation_endpoint(session_id: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return service.end_conversation(session_id, workspace)
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Create search endpoint, searches several documents at once (VECTORSTORE_MODE=shared only)
+@app.get("/search/")
+def search_documents_endpoint(query: str,
+                              filenames: List[str] = Query(default=[]),
+                              page: Optional[int] = None,
+                              section: Optional[str] = None,
+                              content_type: Optional[str] = None,
+                              k: int = 10,
+                              workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        filters = {"page": page, "section": section, "content_type": content_type}
+        return {"results": service.search_documents(query, workspace, filenames, filters, k)}
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
         
     
 # Create delete endpoint 
 @app.delete(("/delete-file/{filename}"))
-def delete_file_endpoint(filename: str):
+def delete_file_endpoint(filename: str, workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
     try:
-        is_file_deleted, messages = delete_file(filename)
-
-        if is_file_deleted:
-            return messages
-        
-        else:
-            raise HTTPException(status_code=404, detail="File not found.")
+        return service.delete_document(filename, workspace)
         
-    except HTTPException as he:
-        raise he
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Create list endpoint, reads the document index of the workspace
+@app.get("/documents/")
+def list_documents_endpoint(workspace: str = Header(DEFAULT_WORKSPACE, alias="X-Workspace")):
+    try:
+        return {"documents": service.list_documents(workspace)}
+
+    except ServiceError as se:
+        raise HTTPException(status_code=se.status_code, detail=se.detail)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,185 @@
+import os
+import uuid
+from typing import Iterable, Iterator
+
+from backend.errors import ServiceError
+from backend.file_ops import MAX_UPLOAD_BYTES
+
+# "local" calls the service layer in-process, "http" talks to a separately deployed API.
+API_MODE = os.getenv("RFP_API_MODE", "local")
+API_BASE_URL = os.getenv("RFP_API_URL", "http://127.0.0.1:8000")
+DEFAULT_WORKSPACE = os.getenv("RFP_DEFAULT_WORKSPACE", "default")
+
+
+def _multipart_body(chunks: Iterable[bytes], filename: str, boundary: str,
+                    max_bytes: int = MAX_UPLOAD_BYTES) -> Iterator[bytes]:
+    """
+    Yields the multipart/form-data body of an uploaded PDF, as a "file" field, chunk by chunk. Stops with a
+    409 error once the file exceeds `max_bytes`, like the API would, without sending the rest.
+    """
+    quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+    yield (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{quoted}\"\r\n"
+           f"Content-Type: application/pdf\r\n\r\n").encode("utf-8")
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise ServiceError(409, f"{filename} is larger than {max_bytes // (1024 * 1024)} MB.")
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+
+class LocalClient:
+    """
+    Calls the service layer directly, in the same process.
+
+    This is the default for the Dash app mounted inside FastAPI: no serialization, no TCP hop
+    and no WSGI thread blocked waiting on its own server.
+    """
+
+    def upload(self, chunks: Iterable[bytes], filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.upload_document(chunks, filename, workspace)
+
+    def extract(self, filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE, wait: bool = True) -> dict:
+        from backend import document_service
+        return document_service.extract_document(filepath, schema_name, workspace, wait)
+
+    def extraction_status(self, filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.extraction_status(filepath, workspace)
+
+    def pre_extracted(self, filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.pre_extract_document(filepath, schema_name, workspace)
+
+    def query(self, filepath: str, query: str, workspace: str = DEFAULT_WORKSPACE, filters: dict | None = None) -> dict:
+        from backend import document_service
+        return document_service.query_document(filepath, query, workspace, filters)
+
+    def start_conversation(self, filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.start_conversation(filepath, workspace)
+
+    def ask(self, session_id: str, query: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.ask_conversation(session_id, query, workspace)
+
+    def end_conversation(self, session_id: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.end_conversation(session_id, workspace)
+
+    def search(self, query: str, workspace: str = DEFAULT_WORKSPACE, filenames: list | None = None,
+               filters: dict | None = None) -> list:
+        from backend import document_service
+        return document_service.search_documents(query, workspace, filenames, filters)
+
+    def delete(self, filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        from backend import document_service
+        return document_service.delete_document(filename, workspace)
+
+    def list_documents(self, workspace: str = DEFAULT_WORKSPACE) -> list:
+        from backend import document_service
+        return document_service.list_documents(workspace)
+
+
+class HttpClient:
+    """
+    Calls the FastAPI endpoints over HTTP. Only needed when the UI and the API are deployed separately.
+    """
+
+    def __init__(self, base_url: str = API_BASE_URL, timeout: float = 300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _handle(self, response) -> dict:
+        if response.status_code == 200:
+            return response.json()
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise ServiceError(response.status_code, detail)
+
+    def _headers(self, workspace: str) -> dict:
+        return {"X-Workspace": workspace}
+
+    def upload(self, chunks: Iterable[bytes], filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        # requests builds `files=` bodies in memory, so the multipart body is streamed from a generator instead
+        boundary = uuid.uuid4().hex
+        headers = {**self._headers(workspace), "Content-Type": f"multipart/form-data; boundary={boundary}"}
+        return self._handle(requests.post(f"{self.base_url}/upload-pdf/", data=_multipart_body(chunks, filename, boundary),
+                                          headers=headers, timeout=self.timeout))
+
+    def extract(self, filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE, wait: bool = True) -> dict:
+        import requests
+        params = {"filepath": filepath, "schema_name": schema_name, "wait": str(wait).lower()}
+        return self._handle(requests.get(f"{self.base_url}/extract-data/", params,
+                                         headers=self._headers(workspace), timeout=self.timeout))
+
+    def extraction_status(self, filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        return self._handle(requests.get(f"{self.base_url}/extraction-status/", {"filepath": filepath},
+                                         headers=self._headers(workspace), timeout=self.timeout))
+
+    def pre_extracted(self, filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        params = {"filepath": filepath, "schema_name": schema_name}
+        return self._handle(requests.get(f"{self.base_url}/pre-extracted/", params,
+                                         headers=self._headers(workspace), timeout=self.timeout))
+
+    def query(self, filepath: str, query: str, workspace: str = DEFAULT_WORKSPACE, filters: dict | None = None) -> dict:
+        import requests
+        params = {"filepath": filepath, "query": query}
+        params.update({key: value for key, value in (filters or {}).items() if value is not None})
+        return self._handle(requests.get(f"{self.base_url}/query-document/", params,
+                                         headers=self._headers(workspace), timeout=self.timeout))
+
+    def start_conversation(self, filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        return self._handle(requests.post(f"{self.base_url}/conversations/", params={"filepath": filepath},
+                                          headers=self._headers(workspace), timeout=self.timeout))
+
+    def ask(self, session_id: str, query: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        return self._handle(requests.post(f"{self.base_url}/conversations/{session_id}/messages", params={"query": query},
+                                          headers=self._headers(workspace), timeout=self.timeout))
+
+    def end_conversation(self, session_id: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        return self._handle(requests.delete(f"{self.base_url}/conversations/{session_id}",
+                                            headers=self._headers(workspace), timeout=self.timeout))
+
+    def search(self, query: str, workspace: str = DEFAULT_WORKSPACE, filenames: list | None = None,
+               filters: dict | None = None) -> list:
+        import requests
+        params = {"query": query, "filenames": filenames or []}
+        params.update({key: value for key, value in (filters or {}).items() if value is not None})
+        return self._handle(requests.get(f"{self.base_url}/search/", params,
+                                         headers=self._headers(workspace), timeout=self.timeout))["results"]
+
+    def delete(self, filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+        import requests
+        return self._handle(requests.delete(f"{self.base_url}/delete-file/{filename}",
+                                            headers=self._headers(workspace), timeout=self.timeout))
+
+    def list_documents(self, workspace: str = DEFAULT_WORKSPACE) -> list:
+        import requests
+        return self._handle(requests.get(f"{self.base_url}/documents/",
+                                         headers=self._headers(workspace), timeout=self.timeout))["documents"]
+
+
+def get_api_client(mode: str = API_MODE):
+    """
+    Returns the client used by the Dash callbacks.
+
+    Parameters:
+        mode (str): "local" (default) for in-process calls or "http" for split deployments.
+    """
+    if mode == "local":
+        return LocalClient()
+    elif mode == "http":
+        return HttpClient()
+    else:
+        raise ValueError(f"Unknown API mode: {mode}. Use 'local' or 'http'.")
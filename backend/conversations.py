@@ -0,0 +1,275 @@
+"""
+Conversation sessions of the RAG endpoint: history, rolling summary and the chunks of the current topic.
+
+A session belongs to one document. Every turn is stored with its question and answer. The prompt of a turn
+gets the last CONVERSATION_RECENT_TURNS turns verbatim and a summary of the older ones: once a session has
+more turns, the oldest are folded into the summary by the LLM in a background thread, so the prompt stays
+the same size however long the session runs.
+
+The chunks retrieved for a question are kept with the embedding of that question. A follow-up question
+whose embedding is close to it (cosine >= CONVERSATION_FOLLOWUP_SIMILARITY) is about the same topic and is
+answered from the same chunks, without a new retrieval.
+"""
+import json
+import math
+import os
+import sqlite3
+import time
+import uuid
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, List
+
+from backend.document_store import INDEX_PATH
+from utils import telemetry
+from utils.logger_config import setup_logger, log_context, get_log_context
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+CONVERSATION_INDEX_PATH = os.getenv("CONVERSATION_INDEX_PATH", INDEX_PATH)
+RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", 3)) # Turns sent verbatim, the older ones are summarized
+SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", 300))
+FOLLOWUP_SIMILARITY = float(os.getenv("CONVERSATION_FOLLOWUP_SIMILARITY", 0.55))
+CONVERSATION_TTL_SECONDS = float(os.getenv("CONVERSATION_TTL_SECONDS", 24 * 3600)) # Idle sessions are removed after
+
+
+def _pack_vector(vector: List[float] | None) -> bytes | None:
+    return array("f", vector).tobytes() if vector is not None else None
+
+
+def _unpack_vector(blob: bytes | None) -> List[float] | None:
+    if blob is None:
+        return None
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def is_follow_up(query_vector: List[float], context_vector: List[float] | None,
+                 threshold: float = FOLLOWUP_SIMILARITY) -> bool:
+    """Whether a question is about the topic whose chunks were retrieved for `context_vector`."""
+
+    return context_vector is not None and cosine_similarity(query_vector, context_vector) >= threshold
+
+
+class ConversationStore:
+    """
+    Conversation sessions in a small SQLite database (the document index by default).
+
+    `conversations` has one row per session: its document, the summary of its older turns, the number of
+    turns that summary covers and the chunks of the current topic with the question vector they were
+    retrieved for. `turns` has one row per question.
+    """
+
+    def __init__(self, index_path: str = CONVERSATION_INDEX_PATH):
+        self.index_path = index_path
+        self._create_index()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens a connection to the index, commits on success and always closes it."""
+
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_index(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    session_id        TEXT    PRIMARY KEY,
+                    workspace         TEXT    NOT NULL,
+                    filename          TEXT    NOT NULL,
+                    summary           TEXT    NOT NULL DEFAULT '',
+                    summarized_turns  INTEGER NOT NULL DEFAULT 0,
+                    context           TEXT,
+                    context_vector    BLOB,
+                    created_at        REAL    NOT NULL,
+                    updated_at        REAL    NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    session_id      TEXT    NOT NULL,
+                    turn            INTEGER NOT NULL,
+                    question        TEXT    NOT NULL,
+                    answer          TEXT    NOT NULL,
+                    reused_context  INTEGER NOT NULL DEFAULT 0,
+                    created_at      REAL    NOT NULL,
+                    PRIMARY KEY (session_id, turn)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS conversations_document ON conversations (workspace, filename)")
+
+    def create(self, workspace: str, filename: str) -> str:
+        """Starts a session on a document, returns its id."""
+
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO conversations (session_id, workspace, filename, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (session_id, workspace, filename, now, now)
+            )
+        return session_id
+
+    def get(self, session_id: str) -> dict | None:
+        """
+        Returns the session, with its "context" as a list of {"page_content", "metadata"} chunks and its
+        "context_vector" as a list of floats (both None before the first retrieval).
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM conversations WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        session = dict(row)
+        session["context"] = json.loads(session["context"]) if session["context"] else None
+        session["context_vector"] = _unpack_vector(session["context_vector"])
+        return session
+
+    def turns(self, session_id: str, after: int = 0) -> list:
+        """Returns the turns numbered above `after`, oldest first."""
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT turn, question, answer, reused_context, created_at FROM turns
+                   WHERE session_id = ? AND turn > ? ORDER BY turn""",
+                (session_id, after)
+            ).fetchall()
+        return [{**dict(row), "reused_context": bool(row["reused_context"])} for row in rows]
+
+    def add_turn(self, session_id: str, question: str, answer: str, reused_context: bool,
+                 context: list | None = None, context_vector: List[float] | None = None) -> int:
+        """
+        Records a turn and, when its chunks were freshly retrieved, makes them the context of the session.
+
+        Returns:
+            int: The number of the turn, from 1.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE") # Concurrent questions of a session get distinct numbers
+            turn = conn.execute("SELECT COALESCE(MAX(turn), 0) + 1 FROM turns WHERE session_id = ?",
+                                (session_id,)).fetchone()[0]
+            conn.execute(
+                """INSERT INTO turns (session_id, turn, question, answer, reused_context, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (session_id, turn, question, answer, int(reused_context), now)
+            )
+            if context is not None:
+                conn.execute(
+                    "UPDATE conversations SET context = ?, context_vector = ?, updated_at = ? WHERE session_id = ?",
+                    (json.dumps(context), _pack_vector(context_vector), now, session_id)
+                )
+            else:
+                conn.execute("UPDATE conversations SET updated_at = ? WHERE session_id = ?", (now, session_id))
+        return turn
+
+    def update_summary(self, session_id: str, summary: str, summarized_turns: int, expected_turns: int) -> bool:
+        """
+        Replaces the summary, unless another thread or worker updated it since it was read with
+        `expected_turns` summarized turns. Returns whether it was replaced.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """UPDATE conversations SET summary = ?, summarized_turns = ?
+                   WHERE session_id = ? AND summarized_turns = ?""",
+                (summary, summarized_turns, session_id, expected_turns)
+            )
+        return cursor.rowcount == 1
+
+    def delete(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+
+    def delete_document(self, workspace: str, filename: str) -> int:
+        """Removes the sessions of a document, returns how many there were."""
+
+        return self._delete_where("workspace = ? AND filename = ?", (workspace, filename))
+
+    def prune(self, idle_seconds: float = CONVERSATION_TTL_SECONDS) -> int:
+        """Removes the sessions unused for `idle_seconds`, returns how many there were."""
+
+        return self._delete_where("updated_at < ?", (time.time() - idle_seconds,))
+
+    def _delete_where(self, condition: str, params: tuple) -> int:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"DELETE FROM turns WHERE session_id IN (SELECT session_id FROM conversations WHERE {condition})",
+                         params)
+            return conn.execute(f"DELETE FROM conversations WHERE {condition}", params).rowcount
+
+
+@lru_cache(maxsize=1)
+def get_conversation_store() -> ConversationStore:
+    """Returns the conversation store shared by the whole process."""
+
+    return ConversationStore()
+
+
+@lru_cache(maxsize=1)
+def _summary_executor() -> ThreadPoolExecutor:
+    # Created on first use, so a forked worker gets its own threads
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+
+def compact(session_id: str) -> bool:
+    """
+    Folds the turns older than the last RECENT_TURNS into the summary of the session.
+
+    Returns:
+        bool: Whether the summary was updated. It is not when there is nothing to fold or when another
+            thread did it first.
+    """
+    from backend.extraction_and_rag_service import summarize_conversation
+
+    store = get_conversation_store()
+    session = store.get(session_id)
+    if session is None:
+        return False
+
+    turns = store.turns(session_id, after=session["summarized_turns"])
+    if len(turns) <= RECENT_TURNS:
+        return False
+
+    older = turns[:-RECENT_TURNS] if RECENT_TURNS else turns
+    summary = summarize_conversation(session["summary"], older, max_tokens=SUMMARY_MAX_TOKENS)
+    updated = store.update_summary(session_id, summary, older[-1]["turn"], expected_turns=session["summarized_turns"])
+    if updated:
+        telemetry.increment("conversation_summaries_total")
+    return updated
+
+
+def schedule_compaction(session_id: str):
+    """Runs `compact` in the background, with the log context of the request that scheduled it."""
+
+    fields = get_log_context()
+
+    def run():
+        with log_context(**fields):
+            try:
+                compact(session_id)
+            except Exception as e:
+                # The turns stay unsummarized, the next turn tries again
+                logger.error(f"Summarizing conversation {session_id} failed: {e}")
+
+    _summary_executor().submit(run)
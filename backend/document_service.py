@@ -0,0 +1,495 @@
+import os
+from contextlib import contextmanager, ExitStack
+from typing import Iterable, Iterator
+
+from backend.file_ops import save_uploaded_stream, delete_file, sanitize_filename, MAX_UPLOAD_BYTES
+from backend.document_store import get_document_store, validate_workspace, DEFAULT_WORKSPACE
+from backend.store_manager import get_store_manager, DocumentDeletedError
+from backend.shared_store import is_shared_mode, delete_document_vectors, document_id, search_documents as search_shared_store
+from backend.errors import ServiceError
+from backend.file_lock import file_lock
+from backend.conversations import get_conversation_store, schedule_compaction, RECENT_TURNS, CONVERSATION_TTL_SECONDS
+from backend.extraction_cache import get_extraction_cache, fields_from_rows, rows_from_fields, TABLE_COLUMNS
+from backend.precompute import schedule_precompute, wait_for_extraction, PRECOMPUTE_TIMEOUT_SECONDS, PRECOMPUTE_WAIT_SECONDS
+from backend import query_router
+from utils import telemetry
+from utils.logger_config import log_context
+
+# The extraction and RAG pipelines (LangChain, Chroma, PDF parsing) are imported by the functions using
+# them, on the first extraction or query, so the API starts without loading them
+
+# How long a deletion waits for running queries before handing the cleanup over to them
+DELETE_WAIT_SECONDS = float(os.getenv("DELETE_WAIT_SECONDS", 5))
+
+
+def _workspace(workspace: str) -> str:
+    """Validates the workspace name and turns a bad one into a 400 error."""
+    try:
+        return validate_workspace(workspace)
+    except ValueError as ve:
+        raise ServiceError(400, str(ve))
+
+
+@contextmanager
+def _open_document(workspace: str, filepath: str) -> Iterator[dict]:
+    """
+    Holds a reader reference on the vector store of a document for the duration of a request.
+
+    On entry, the vector store is restored if it was archived and the document is marked as recently used.
+    On success, the size of a freshly created vector store is recorded and cold stores above the quota
+    are archived. In shared mode, documents have no vector store directory of their own, so there is
+    nothing to archive or restore.
+
+    Yields:
+        dict: The "upload_dir", "vectorstore_dir" and "workspace" of the document.
+    """
+    store = get_document_store()
+    if store.get_document(workspace, filepath) is None:
+        raise ServiceError(404, f"{filepath} not found in workspace {workspace}.")
+
+    persist_path = store.vectorstore_path(workspace, filepath)
+    with ExitStack() as stack:
+        stack.enter_context(log_context(document_id=document_id(workspace, filepath))) # Logged with every record
+        try:
+            stack.enter_context(get_store_manager().acquire(persist_path))
+        except DocumentDeletedError:
+            # Fail fast instead of recreating the store of a document being deleted
+            raise ServiceError(410, f"{filepath} is being deleted.")
+        # Other workers cannot archive or remove the store while this request reads it
+        stack.enter_context(file_lock(persist_path, shared=True))
+
+        if not is_shared_mode():
+            store.restore_vector_store(workspace, filepath)
+        store.touch(workspace, filepath)
+
+        yield {"upload_dir": store.upload_dir(workspace), "vectorstore_dir": store.vectorstore_dir(workspace),
+               "workspace": workspace}
+
+        document = store.get_document(workspace, filepath)
+        if not is_shared_mode() and document and not document["index_bytes"]:
+            store.refresh_index_size(workspace, filepath)
+            store.enforce_index_quota(workspace, keep=filepath)
+
+
+def upload_document(chunks: Iterable[bytes], filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Streams an uploaded PDF to the upload directory of the workspace and registers it in the document index.
+
+    Parameters:
+        chunks (Iterable[bytes]): Content of the uploaded file, chunk by chunk.
+        filename (str): Original name of the uploaded file.
+        workspace (str): Workspace (user or team) that owns the document.
+
+    Returns:
+        dict: {"success": bool, "message": str, "content_hash": str, "precomputing": list[str]}, the schemas
+            being extracted in the background, see `backend.precompute`.
+    """
+    workspace = _workspace(workspace)
+    store = get_document_store()
+
+    # Fail fast before streaming anything if the workspace is already full
+    allowed, message = store.check_quota(workspace)
+    if not allowed:
+        raise ServiceError(409, message)
+
+    max_bytes = min(MAX_UPLOAD_BYTES, store.remaining_bytes(workspace))
+    success, message, content_hash = save_uploaded_stream(
+        chunks, filename, upload_dir=store.upload_dir(workspace), max_bytes=max_bytes
+    )
+    if not success:
+        # 409 for known issues (quota reached, duplicate, wrong file type, too large)
+        raise ServiceError(409, message)
+
+    safe_filename = sanitize_filename(filename)
+    size_bytes = os.path.getsize(os.path.join(store.upload_dir(workspace), safe_filename))
+    added, quota_message = store.add_document(workspace, safe_filename, size_bytes, content_hash)
+    if not added:
+        # A concurrent upload took the remaining quota, roll this one back
+        delete_file(safe_filename, upload_dir=store.upload_dir(workspace), vector_dir=store.vectorstore_dir(workspace))
+        raise ServiceError(409, quota_message)
+
+    # With PRECOMPUTE_EXTRACTIONS, every schema is extracted in the background before the user asks for it
+    from backend.schemas import SCHEMAS
+
+    with log_context(document_id=document_id(workspace, safe_filename)):
+        precomputed = schedule_precompute(safe_filename, workspace, content_hash, list(SCHEMAS))
+
+    return {"success": success, "message": message, "content_hash": content_hash, "precomputing": precomputed}
+
+
+def _content_hash(workspace: str, filepath: str) -> str | None:
+    """Returns the content hash of a document, which keys its cached extractions."""
+
+    document = get_document_store().get_document(workspace, filepath)
+    return document["content_hash"] if document else None
+
+
+def run_extraction(filepath: str, schema_name: str, workspace: str, content_hash: str | None) -> dict:
+    """
+    Extracts a schema from a document with the LLM and caches a successful result, whether it was
+    requested or precomputed (see `backend.precompute`), unless the document was deleted meanwhile.
+
+    Returns:
+        dict: {"rows": list[dict], "cols": list[dict]} ready to be used by a Dash DataTable.
+    """
+    from backend.extraction_and_rag_service import extract_data
+    from backend.vectorstore_chain import load_candidates
+
+    with _open_document(workspace, filepath) as dirs:
+        # The fields found by the pre-extraction rules are not asked to the LLM
+        candidates = load_candidates(filepath, dirs["upload_dir"], content_hash)
+        try:
+            rows, cols = extract_data(filepath, schema_name, candidates=candidates, **dirs)
+        except ValueError as ve:
+            raise ServiceError(400, f"Invalid request: {str(ve)}")
+
+    fields = fields_from_rows(rows)
+    if content_hash and fields is not None:
+        # The document may have been deleted during the LLM call, its extractions with it: caching this one
+        # would leave an entry no document uses. The check after the write covers a deletion in between.
+        store, cache = get_document_store(), get_extraction_cache()
+        if store.has_content(content_hash):
+            cache.put(content_hash, schema_name, fields)
+            if not store.has_content(content_hash):
+                cache.delete(content_hash)
+
+    if not rows and cols:
+        raise ServiceError(204, "No Relevant information found.")
+
+    return {"rows": rows, "cols": cols}
+
+
+def extract_document(filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE, wait: bool = True) -> dict:
+    """
+    Extracts the structured information of the given schema from a document. Successful extractions are
+    cached by content hash, see `backend.extraction_cache`.
+
+    An extraction being precomputed in the background, marked pending less than PRECOMPUTE_TIMEOUT_SECONDS
+    ago, is waited for, at most PRECOMPUTE_WAIT_SECONDS, instead of being run twice. With `wait=False`, it is
+    reported as pending right away.
+
+    Returns:
+        dict: {"rows": list[dict], "cols": list[dict], "status": "done" | "pending"}, rows and columns ready to
+            be used by a Dash DataTable, empty while pending.
+    """
+    from backend.schemas import SCHEMAS
+
+    workspace = _workspace(workspace)
+    if schema_name.lower() not in SCHEMAS:
+        raise ServiceError(400, f"Invalid request: Unknown schema name: {schema_name}")
+
+    content_hash = _content_hash(workspace, filepath)
+    cache = get_extraction_cache()
+    fields = cache.get(content_hash, schema_name) if content_hash else None
+    if fields is None and content_hash and schema_name.lower() in cache.pending(content_hash, PRECOMPUTE_TIMEOUT_SECONDS):
+        if not wait:
+            return {"rows": [], "cols": TABLE_COLUMNS, "status": "pending"}
+        fields = wait_for_extraction(content_hash, schema_name, timeout=PRECOMPUTE_WAIT_SECONDS)
+    telemetry.record_cache("extraction", fields is not None)
+    if fields is not None:
+        return {"rows": rows_from_fields(fields), "cols": TABLE_COLUMNS, "status": "done"}
+
+    return {**run_extraction(filepath, schema_name, workspace, content_hash), "status": "done"}
+
+
+def extraction_status(filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Returns the state of the extractions of a document.
+
+    Returns:
+        dict: {"schemas": {schema_name: "done" | "pending" | "missing"}}, "pending" for the extractions
+            being precomputed in the background.
+    """
+    from backend.schemas import SCHEMAS
+
+    workspace = _workspace(workspace)
+    content_hash = _content_hash(workspace, filepath)
+    if content_hash is None:
+        raise ServiceError(404, f"{filepath} not found in workspace {workspace}.")
+
+    cache = get_extraction_cache()
+    done = cache.get_all(content_hash)
+    pending = cache.pending(content_hash, PRECOMPUTE_TIMEOUT_SECONDS)
+    return {"schemas": {name: "done" if name in done else "pending" if name in pending else "missing"
+                        for name in SCHEMAS}}
+
+
+def pre_extract_document(filepath: str, schema_name: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Returns the fields of a schema found by the pre-extraction rules (see `utils.pre_extraction`), without
+    LLM call nor vector store: the partial table shown while `extract_document` runs. Once the extraction
+    is cached, it is returned instead, so a late partial table never replaces the complete one.
+
+    Returns:
+        dict: {"rows": list[dict], "cols": list[dict], "complete": bool}, "complete" being False when the
+            LLM still has fields to extract.
+    """
+    from backend.schemas import SCHEMAS
+    from backend.vectorstore_chain import load_candidates
+    from utils.pre_extraction import resolve_fields
+
+    workspace = _workspace(workspace)
+    schema = SCHEMAS.get(schema_name.lower())
+    if schema is None:
+        raise ServiceError(400, f"Invalid request: Unknown schema name: {schema_name}")
+
+    store = get_document_store()
+    content_hash = _content_hash(workspace, filepath)
+    if content_hash is None:
+        raise ServiceError(404, f"{filepath} not found in workspace {workspace}.")
+
+    fields = get_extraction_cache().get(content_hash, schema_name)
+    if fields is not None:
+        return {"rows": rows_from_fields(fields), "cols": TABLE_COLUMNS, "complete": True}
+
+    with log_context(document_id=document_id(workspace, filepath)):
+        resolved, _ = resolve_fields(load_candidates(filepath, store.upload_dir(workspace), content_hash), schema_name)
+    if not resolved:
+        raise ServiceError(204, "No field pre-extracted.")
+
+    # The fields left to the LLM are listed empty, in the order of the complete table
+    rows = rows_from_fields({name: resolved.get(name) for name in schema.model_fields})
+    return {"rows": rows, "cols": TABLE_COLUMNS, "complete": len(resolved) == len(schema.model_fields)}
+
+
+def _metadata_filter(filters: dict | None) -> dict | None:
+    """Builds the Chroma filter of the "page", "section" and "content_type" filters, a bad one being a 400 error."""
+    from utils.helper_functions import build_metadata_filter
+
+    try:
+        return build_metadata_filter(**{key: value for key, value in (filters or {}).items() if value is not None})
+    except (TypeError, ValueError) as e:
+        raise ServiceError(400, f"Invalid filter: {str(e)}")
+
+
+def _answer_from_extractions(route: "query_router.Route", workspace: str, filepath: str) -> str | None:
+    """Answers a question about a schema field from the cached extractions of the document, if they have it."""
+
+    content_hash = _content_hash(workspace, filepath)
+    if not content_hash:
+        return None
+    return query_router.answer_from_extractions(route, get_extraction_cache().get_all(content_hash))
+
+
+def query_document(filepath: str, query: str, workspace: str = DEFAULT_WORKSPACE, filters: dict | None = None) -> dict:
+    """
+    Answers the user query from the given document. The query router (see `backend.query_router`) picks
+    the path: the cached extractions for questions about a schema field, a small context for short
+    factoid questions and the full RAG pipeline for the others.
+
+    Parameters:
+        filters (dict, optional): Narrows the search to chunks matching "page", "section" and/or "content_type",
+            see `build_metadata_filter`.
+
+    Returns:
+        dict: {"answer": str, "route": "extraction" | "factoid" | "rag"}
+    """
+    workspace = _workspace(workspace)
+    metadata_filter = _metadata_filter(filters)
+
+    route = requested = query_router.route_query(query)
+    if route.kind == query_router.ROUTE_EXTRACTION:
+        # A filter asks for an answer from some pages or sections, not from the whole document
+        answer = None if metadata_filter else _answer_from_extractions(route, workspace, filepath)
+        if answer:
+            telemetry.increment("query_routes_total", route=route.kind, requested=requested.kind)
+            return {"answer": answer, "route": route.kind}
+        route = query_router.Route(query_router.ROUTE_FACTOID)
+
+    from backend.extraction_and_rag_service import run_rag
+
+    model_name = query_router.FACTOID_MODEL if route.kind == query_router.ROUTE_FACTOID else query_router.RAG_MODEL
+    with _open_document(workspace, filepath) as dirs:
+        answer = run_rag(filepath, query, metadata_filter=metadata_filter, k=route.k, model_name=model_name, **dirs)
+    # "requested" differs from "route" for field questions the cached extractions could not answer
+    telemetry.increment("query_routes_total", route=route.kind, requested=requested.kind)
+
+    if not answer:
+        raise ServiceError(204, "No relavant information found")
+
+    return {"answer": str(answer), "route": route.kind}
+
+
+def _conversation(session_id: str, workspace: str) -> dict:
+    """Returns a conversation session, a 404 error if it does not exist or belongs to another workspace."""
+
+    session = get_conversation_store().get(session_id)
+    if session is None or session["workspace"] != workspace:
+        raise ServiceError(404, f"Conversation {session_id} not found in workspace {workspace}.")
+    return session
+
+
+def start_conversation(filepath: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Starts a conversation on a document, see `backend.conversations`. Sessions idle for longer than
+    CONVERSATION_TTL_SECONDS are removed at the same time.
+
+    Returns:
+        dict: {"session_id": str, "filename": str}
+    """
+    workspace = _workspace(workspace)
+    if get_document_store().get_document(workspace, filepath) is None:
+        raise ServiceError(404, f"{filepath} not found in workspace {workspace}.")
+
+    conversations = get_conversation_store()
+    conversations.prune(CONVERSATION_TTL_SECONDS)
+    return {"session_id": conversations.create(workspace, filepath), "filename": filepath}
+
+
+def ask_conversation(session_id: str, query: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Answers the next question of a conversation, with the summary of its older turns, its last turns and,
+    for a follow-up on the same topic, the chunks retrieved for the previous question. Questions about a
+    schema field are answered from the cached extractions when possible, see `query_document`.
+
+    Returns:
+        dict: {"answer": str, "turn": int, "reused_context": bool, "route": "extraction" | "rag"}
+    """
+    from backend.extraction_and_rag_service import run_conversation_turn
+
+    workspace = _workspace(workspace)
+    session = _conversation(session_id, workspace)
+    conversations = get_conversation_store()
+
+    route = query_router.route_query(query)
+    if route.kind == query_router.ROUTE_EXTRACTION:
+        answer = _answer_from_extractions(route, workspace, session["filename"])
+        if answer:
+            telemetry.increment("query_routes_total", route=route.kind, requested=route.kind)
+            turn = conversations.add_turn(session_id, query, answer, reused_context=False)
+            if turn - session["summarized_turns"] > RECENT_TURNS:
+                schedule_compaction(session_id)
+            return {"answer": answer, "turn": turn, "reused_context": False, "route": route.kind}
+    # At most twice the recent turns, even when the summary lags behind (or failed)
+    recent_turns = conversations.turns(session_id, after=session["summarized_turns"])[-2 * RECENT_TURNS:]
+
+    with _open_document(workspace, session["filename"]) as dirs:
+        result = run_conversation_turn(session["filename"], query, session["summary"], recent_turns,
+                                       session["context"], session["context_vector"], **dirs)
+
+    if not result["answer"]:
+        raise ServiceError(204, "No relavant information found")
+
+    turn = conversations.add_turn(session_id, query, result["answer"], result["reused_context"],
+                                  result["context"], result["context_vector"])
+    if turn - session["summarized_turns"] > RECENT_TURNS:
+        schedule_compaction(session_id)
+
+    return {"answer": result["answer"], "turn": turn, "reused_context": result["reused_context"], "route": query_router.ROUTE_RAG}
+
+
+def get_conversation(session_id: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Returns the history of a conversation.
+
+    Returns:
+        dict: {"session_id", "filename", "summary", "summarized_turns",
+            "turns": [{"turn", "question", "answer", "reused_context", "created_at"}]}
+    """
+    workspace = _workspace(workspace)
+    session = _conversation(session_id, workspace)
+    return {
+        "session_id": session_id,
+        "filename": session["filename"],
+        "summary": session["summary"],
+        "summarized_turns": session["summarized_turns"],
+        "turns": get_conversation_store().turns(session_id),
+    }
+
+
+def end_conversation(session_id: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """Deletes a conversation and its history."""
+
+    workspace = _workspace(workspace)
+    _conversation(session_id, workspace)
+    get_conversation_store().delete(session_id)
+    return {"status": "deleted"}
+
+
+def search_documents(query: str, workspace: str = DEFAULT_WORKSPACE, filenames: list | None = None,
+                     filters: dict | None = None, k: int = 10) -> list:
+    """
+    Searches several documents of a workspace at once (all of them if `filenames` is empty).
+    Only available in shared mode, where all the documents are in a single collection.
+
+    Documents that were never queried are not indexed yet and do not show up in the results.
+
+    Returns:
+        list[dict]: The matching chunks, most similar first, as
+            {"filename", "page_start", "page_end", "section", "content"}.
+    """
+    if not is_shared_mode():
+        raise ServiceError(400, "Searching across documents requires VECTORSTORE_MODE=shared.")
+
+    workspace = _workspace(workspace)
+    metadata_filter = _metadata_filter(filters)
+
+    chunks = search_shared_store(query, workspace, filenames=filenames, k=k, metadata_filter=metadata_filter)
+    return [
+        {
+            "filename": chunk.metadata.get("filename"),
+            "page_start": chunk.metadata.get("page_start"),
+            "page_end": chunk.metadata.get("page_end"),
+            "section": chunk.metadata.get("section", ""),
+            "content": chunk.page_content,
+        }
+        for chunk in chunks
+    ]
+
+
+def delete_document(filename: str, workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Removes an uploaded document, its vector store, its archive and its entry in the document index.
+
+    The document disappears from the index right away. Its files are removed as soon as no query is
+    reading its vector store, waiting at most DELETE_WAIT_SECONDS; after that, the last running query
+    removes them and the deletion is reported as "pending".
+
+    Returns:
+        dict: {"file_message": str, "folder_message": str, "status": "deleted" | "pending"}
+    """
+    workspace = _workspace(workspace)
+    store = get_document_store()
+    upload_dir = store.upload_dir(workspace)
+    vectorstore_dir = store.vectorstore_dir(workspace)
+    persist_path = store.vectorstore_path(workspace, filename)
+
+    is_indexed = store.get_document(workspace, filename) is not None
+    has_files = (os.path.exists(os.path.join(upload_dir, filename))
+                 or os.path.isdir(persist_path)
+                 or os.path.exists(store.archive_path(workspace, filename)))
+    if not is_indexed and not has_files:
+        raise ServiceError(404, "File not found.")
+
+    content_hash = _content_hash(workspace, filename)
+    if is_indexed:
+        store.remove_document(workspace, filename)
+    get_conversation_store().delete_document(workspace, filename)
+    # Identical files elsewhere keep sharing the extractions
+    if content_hash and not store.has_content(content_hash):
+        get_extraction_cache().delete(content_hash)
+
+    messages = {"file_message": "", "folder_message": ""}
+    def reclaim():
+        # Waits for the queries running on the document in other workers
+        with file_lock(persist_path):
+            is_file_deleted, delete_messages = delete_file(filename, upload_dir=upload_dir, vector_dir=vectorstore_dir)
+        if is_file_deleted:
+            messages.update(delete_messages)
+        if store.remove_archive(workspace, filename):
+            messages["folder_message"] = f"{filename} archive removed."
+        if is_shared_mode():
+            delete_document_vectors(workspace, filename)
+            messages["folder_message"] = f"{filename} removed from the shared vector store."
+
+    status = get_store_manager().delete(persist_path, reclaim, timeout=DELETE_WAIT_SECONDS)
+    if status == "pending":
+        messages["file_message"] = f"{filename} will be removed once the running queries finish."
+
+    return {**messages, "status": status}
+
+
+def list_documents(workspace: str = DEFAULT_WORKSPACE) -> list:
+    """Returns the names of all the documents of a workspace, read from the document index."""
+
+    return get_document_store().list_documents(_workspace(workspace))
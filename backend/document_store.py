@@ -0,0 +1,447 @@
+import os
+import re
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator
+
+from backend.file_ops import UPLOAD_DIRECTORY, VECTORSTORE_DIRECTORY, vectorstore_name
+from backend.store_manager import get_store_manager
+from backend.file_lock import file_lock
+from utils.logger_config import setup_logger
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+ARCHIVE_DIRECTORY = "archives"
+INDEX_PATH = os.getenv("DOCUMENT_INDEX_PATH", "document_index.sqlite3")
+DEFAULT_WORKSPACE = os.getenv("RFP_DEFAULT_WORKSPACE", "default")
+
+WORKSPACE_PATTERN = re.compile(r"\A[A-Za-z0-9_-]{1,64}\Z")
+
+ARCHIVE_FORMAT = "gztar"
+ARCHIVE_EXTENSION = ".tar.gz"
+
+
+@dataclass(frozen=True)
+class WorkspaceQuota:
+    """Limits applied to every workspace."""
+
+    max_files: int = 50
+    max_bytes: int = 2 * 1024 ** 3          # Total size of the uploaded PDFs
+    max_index_bytes: int = 1 * 1024 ** 3    # Total size of the vector stores kept on disk (archives excluded)
+
+
+def load_quota() -> WorkspaceQuota:
+    """Loads the workspace quota from the environment variables, falling back to the defaults."""
+
+    defaults = WorkspaceQuota()
+    return WorkspaceQuota(
+        max_files=int(os.getenv("QUOTA_MAX_FILES", defaults.max_files)),
+        max_bytes=int(os.getenv("QUOTA_MAX_BYTES", defaults.max_bytes)),
+        max_index_bytes=int(os.getenv("QUOTA_MAX_INDEX_BYTES", defaults.max_index_bytes)),
+    )
+
+
+def directory_size(path: str) -> int:
+    """Returns the total size in bytes of all the files under `path`."""
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DocumentStore:
+    """
+    Per-workspace document storage backed by a small SQLite index.
+
+    Every workspace (a user or a team) gets its own namespace:
+        uploads/<workspace>/<file>.pdf
+        vectorestores/<workspace>/<file>/
+        archives/<workspace>/<file>.tar.gz
+
+    The index keeps one row per document with its size, the size of its vector store and the last
+    access time, so listing and quota checks never scan directories. When the vector stores of a
+    workspace grow beyond the quota, or stay idle for long (see `TieredStoreManager`), they are
+    compressed to the archive directory and restored transparently on the next access.
+    """
+
+    def __init__(self,
+                 index_path: str = INDEX_PATH,
+                 upload_root: str = UPLOAD_DIRECTORY,
+                 vectorstore_root: str = VECTORSTORE_DIRECTORY,
+                 archive_root: str = ARCHIVE_DIRECTORY,
+                 quota: WorkspaceQuota | None = None):
+        self.index_path = index_path
+        self.upload_root = upload_root
+        self.vectorstore_root = vectorstore_root
+        self.archive_root = archive_root
+        self.quota = quota or load_quota()
+        self._create_index()
+
+    # ---------- Paths ----------
+    def upload_dir(self, workspace: str) -> str:
+        return os.path.join(self.upload_root, validate_workspace(workspace))
+
+    def vectorstore_dir(self, workspace: str) -> str:
+        return os.path.join(self.vectorstore_root, validate_workspace(workspace))
+
+    def vectorstore_path(self, workspace: str, filename: str) -> str:
+        return os.path.join(self.vectorstore_dir(workspace), vectorstore_name(filename))
+
+    def archive_path(self, workspace: str, filename: str) -> str:
+        return os.path.join(self.archive_root, validate_workspace(workspace), vectorstore_name(filename) + ARCHIVE_EXTENSION)
+
+    # ---------- Index ----------
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens a connection to the index, commits on success and always closes it."""
+
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_index(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    workspace     TEXT    NOT NULL,
+                    filename      TEXT    NOT NULL,
+                    content_hash  TEXT,
+                    size_bytes    INTEGER NOT NULL DEFAULT 0,
+                    index_bytes   INTEGER NOT NULL DEFAULT 0,
+                    uploaded_at   REAL    NOT NULL,
+                    last_accessed REAL    NOT NULL,
+                    archived      INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (workspace, filename)
+                )
+            """)
+
+    def usage(self, workspace: str) -> dict:
+        """Returns the number of documents, their total size and the size of the live vector stores."""
+
+        with self._connect() as conn:
+            row = conn.execute(
+                """SELECT COUNT(*) AS files,
+                          COALESCE(SUM(size_bytes), 0) AS bytes,
+                          COALESCE(SUM(CASE WHEN archived = 0 THEN index_bytes ELSE 0 END), 0) AS index_bytes
+                   FROM documents WHERE workspace = ?""",
+                (workspace,)
+            ).fetchone()
+        return dict(row)
+
+    def check_quota(self, workspace: str, incoming_bytes: int = 0) -> tuple:
+        """
+        Checks whether one more document of `incoming_bytes` fits in the workspace quota.
+
+        Returns:
+            (allowed: bool, message: str)
+        """
+        usage = self.usage(workspace)
+        if usage["files"] >= self.quota.max_files:
+            return False, f"Total {usage['files']} uploaded.\n Cannot upload more than {self.quota.max_files} files."
+
+        if usage["bytes"] + incoming_bytes > self.quota.max_bytes:
+            return False, f"Storage quota of {self.quota.max_bytes // (1024 * 1024)} MB reached."
+
+        return True, ""
+
+    def remaining_bytes(self, workspace: str) -> int:
+        """Returns how many bytes of uploads the workspace can still store."""
+
+        return max(self.quota.max_bytes - self.usage(workspace)["bytes"], 0)
+
+    def add_document(self, workspace: str, filename: str, size_bytes: int, content_hash: str | None) -> tuple:
+        """
+        Registers an uploaded document, re-checking the quota in the same transaction so concurrent
+        uploads cannot exceed it.
+
+        Returns:
+            (added: bool, message: str)
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM documents WHERE workspace = ?", (workspace,)
+            ).fetchone()
+            if row[0] >= self.quota.max_files or row[1] + size_bytes > self.quota.max_bytes:
+                return False, "Workspace quota exceeded."
+
+            conn.execute(
+                """INSERT OR REPLACE INTO documents
+                   (workspace, filename, content_hash, size_bytes, index_bytes, uploaded_at, last_accessed, archived)
+                   VALUES (?, ?, ?, ?, 0, ?, ?, 0)""",
+                (workspace, filename, content_hash, size_bytes, now, now)
+            )
+        return True, ""
+
+    def migrate_legacy_uploads(self, workspace: str = DEFAULT_WORKSPACE) -> list:
+        """
+        Moves the PDFs of the flat upload directory of older versions (`uploads/<file>.pdf`) into a workspace
+        and registers them in the index, with their vector stores (`vectorestores/<file>/`). Quotas are not
+        applied: these documents were uploaded already. Files whose name is taken in the workspace stay where
+        they are, with a warning.
+
+        Returns:
+            list: The names of the documents moved.
+        """
+        from utils.parse_cache import file_content_hash
+
+        if not os.path.isdir(self.upload_root):
+            return []
+
+        moved = []
+        with file_lock(os.path.abspath(self.upload_root) + ":migrate"): # Workers start together
+            legacy_files = sorted(name for name in os.listdir(self.upload_root)
+                                  if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(self.upload_root, name)))
+            for filename in legacy_files:
+                target = os.path.join(self.upload_dir(workspace), filename)
+                if os.path.exists(target) or self.get_document(workspace, filename):
+                    logger.warning(f"Not migrating {filename}: the name is already used in workspace {workspace}")
+                    continue
+
+                os.makedirs(self.upload_dir(workspace), exist_ok=True)
+                os.replace(os.path.join(self.upload_root, filename), target)
+                legacy_store = os.path.join(self.vectorstore_root, vectorstore_name(filename))
+                # A store named like the workspace is the workspace directory, that one is rebuilt instead
+                if vectorstore_name(filename) != workspace and os.path.isdir(legacy_store) \
+                        and not os.path.exists(self.vectorstore_path(workspace, filename)):
+                    os.makedirs(self.vectorstore_dir(workspace), exist_ok=True)
+                    os.replace(legacy_store, self.vectorstore_path(workspace, filename))
+
+                now = time.time()
+                with self._connect() as conn:
+                    conn.execute(
+                        """INSERT OR REPLACE INTO documents
+                           (workspace, filename, content_hash, size_bytes, index_bytes, uploaded_at, last_accessed, archived)
+                           VALUES (?, ?, ?, ?, 0, ?, ?, 0)""",
+                        (workspace, filename, file_content_hash(target), os.path.getsize(target), now, now)
+                    )
+                moved.append(filename)
+
+        if moved:
+            logger.info(f"Moved {len(moved)} documents of the flat {self.upload_root}/ directory to workspace {workspace}")
+        return moved
+
+    def remove_document(self, workspace: str, filename: str):
+        """Removes a document from the index. Its files are deleted separately (see `TieredStoreManager.delete`)."""
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE workspace = ? AND filename = ?", (workspace, filename))
+
+    def remove_archive(self, workspace: str, filename: str) -> bool:
+        """Deletes the archived vector store of a document, if any."""
+
+        archive_path = self.archive_path(workspace, filename)
+        if not os.path.exists(archive_path):
+            return False
+        os.remove(archive_path)
+        return True
+
+    def get_document(self, workspace: str, filename: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM documents WHERE workspace = ? AND filename = ?", (workspace, filename)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def has_content(self, content_hash: str) -> bool:
+        """Whether a document of any workspace has this content hash."""
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT 1 FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone()
+        return row is not None
+
+    def list_documents(self, workspace: str) -> list:
+        """Returns the filenames of the documents of a workspace, in upload order."""
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT filename FROM documents WHERE workspace = ? ORDER BY uploaded_at", (workspace,)
+            ).fetchall()
+        return [row["filename"] for row in rows]
+
+    def recent_documents(self, limit: int) -> list:
+        """Returns the (workspace, filename) of the most recently used documents with a live vector store."""
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT workspace, filename FROM documents
+                   WHERE archived = 0 AND index_bytes > 0
+                   ORDER BY last_accessed DESC LIMIT ?""",
+                (limit,)
+            ).fetchall()
+        return [(row["workspace"], row["filename"]) for row in rows]
+
+    def touch(self, workspace: str, filename: str):
+        """Marks a document as recently used."""
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE documents SET last_accessed = ? WHERE workspace = ? AND filename = ?",
+                (time.time(), workspace, filename)
+            )
+
+    def refresh_index_size(self, workspace: str, filename: str) -> int:
+        """Measures the vector store of a document on disk and records its size in the index."""
+
+        index_bytes = directory_size(self.vectorstore_path(workspace, filename))
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE documents SET index_bytes = ? WHERE workspace = ? AND filename = ?",
+                (index_bytes, workspace, filename)
+            )
+        return index_bytes
+
+    # ---------- Archiving ----------
+    def archive_vector_store(self, workspace: str, filename: str) -> bool:
+        """Compresses the vector store of a document to the archive directory and removes it from disk."""
+
+        persist_path = self.vectorstore_path(workspace, filename)
+
+        # The store is closed and must not be read while it is compressed and removed.
+        # Stores in use, here or in another worker, or being deleted are skipped, a later sweep archives them.
+        with get_store_manager().exclusive(persist_path) as is_exclusive, \
+                file_lock(persist_path, blocking=False) as is_unused:
+            if not is_exclusive or not is_unused or not os.path.isdir(persist_path):
+                return False
+
+            archive_path = self.archive_path(workspace, filename)
+            os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+            # Write next to the final archive and rename, so a crash never leaves a truncated archive behind
+            tmp_base = archive_path[:-len(ARCHIVE_EXTENSION)] + ".part"
+            tmp_archive = shutil.make_archive(tmp_base, ARCHIVE_FORMAT, root_dir=persist_path)
+            os.replace(tmp_archive, archive_path)
+            shutil.rmtree(persist_path)
+
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE documents SET archived = 1 WHERE workspace = ? AND filename = ?", (workspace, filename)
+                )
+        logger.info(f"Archived vector store of {workspace}/{filename} to {archive_path}")
+        return True
+
+    def restore_vector_store(self, workspace: str, filename: str) -> bool:
+        """
+        Restores an archived vector store back to the vector store directory.
+
+        Callers hold a reader reference on the store (`TieredStoreManager.acquire` and a shared `file_lock`),
+        so it cannot be archived again or deleted meanwhile. Concurrent readers, in any worker, restore it only once.
+        """
+        persist_path = self.vectorstore_path(workspace, filename)
+        archive_path = self.archive_path(workspace, filename)
+
+        with get_store_manager().path_lock(persist_path), file_lock(persist_path + ":restore"):
+            if not os.path.exists(archive_path):
+                return False
+
+            tmp_path = persist_path + ".restoring"
+            if os.path.isdir(tmp_path):
+                shutil.rmtree(tmp_path)
+            shutil.unpack_archive(archive_path, tmp_path, format=ARCHIVE_FORMAT)
+            if os.path.isdir(persist_path):
+                shutil.rmtree(persist_path)
+            os.replace(tmp_path, persist_path)
+            os.remove(archive_path)
+
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE documents SET archived = 0 WHERE workspace = ? AND filename = ?", (workspace, filename)
+                )
+        logger.info(f"Restored vector store of {workspace}/{filename} from {archive_path}")
+        return True
+
+    def archive_idle(self, idle_seconds: float, exclude_paths: set = frozenset()) -> list:
+        """
+        Archives the vector stores of all workspaces that were not accessed for more than `idle_seconds`.
+
+        Parameters:
+            idle_seconds (float): Minimum idle time before a vector store is archived.
+            exclude_paths (set): Vector store paths that must stay live, e.g. the ones open in memory.
+
+        Returns:
+            list[str]: "<workspace>/<filename>" of the archived documents.
+        """
+        cutoff = time.time() - idle_seconds
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT workspace, filename FROM documents
+                   WHERE archived = 0 AND index_bytes > 0 AND last_accessed < ?""",
+                (cutoff,)
+            ).fetchall()
+
+        archived = []
+        for row in rows:
+            if self.vectorstore_path(row["workspace"], row["filename"]) in exclude_paths:
+                continue
+            if self.archive_vector_store(row["workspace"], row["filename"]):
+                archived.append(f"{row['workspace']}/{row['filename']}")
+
+        return archived
+
+    def enforce_index_quota(self, workspace: str, keep: str | None = None) -> list:
+        """
+        Archives the least recently used vector stores of a workspace until the live ones fit in the quota.
+
+        Parameters:
+            workspace (str): The workspace to check.
+            keep (str, optional): A document that must stay live, usually the one being queried.
+
+        Returns:
+            list[str]: Filenames of the archived documents.
+        """
+        archived = []
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT filename, index_bytes FROM documents
+                   WHERE workspace = ? AND archived = 0 AND index_bytes > 0
+                   ORDER BY last_accessed ASC""",
+                (workspace,)
+            ).fetchall()
+
+        live_bytes = sum(row["index_bytes"] for row in rows)
+        for row in rows:
+            if live_bytes <= self.quota.max_index_bytes:
+                break
+            if row["filename"] == keep:
+                continue
+            if self.archive_vector_store(workspace, row["filename"]):
+                live_bytes -= row["index_bytes"]
+                archived.append(row["filename"])
+
+        return archived
+
+
+def validate_workspace(workspace: str) -> str:
+    """Returns the workspace name if it is safe to use as a directory name, else raises ValueError."""
+
+    if not workspace or not WORKSPACE_PATTERN.fullmatch(workspace):
+        raise ValueError(f"Invalid workspace name: {workspace!r}. Use letters, digits, '-' or '_' only.")
+    return workspace
+
+
+@lru_cache(maxsize=1)
+def get_document_store() -> DocumentStore:
+    """Returns the document store shared by the whole process, with the uploads of older versions moved in."""
+
+    store = DocumentStore()
+    store.migrate_legacy_uploads()
+    return store
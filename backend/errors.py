@@ -0,0 +1,12 @@
+class ServiceError(Exception):
+    """
+    Raised by the service layer for known failures.
+
+    It carries an HTTP-style status code so the FastAPI routes can translate it into an
+    `HTTPException` and the Dash callbacks can show the detail message as is.
+    """
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
@@ -1,75 +1,153 @@
 from backend.vectorstore_chain import load_or_create_vector_store
+from backend.file_ops import UPLOAD_DIRECTORY, VECTORSTORE_DIRECTORY
+from backend.document_store import DEFAULT_WORKSPACE
 import utils.helper_functions as hf
 import backend.schemas as sm
 
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
 import pandas as pd
 
 import asyncio
+import os
+from utils import telemetry
 from utils.logger_config import setup_logger
 
 logger = setup_logger(name="backend_log", log_file="logs/backend.log")
 
-def extract_data(filepath: str, schema_name: str):
-    # Initialize the model
-    model = hf.load_openai_model(model="gpt-4o-mini")
+# OpenAI caches the prompt prefixes it has seen (from 1024 tokens), so every prompt starts with its static text:
+# the system instructions and the schema (tools come first), then the document context, then the question.
+# Prompts sharing a prefix also share a `prompt_cache_key`, which routes them to the same cache; empty disables it.
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "rfp")
 
-    # load or create a vector store 
-    store = asyncio.run(load_or_create_vector_store(filepath=filepath))
+EXTRACTION_INSTRUCTIONS = """You are an Expert RFP / EOI paser who can extract the needfull information
+from any RFP/EOI document efficiently and accurately.
+
+🔒 Rules:
+- Only use the provided context — do not assume or hallucinate values.
+- If a field is not clearly stated, return `null`.
+- Prefer values that are closest to definitions provided.
+NOTE THAT YOU ONLY USE THE CONTEXT provided to you TO ANSWER THE QUERY.
+
+Information to extract:
+{schema_fields}"""
+
+RAG_INSTRUCTIONS = """You are a helpful assistant. You answers the user query in a very professional way
+and succinct way, using only the provided context.
+IF YOU DONT HAVE ENOUGH CONTEXT TO ANSWER THE QUERY THEN JUST SAY
+'I do not that enough context to answer your question.' And do not
+assume anything. May be you can ask a followup question whenever is appropriate"""
+
+CONVERSATION_INSTRUCTIONS = """You are a helpful assistant answering questions about an RFP / EOI document, in a
+very professional and succinct way, in a conversation with the user. Answer the last question
+using only the provided context and the conversation so far.
+IF YOU DONT HAVE ENOUGH CONTEXT TO ANSWER THE QUESTION THEN JUST SAY
+'I do not have enough context to answer your question.' And do not assume anything."""
+
+SUMMARY_INSTRUCTIONS = """Update the summary of a conversation between a user and an assistant about an RFP / EOI
+document with its next turns. Keep the questions asked and the facts, figures, names and dates
+of the answers; drop everything else. Write at most {max_words} words."""
+
+
+def _with_prompt_cache_key(model, prompt_name: str):
+    """Binds the `prompt_cache_key` of a prompt to the model, so OpenAI routes its calls to the same prompt cache."""
+
+    if not PROMPT_CACHE_KEY:
+        return model
+    return model.bind(extra_body={"prompt_cache_key": f"{PROMPT_CACHE_KEY}-{prompt_name}"})
+
+def _pre_extracted_notes(resolved: dict, ambiguous: dict) -> str:
+    """
+    Describes the pre-extracted values for the extraction prompt: the resolved fields, then the candidates
+    of the ambiguous ones, one line per field. Empty without any.
+    """
+    sections = []
+    if resolved:
+        sections.append("Values found in the document by pattern matching, keep them:\n" +
+                        "\n".join(f"- {field}: \"{value}\"" for field, value in resolved.items()))
+    if ambiguous:
+        sections.append("Candidate values found in the document by pattern matching, pick the right one if any:\n" +
+                        "\n".join(f"- {field}: " + ", ".join(f"\"{candidate['value']}\" (page {candidate['page']})"
+                                                              for candidate in candidates)
+                                  for field, candidates in ambiguous.items()))
+    return "\n\n".join(sections)
+
+
+def extract_data(filepath: str, 
+                 schema_name: str, 
+                 upload_dir: str = UPLOAD_DIRECTORY, 
+                 vectorstore_dir: str = VECTORSTORE_DIRECTORY,
+                 workspace: str = DEFAULT_WORKSPACE,
+                 candidates: list | None = None):
+    """
+    Extracts the fields of a schema from a document with the LLM, over the ten chunks most relevant to them.
+
+    With the rule-based pre-extraction `candidates` of the document (see `utils.pre_extraction`), the fields
+    they resolve are listed to the LLM after the context, with the candidates of the others as hints, and
+    override its answer. The schema and the instructions stay the same for every document, so the prompt
+    prefix stays cached. When the candidates resolve every field, neither the vector store nor the LLM is used.
+    """
+    from utils.pre_extraction import resolve_fields
 
     # Select the schema
-    if schema_name.lower() == "keydates":
-        schema = sm.RFPKeyDates
-    elif schema_name.lower() == "contact":
-        schema = sm.RFPClientContactDetails
-    elif schema_name.lower() == "submission":
-        schema = sm.RFPSubmissionDetails
-    elif schema_name.lower() == "procurement":
-        schema = sm.RFPProcurementInformation
-    elif schema_name.lower() == "project":
-        schema = sm.RFPProjectInformation
-    else:
+    schema = sm.SCHEMAS.get(schema_name.lower())
+    if schema is None:
         raise ValueError(f"Unknown schema name: {schema_name}")
-    
 
-    extraction_prompt = PromptTemplate( 
-        input_variables = ["context"],
-        template="""You are an Expert RFP / EOI paser who can extract the needfull information
-                    from any RFP/EOI document efficiently and accurately.
+    resolved, ambiguous = resolve_fields(candidates or [], schema_name)
+    columns = [{"name": "Items", "id": "Key"}, {'name': "Value", "id": "Value"}]
+    if all(name in resolved for name in schema.model_fields):
+        telemetry.increment("pre_extracted_fields_total", len(resolved), source="rules")
+        logger.info(f"All the {schema_name} fields of {filepath} pre-extracted, no LLM call")
+        return [{"Key": name, "Value": resolved[name]} for name in schema.model_fields], columns
 
-                    🔒 Rules:
-                    - Only use the provided context — do not assume or hallucinate values.
-                    - If a field is not clearly stated, return `null`.
-                    - Prefer values that are closest to definitions provided.
-                    NOTE THAT YOU ONLY USE THE CONTEXT {context} provided to you TO ANSWER THE QUERY,
+    # Initialize the model
+    model_name = "gpt-4o-mini"
+    model = hf.load_openai_model(model=model_name)
+
+    # load or create a vector store 
+    store = asyncio.run(load_or_create_vector_store(filepath=filepath, vectorstore_dir=vectorstore_dir, upload_dir=upload_dir,
+                                                    workspace=workspace))
 
-                    """
-        )
+    # Static instructions and fields first, the same for every document, then the retrieved context and,
+    # after it, the pre-extracted values, which differ from one document to the next
+    schema_fields = hf.extract_basemodel_field_and_description(schema)
+    notes = _pre_extracted_notes(resolved, ambiguous)
+    extraction_prompt = ChatPromptTemplate.from_messages([
+        ("system", EXTRACTION_INSTRUCTIONS),
+        ("human", "Context:\n{context}" + ("\n\n{pre_extracted}" if notes else "")),
+    ]).partial(schema_fields=schema_fields, **({"pre_extracted": notes} if notes else {}))
 
     query = f"""Extract the relavant documents from a retriever to include the accurate information
                 about following:
-                {hf.extract_basemodel_field_and_description(schema)}
+                {schema_fields}
                 """
     
     # Create a retriever 
     retriever = hf.create_retriever_from_store(store, k=10)
     extraction_chain = (
-        retriever | 
+        telemetry.traced_runnable("retrieve", retriever) | 
         RunnableLambda(hf.combine_all_relevant_chunks_text) |
         extraction_prompt |
-        model.bind_tools([schema])
+        telemetry.traced_runnable("llm", _with_prompt_cache_key(model.bind_tools([schema]), f"extract-{schema_name.lower()}"))
     )
 
     response = extraction_chain.invoke(query)
+    telemetry.count_message_tokens(response, model_name, prompt="extraction")
+    prompt_tokens, cached_tokens = telemetry.prompt_cache_usage(response)
 
     if response.tool_calls:
-        info = response.tool_calls[0]['args']
+        # The resolved values win over the answer of the LLM, in the order of the schema
+        info = {**response.tool_calls[0]['args'], **resolved}
+        info = {**{name: info[name] for name in schema.model_fields if name in info}, **info}
+        telemetry.increment("pre_extracted_fields_total", len(resolved), source="rules")
+        telemetry.increment("pre_extracted_fields_total", len(schema.model_fields) - len(resolved), source="llm")
         df = pd.DataFrame(list(info.items()), columns=["Key", "Value"])
-        logger.info("Information successfully extracted!")
-        return  df.to_dict('records'), [{"name": "Items", "id": "Key"}, {'name': "Value", "id": "Value"}]
+        logger.info(f"Information successfully extracted! {len(resolved)} fields pre-extracted, "
+                    f"{cached_tokens}/{prompt_tokens} prompt tokens cached "
+                    f"{telemetry.format_trace(telemetry.current_trace())}")
+        return  df.to_dict('records'), columns
     else: 
         df = pd.DataFrame([{"Error": "No relevant information found"}])
         logger.error("Extraction failed!")
@@ -77,36 +155,149 @@ def extract_data(filepath: str, schema_name: str):
 
 
 
-def run_rag(filepath, user_query):
+def run_rag(filepath, 
+            user_query, 
+            upload_dir: str = UPLOAD_DIRECTORY, 
+            vectorstore_dir: str = VECTORSTORE_DIRECTORY,
+            metadata_filter: dict | None = None,
+            workspace: str = DEFAULT_WORKSPACE,
+            k: int = 5,
+            model_name: str = "gpt-4o-mini"):
 
-    store = asyncio.run(load_or_create_vector_store(filepath=filepath))
-    model = hf.load_openai_model()
+    store = asyncio.run(load_or_create_vector_store(filepath=filepath, vectorstore_dir=vectorstore_dir, upload_dir=upload_dir,
+                                                    workspace=workspace))
+    model = hf.load_openai_model(model=model_name)
 
-    rag_template = PromptTemplate(
-        template="""You are a helpful assistant. You answers the user query using" 
-        in a very professional way and succinct way. You answer the query {user_query} using
-        only form the provided context:
-        {context}.
-        IF YOU DONT HAVE ENOUGH CONTEXT TO ANSWER THE QUERY THEN JUST SAY 
-        'I do not that enough context to answer your question.' And do not 
-        assume anything. May be you can ask a followup question whenever is appropriate""",
-        input_variables=['context', 'user_query']
-        )
+    # Static instructions first, then the context, the question last
+    rag_template = ChatPromptTemplate.from_messages([
+        ("system", RAG_INSTRUCTIONS),
+        ("human", "Context:\n{context}\n\nQuery: {user_query}"),
+    ])
     
   
-    retriever = hf.create_retriever_from_store(store, k=5)
+    # Narrow the search to some pages, sections or content types, if asked to
+    retriever = hf.create_retriever_from_store(store, k=k, metadata_filter=metadata_filter)
     augment_query = RunnableParallel({
-        "context": retriever | RunnableLambda(hf.combine_all_relevant_chunks_text),
+        "context": telemetry.traced_runnable("retrieve", retriever) | RunnableLambda(hf.combine_all_relevant_chunks_text),
         "user_query": RunnablePassthrough()
 
     })
             
-    rag_chain = augment_query | rag_template | model | StrOutputParser()
-    result = rag_chain.invoke(user_query)
+    rag_chain = augment_query | rag_template | telemetry.traced_runnable("llm", _with_prompt_cache_key(model, "rag"))
+    response = rag_chain.invoke(user_query)
+    telemetry.count_message_tokens(response, model_name, prompt="rag")
+    prompt_tokens, cached_tokens = telemetry.prompt_cache_usage(response)
+
+    result = response.content
     if result:
-        logger.info("RAG succeded!")
+        logger.info(f"RAG succeded! {cached_tokens}/{prompt_tokens} prompt tokens cached "
+                    f"{telemetry.format_trace(telemetry.current_trace())}")
     else:
         logger.error("RAG failed")
 
     return result
     
+
+
+
+def _format_turns(turns: list) -> str:
+    return "\n\n".join(f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in turns)
+
+
+def run_conversation_turn(filepath: str,
+                          user_query: str,
+                          summary: str = "",
+                          recent_turns: list | None = None,
+                          context: list | None = None,
+                          context_vector: list | None = None,
+                          upload_dir: str = UPLOAD_DIRECTORY,
+                          vectorstore_dir: str = VECTORSTORE_DIRECTORY,
+                          workspace: str = DEFAULT_WORKSPACE) -> dict:
+    """
+    Answers one question of a conversation, see `backend.conversations`.
+
+    The chunks of the previous turn are re-used when the question is a follow-up on the same topic,
+    otherwise they are retrieved for the question. The question is embedded once, for both.
+
+    Parameters:
+        summary (str): Summary of the older turns of the conversation.
+        recent_turns (list): The last turns, as {"question", "answer"}, oldest first.
+        context (list): Chunks of the current topic, as {"page_content", "metadata"}.
+        context_vector (list): Embedding of the question the chunks were retrieved for.
+
+    Returns:
+        dict: {"answer": str, "reused_context": bool, "context": list | None, "context_vector": list | None},
+            the context being the freshly retrieved chunks and question vector, None when they were re-used.
+    """
+    from langchain_core.documents import Document
+    from backend.conversations import is_follow_up
+
+    store = asyncio.run(load_or_create_vector_store(filepath=filepath, vectorstore_dir=vectorstore_dir, upload_dir=upload_dir,
+                                                    workspace=workspace))
+    model_name = "gpt-4o-mini"
+    model = hf.load_openai_model(model=model_name)
+
+    query_vector = hf.load_embedding_model().embed_query(user_query)
+    reused_context = bool(context) and is_follow_up(query_vector, context_vector)
+    if reused_context:
+        chunks = [Document(page_content=chunk["page_content"], metadata=chunk["metadata"]) for chunk in context]
+    else:
+        with telemetry.span("retrieve"):
+            chunks = store.max_marginal_relevance_search_by_vector(query_vector, k=5)
+    telemetry.increment("conversation_turns_total", context="reused" if reused_context else "retrieved")
+
+    # The context comes right after the instructions: follow-ups answered from the same chunks share that whole
+    # prefix, and only the summary, the last turns and the question change
+    conversation_template = ChatPromptTemplate.from_messages([
+        ("system", CONVERSATION_INSTRUCTIONS),
+        ("human", "Context:\n{context}\n\nSummary of the earlier conversation:\n{summary}\n\n"
+                  "Last turns of the conversation:\n{history}\n\nQuestion: {user_query}"),
+    ])
+
+    chain = conversation_template | telemetry.traced_runnable("llm", _with_prompt_cache_key(model, "conversation"))
+    response = chain.invoke({
+        "summary": summary or "(none)",
+        "history": _format_turns(recent_turns or []) or "(none)",
+        "context": hf.combine_all_relevant_chunks_text(chunks),
+        "user_query": user_query,
+    })
+    telemetry.count_message_tokens(response, model_name, prompt="conversation")
+    prompt_tokens, cached_tokens = telemetry.prompt_cache_usage(response)
+    logger.info(f"Conversation turn answered, context {'re-used' if reused_context else 'retrieved'}! "
+                f"{cached_tokens}/{prompt_tokens} prompt tokens cached "
+                f"{telemetry.format_trace(telemetry.current_trace())}")
+
+    return {
+        "answer": response.content,
+        "reused_context": reused_context,
+        "context": None if reused_context else [{"page_content": chunk.page_content, "metadata": chunk.metadata}
+                                               for chunk in chunks],
+        "context_vector": None if reused_context else list(query_vector),
+    }
+
+
+def summarize_conversation(summary: str, turns: list, max_tokens: int = 300) -> str:
+    """
+    Folds turns of a conversation into its running summary.
+
+    Parameters:
+        summary (str): The current summary, empty at first.
+        turns (list): The turns to add, as {"question", "answer"}, oldest first.
+        max_tokens (int): Length limit of the new summary.
+
+    Returns:
+        str: The new summary.
+    """
+    model_name = "gpt-4o-mini"
+    model = hf.load_openai_model(model=model_name)
+
+    summary_template = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_INSTRUCTIONS),
+        ("human", "Current summary:\n{summary}\n\nNext turns:\n{turns}\n\nUpdated summary:"),
+    ])
+
+    chain = summary_template | telemetry.traced_runnable("summarize", _with_prompt_cache_key(model, "summary").bind(max_tokens=max_tokens))
+    response = chain.invoke({"summary": summary or "(none)", "turns": _format_turns(turns),
+                             "max_words": int(max_tokens * 0.75)})
+    telemetry.count_message_tokens(response, model_name, prompt="summary")
+    return response.content.strip()
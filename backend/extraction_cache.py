@@ -0,0 +1,184 @@
+"""
+Cache of the schema extractions, keyed by the content hash of the document and the schema name.
+
+An extraction is an LLM call over ten retrieved chunks; its result only depends on the document and the
+schema, so it is stored once and re-used by `/extract-data/` and by the query router (see
+`backend.query_router`), which answers questions such as "what is the RFP number?" from it. Identical
+files uploaded under different names or in different workspaces share their entries, like the parse cache.
+
+The candidates of the rule-based pre-extraction (see `utils.pre_extraction`) are stored next to them, once
+per content hash, when the document is parsed, and so are the extractions being precomputed in the
+background (see `backend.precompute`), which every worker sees as pending.
+"""
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator
+
+from backend.document_store import INDEX_PATH
+from utils.pre_extraction import PRE_EXTRACTION_VERSION
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", INDEX_PATH)
+
+# Bump when the extraction prompts or schemas change, so stale entries are ignored
+EXTRACTION_VERSION = 3
+
+TABLE_COLUMNS = [{"name": "Items", "id": "Key"}, {"name": "Value", "id": "Value"}]
+
+
+def fields_from_rows(rows: list) -> dict | None:
+    """Returns the extracted {field: value} of an extraction table, None for the "no information found" table."""
+
+    if not rows or "Key" not in rows[0]:
+        return None
+    return {row["Key"]: row.get("Value") for row in rows}
+
+
+def rows_from_fields(fields: dict) -> list:
+    """Returns the rows of the extraction table of {field: value}, for a Dash DataTable with `TABLE_COLUMNS`."""
+
+    return [{"Key": key, "Value": value} for key, value in fields.items()]
+
+
+class ExtractionCache:
+    """Extracted fields per (content hash, schema), in a small SQLite database (the document index by default)."""
+
+    def __init__(self, index_path: str = EXTRACTION_CACHE_PATH):
+        self.index_path = index_path
+        self._create_index()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Opens a connection to the index, commits on success and always closes it."""
+
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_index(self):
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS extractions (
+                    content_hash  TEXT    NOT NULL,
+                    schema_name   TEXT    NOT NULL,
+                    version       INTEGER NOT NULL,
+                    fields        TEXT    NOT NULL,
+                    created_at    REAL    NOT NULL,
+                    PRIMARY KEY (content_hash, schema_name)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS candidates (
+                    content_hash  TEXT    PRIMARY KEY,
+                    version       INTEGER NOT NULL,
+                    candidates    TEXT    NOT NULL,
+                    created_at    REAL    NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pending_extractions (
+                    content_hash  TEXT    NOT NULL,
+                    schema_name   TEXT    NOT NULL,
+                    started_at    REAL    NOT NULL,
+                    PRIMARY KEY (content_hash, schema_name)
+                )
+            """)
+
+    def get(self, content_hash: str, schema_name: str) -> dict | None:
+        """Returns the cached {field: value} of a schema, or None."""
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT fields FROM extractions WHERE content_hash = ? AND schema_name = ? AND version = ?",
+                (content_hash, schema_name.lower(), EXTRACTION_VERSION)
+            ).fetchone()
+        return json.loads(row["fields"]) if row else None
+
+    def get_all(self, content_hash: str) -> dict:
+        """Returns the cached fields of all the schemas of a document, as {schema_name: {field: value}}."""
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT schema_name, fields FROM extractions WHERE content_hash = ? AND version = ?",
+                (content_hash, EXTRACTION_VERSION)
+            ).fetchall()
+        return {row["schema_name"]: json.loads(row["fields"]) for row in rows}
+
+    def put(self, content_hash: str, schema_name: str, fields: dict):
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO extractions (content_hash, schema_name, version, fields, created_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (content_hash, schema_name.lower(), EXTRACTION_VERSION, json.dumps(fields, default=str), time.time())
+            )
+
+    def get_candidates(self, content_hash: str) -> list | None:
+        """Returns the pre-extraction candidates of a document content, or None if it was not pre-extracted."""
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT candidates FROM candidates WHERE content_hash = ? AND version = ?",
+                (content_hash, PRE_EXTRACTION_VERSION)
+            ).fetchone()
+        return json.loads(row["candidates"]) if row else None
+
+    def put_candidates(self, content_hash: str, candidates: list):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO candidates (content_hash, version, candidates, created_at) VALUES (?, ?, ?, ?)",
+                (content_hash, PRE_EXTRACTION_VERSION, json.dumps(candidates), time.time())
+            )
+
+    def mark_pending(self, content_hash: str, schema_names: list):
+        """Records that the extractions of `schema_names` are being computed in the background."""
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pending_extractions (content_hash, schema_name, started_at) VALUES (?, ?, ?)",
+                [(content_hash, schema_name.lower(), now) for schema_name in schema_names]
+            )
+
+    def clear_pending(self, content_hash: str, schema_name: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM pending_extractions WHERE content_hash = ? AND schema_name = ?",
+                         (content_hash, schema_name.lower()))
+
+    def pending(self, content_hash: str, max_age: float) -> set:
+        """
+        Returns the schemas whose extraction is being computed in the background. Marks older than `max_age`
+        seconds are ignored: the worker computing them died or gave up.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT schema_name FROM pending_extractions WHERE content_hash = ? AND started_at >= ?",
+                (content_hash, time.time() - max_age)
+            ).fetchall()
+        return {row["schema_name"] for row in rows}
+
+    def delete(self, content_hash: str):
+        """Removes the extractions and candidates of a document content, once no document uses it any more."""
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM extractions WHERE content_hash = ?", (content_hash,))
+            conn.execute("DELETE FROM candidates WHERE content_hash = ?", (content_hash,))
+            conn.execute("DELETE FROM pending_extractions WHERE content_hash = ?", (content_hash,))
+
+
+@lru_cache(maxsize=1)
+def get_extraction_cache() -> ExtractionCache:
+    """Returns the extraction cache shared by the whole process."""
+
+    return ExtractionCache()
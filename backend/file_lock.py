@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+try:
+    import fcntl
+except ImportError: # Windows: gunicorn does not run there either, fall back to locks within the process
+    fcntl = None
+
+LOCK_DIRECTORY = os.getenv("LOCK_DIRECTORY", "locks")
+
+_fallback_locks = {}
+_fallback_guard = threading.Lock()
+
+
+def lock_path(name: str, lock_dir: str = LOCK_DIRECTORY) -> str:
+    """Returns the lock file of `name`, e.g. a vector store path, hashed to a safe file name."""
+
+    return os.path.join(lock_dir, hashlib.sha1(name.encode("utf-8")).hexdigest() + ".lock")
+
+
+@contextmanager
+def file_lock(name: str, shared: bool = False, blocking: bool = True, lock_dir: str = LOCK_DIRECTORY) -> Iterator[bool]:
+    """
+    Locks `name` across all the worker processes (and the threads of each process) for the `with` block.
+
+    Several workers share the same files on disk (vector stores, archives, caches), while the state of
+    `TieredStoreManager` is per process. Code that creates, restores, archives or removes shared files
+    holds this lock, an advisory `flock` on a file of LOCK_DIRECTORY.
+
+    Parameters:
+        name (str): What is locked, usually a vector store path.
+        shared (bool): Take a shared (reader) lock instead of an exclusive one.
+        blocking (bool): If False, do not wait: yield False when the lock is taken elsewhere.
+
+    Yields:
+        bool: True when the lock is held.
+    """
+    if fcntl is None:
+        with _fallback_guard:
+            lock = _fallback_locks.setdefault(name, threading.RLock())
+        # Without flock, shared locks are exclusive too
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+
+    os.makedirs(lock_dir, exist_ok=True)
+    # A new file description per call, so threads of the same process exclude each other too
+    fd = os.open(lock_path(name, lock_dir), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(fd, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
@@ -1,87 +1,153 @@
 import os 
 import shutil
-import time
-import gc
+import base64
+import hashlib
+import tempfile
+from typing import Iterable, Iterator
 
 UPLOAD_DIRECTORY = "uploads"
 VECTORSTORE_DIRECTORY ="vectorestores"
+INCOMING_DIRECTORY = ".incoming" # Temporary files of in progress uploads, inside UPLOAD_DIRECTORY
 
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 200 * 1024 * 1024))
 
-def save_uploaded_file(file_bytes: str, filename: str, max_files: int = 3) -> tuple:
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the allowed size."""
+
+
+def save_uploaded_stream(chunks: Iterable[bytes], 
+                         filename: str, 
+                         upload_dir: str = UPLOAD_DIRECTORY, 
+                         max_bytes: int = MAX_UPLOAD_BYTES) -> tuple:
     """
-    Saves a PDF file if conditions are met. Returns status as a tuple.
+    Saves a PDF file from an iterable of byte chunks without holding the whole file in memory.
+
+    The chunks are written to a temporary file inside the upload directory while the sha256
+    content hash is computed incrementally. The upload is aborted as soon as it exceeds `max_bytes`.
+    Once complete, the temporary file is hard-linked into the upload directory, which atomically fails if
+    the name was taken meanwhile, so a partially written file is never visible to the other functions and
+    two uploads of the same name never overwrite each other.
+
+    Quotas on the number of files are enforced by the document store, not here.
+
+    Parameters:
+        chunks (Iterable[bytes]): The content of the file, chunk by chunk.
+        filename (str): Original name of the uploaded file.
+        upload_dir (str): Directory the file is stored in.
+        max_bytes (int): Maximum size of a single upload in bytes.
 
     Returns:
-        (success: bool, message: str)
+        (success: bool, message: str, content_hash: str | None)
     """
 
-    # Ensure the directory exists
-    os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+    # Ensure the directories exists
+    incoming_dir = os.path.join(upload_dir, INCOMING_DIRECTORY)
+    os.makedirs(incoming_dir, exist_ok=True)
 
     # Sanitize filename BEFORE checking existence
-    safe_filename = filename.replace(" ", "_").replace(",", "")
-    filepath = os.path.join(UPLOAD_DIRECTORY, safe_filename)
-
-    # Create a var to store a all the files in the said directory
-    files = os.listdir(UPLOAD_DIRECTORY)
+    safe_filename = sanitize_filename(filename)
+    filepath = os.path.join(upload_dir, safe_filename)
     
-    # Ensure the number of files in the list is less than than 3 and the file is pdf only.
-    if len(files) >= max_files :
-        return False, f"Total {len(files)} uploaded.\n Cannot upload more than {max_files} files."
-    
-    # File extension check 
-
     # Check if the file is already existed in the directory
-    if safe_filename in files:
-        return False, f"{filename} has been already loaded."
+    if os.path.exists(filepath):
+        return False, f"{filename} has been already loaded.", None
     
-  
+    # File extension check 
     if not filename.lower().endswith(".pdf"):
-        return False, "Only PDF files are accepted"
+        return False, "Only PDF files are accepted", None
     
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_file = tempfile.NamedTemporaryFile(dir=incoming_dir, suffix=".part", delete=False)
     try: 
-        # Create a file path, joining the directory and file name and store in the said dir. 
-        # filepath = os.path.join(UPLOAD_DIRECTORY, filename.replace(" ", "_").replace(",", ""))
-        with open(filepath, "wb") as f:
-            f.write(file_bytes)
+        with tmp_file:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"{filename} is larger than {max_bytes // (1024 * 1024)} MB.")
+                
+                hasher.update(chunk)
+                tmp_file.write(chunk)
+
+        # Claims the name atomically: another request may have stored the same file while this one was
+        # streaming, and a hard link fails instead of replacing it
+        try:
+            os.link(tmp_file.name, filepath)
+        except FileExistsError:
+            return False, f"{filename} has been already loaded.", None
 
         # Return the success message.
-        return True, f"File '{filename}' uploaded successfully!"
-    # If file is different than pdf return failure message.
+        return True, f"File '{filename}' uploaded successfully!", hasher.hexdigest()
+    
+    except UploadTooLargeError as e:
+        return False, str(e), None
+
     except Exception as e:
-        return False, f"Uploaded failed: {str(e)}"
+        return False, f"Uploaded failed: {str(e)}", None
+
+    finally:
+        if os.path.exists(tmp_file.name):
+            os.remove(tmp_file.name)
+
+
+
+def sanitize_filename(filename: str) -> str:
+    """Returns the name under which an uploaded file is stored."""
 
+    return filename.replace(" ", "_").replace(",", "")
 
 
-def cleanup_uploads():
-    for folder in ["uploads", "vectorestores"]:
-        for file in os.listdir(folder):
-            path = os.path.join(folder. file)
-            if os.path.isfile(path):
-                os.remove(path)
 
+def vectorstore_name(filename: str) -> str:
+    """Returns the folder name of the vector store of a document. eg. "uploads/my rfp.pdf" => "my_rfp" """
+
+    return os.path.basename(filename).replace(".pdf", "").replace(" ", "_")
+
+
+
+def iter_file_chunks(file_obj, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yields the content of a binary file object in chunks of `chunk_size` bytes."""
+
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+
+def iter_base64_chunks(content_string: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Decodes a base64 string chunk by chunk, so the decoded file never sits in memory at once.
+
+    The string is sliced in multiples of 4 characters, which always decode independently.
+    """
+
+    step = (chunk_size // 3) * 4
+    for start in range(0, len(content_string), step):
+        yield base64.b64decode(content_string[start:start + step])
 
 
-# This function assumes vectorstore is stored globally or can be accessed
-def unload_vectorstore():
-    global vectorstore  # or access it from wherever you store it
-    try:
-        if vectorstore:
-            del vectorstore
-            gc.collect()  # Forces release of file handles
-            time.sleep(0.5)  # Optional: wait to ensure handles are released
-    except NameError:
-        pass  # If vectorstore wa
 
 def delete_file(filename, upload_dir=UPLOAD_DIRECTORY, vector_dir=VECTORSTORE_DIRECTORY):
-    unload_vectorstore()
+    """
+    Removes an uploaded file and its vector store folder.
+
+    The vector store must not be open: callers go through `TieredStoreManager.delete`, which runs this
+    once the store has no more readers.
+
+    Returns:
+        (deleted: bool, messages: dict | str)
+    """
     file_delete_message = ""
     folder_delete_message = ""
     file_or_folder_found = False
 
     
     filepath = os.path.join(upload_dir, filename)
-    folderpath = os.path.join(vector_dir, filename[:-4])
+    folderpath = os.path.join(vector_dir, vectorstore_name(filename))
 
     if os.path.exists(filepath):
         file_or_folder_found = True
@@ -101,7 +167,7 @@ def delete_file(filename, upload_dir=UPLOAD_DIRECTORY, vector_dir=VECTORSTORE_DI
     
     return True, {
         "file_message": file_delete_message, 
-        "folder_messsage": folder_delete_message
+        "folder_message": folder_delete_message
     }
 
     
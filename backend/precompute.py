@@ -0,0 +1,132 @@
+"""
+Background precomputation of the schema extractions of a freshly uploaded document.
+
+Users open a document and flip through the schemas of the UI right away. With PRECOMPUTE_EXTRACTIONS=true,
+an upload schedules the extraction of every schema in a background thread pool. The first one to start
+parses the document and the others wait for its parse (see `backend.vectorstore_chain.load_candidates`),
+then for its vector store in the same way; each result lands in the extraction cache (see
+`backend.extraction_cache`) and switching schemas only reads it.
+
+At most PRECOMPUTE_CONCURRENCY extractions run at once per worker, and they start at most
+PRECOMPUTE_PER_MINUTE times a minute, so a batch of uploads does not use up the OpenAI rate limit of the
+interactive requests. Until its result is cached, a scheduled schema is "pending" for every worker:
+`/extract-data/` waits for it instead of paying for the same LLM call twice.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from backend.extraction_cache import get_extraction_cache
+from utils import telemetry
+from utils.logger_config import setup_logger, log_context, get_log_context
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+PRECOMPUTE_EXTRACTIONS = os.getenv("PRECOMPUTE_EXTRACTIONS", "false").lower() in ("1", "true", "yes")
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", 2))
+PRECOMPUTE_PER_MINUTE = float(os.getenv("PRECOMPUTE_PER_MINUTE", 30)) # Extractions started per minute, 0 for no limit
+PRECOMPUTE_TIMEOUT_SECONDS = float(os.getenv("PRECOMPUTE_TIMEOUT_SECONDS", 600)) # After that, a pending mark is stale
+PRECOMPUTE_WAIT_SECONDS = float(os.getenv("PRECOMPUTE_WAIT_SECONDS", 120)) # How long a request waits for a pending one
+
+
+class RateLimiter:
+    """Spaces out calls to at most `per_minute` a minute across the threads of the process."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60 / per_minute if per_minute > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the next call is allowed."""
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+@lru_cache(maxsize=1)
+def _precompute_executor() -> ThreadPoolExecutor:
+    # Created on first use, so a forked worker gets its own threads
+    return ThreadPoolExecutor(max_workers=max(PRECOMPUTE_CONCURRENCY, 1), thread_name_prefix="extraction-precompute")
+
+
+@lru_cache(maxsize=1)
+def _rate_limiter() -> RateLimiter:
+    return RateLimiter(PRECOMPUTE_PER_MINUTE)
+
+
+def precompute(filepath: str, schema_name: str, workspace: str, content_hash: str) -> str:
+    """
+    Extracts one schema of a document into the extraction cache, and clears its pending mark either way.
+
+    Returns:
+        str: "done", "cached" when the extraction was cached meanwhile, or "failed".
+    """
+    from backend.document_service import run_extraction
+
+    cache = get_extraction_cache()
+    try:
+        if cache.get(content_hash, schema_name) is not None:
+            return "cached"
+        _rate_limiter().acquire()
+        with telemetry.span("precompute"):
+            run_extraction(filepath, schema_name, workspace, content_hash)
+        return "done"
+    except Exception as e:
+        # Deleted meanwhile, no relevant information, OpenAI errors...: `/extract-data/` tries again on demand
+        logger.warning(f"Precomputing the {schema_name} extraction of {filepath} failed: {getattr(e, 'detail', e)}")
+        return "failed"
+    finally:
+        cache.clear_pending(content_hash, schema_name)
+
+
+def schedule_precompute(filepath: str, workspace: str, content_hash: str, schema_names: list) -> list:
+    """
+    Marks the extractions of a document as pending and runs them in the background, with the log context
+    of the request that scheduled them.
+
+    Returns:
+        list: The schemas scheduled, none when PRECOMPUTE_EXTRACTIONS is off.
+    """
+    if not PRECOMPUTE_EXTRACTIONS:
+        return []
+
+    get_extraction_cache().mark_pending(content_hash, schema_names)
+    fields = get_log_context()
+
+    def run(schema_name: str):
+        with log_context(**fields):
+            result = precompute(filepath, schema_name, workspace, content_hash)
+            telemetry.increment("precomputed_extractions_total", result=result)
+
+    for schema_name in schema_names:
+        _precompute_executor().submit(run, schema_name)
+    logger.info(f"Scheduled the precomputation of {len(schema_names)} extractions of {filepath}")
+    return list(schema_names)
+
+
+def wait_for_extraction(content_hash: str, schema_name: str, timeout: float = PRECOMPUTE_WAIT_SECONDS,
+                        poll_seconds: float = 0.5) -> dict | None:
+    """
+    Waits for a pending extraction to reach the cache.
+
+    Returns:
+        dict | None: The cached fields, None if the extraction is not pending, failed or takes longer than `timeout`.
+    """
+    cache = get_extraction_cache()
+    deadline = time.monotonic() + timeout
+    while True:
+        fields = cache.get(content_hash, schema_name)
+        if fields is not None:
+            return fields
+        if schema_name.lower() not in cache.pending(content_hash, PRECOMPUTE_TIMEOUT_SECONDS):
+            return cache.get(content_hash, schema_name) # Cached between the two reads, or failed
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_seconds)
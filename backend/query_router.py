@@ -0,0 +1,144 @@
+"""
+Routes the questions of `/query-document/` to the cheapest path able to answer them:
+
+- "extraction": the question asks for a field of a schema ("what is the RFP number?", "when is the pre-bid
+  meeting?"). It is answered from the cached extraction of that schema (see `backend.extraction_cache`),
+  without retrieval nor LLM call. If the schema was not extracted yet, or the field is empty, the question
+  goes to the factoid path.
+- "factoid": a short, closed question. It is answered from a small context, FACTOID_K chunks instead of
+  RAG_K, by FACTOID_MODEL, a cheaper model than the RAG_MODEL of the RAG path.
+- "rag": everything else (explanations, summaries, lists, comparisons), the full RAG pipeline.
+
+The routing is a few precompiled regular expressions, it costs microseconds. Every decision is counted in
+the `rfp_query_routes_total{route, requested}` metric.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Tuple
+
+QUERY_ROUTER = os.getenv("QUERY_ROUTER", "true").lower() in ("1", "true", "yes")
+FACTOID_MAX_WORDS = int(os.getenv("FACTOID_MAX_WORDS", 15))
+FACTOID_K = int(os.getenv("FACTOID_K", 2))
+RAG_K = int(os.getenv("RAG_K", 5))
+RAG_MODEL = os.getenv("RAG_MODEL", "gpt-4o-mini")
+FACTOID_MODEL = os.getenv("FACTOID_MODEL", "gpt-4.1-nano") # Cheaper than RAG_MODEL
+
+ROUTE_EXTRACTION = "extraction"
+ROUTE_FACTOID = "factoid"
+ROUTE_RAG = "rag"
+
+Slot = Tuple[Tuple[str, str], ...] # (schema name, field) alternatives, the first one with a value answers
+
+# Questions asking for a schema field. Every route lists slots: the answer needs the first one and adds
+# the others when they have a value (e.g. the time of a date). The specific patterns come first.
+DOC_NUM: Slot = (("keydates", "Document_num"), ("project", "Document_num"), ("contact", "doc_num"),
+                 ("submission", "doc_num"), ("procurement", "doc_num"))
+FIELD_ROUTES = [(re.compile(pattern, re.IGNORECASE), slots) for pattern, slots in [
+    (r"\bpre-?\s?bid\b", ((("keydates", "prebid_meeting_date"),), (("keydates", "prebid_meeting_time"),))),
+    (r"\b(quer(y|ies)|questions?|clarifications?)\b.*\b(deadline|last date|due)\b"
+     r"|\b(deadline|last date)\b.*\b(quer(y|ies)|questions?|clarifications?)\b",
+     ((("keydates", "last_queries_submission_date"),),)),
+    (r"\b(responses?|answers?|replies) to (the )?(quer(y|ies)|questions|clarifications)\b"
+     r"|\bclarifications? (will be )?(issued|provided|published)\b",
+     ((("keydates", "query_response_date"),),)),
+    (r"\bopening date\b|\bwhen (are|will)\b.*\bopened\b", ((("keydates", "opening_date"),),)),
+    (r"\bissu(e|ed|ing) date\b|\bdate of issue\b|\bwhen was\b.*\bissued\b", ((("keydates", "issued_date"),),)),
+    (r"\b(submission|closing|bid|proposal|tender) (deadline|date|time)\b|\bdue date\b|\bdeadline\b"
+     r"|\blast date (to|for) (submit|submission)\b|\bwhen (is|are)\b.*\bdue\b",
+     ((("keydates", "final_submission_date"),), (("keydates", "Final_submission_time"),))),
+    (r"\b(rfp|eoi|rfq|tender|bid|document|reference|ref)\.? ?(no\b\.?|number|num\b|#|id\b)", (DOC_NUM,)),
+    (r"\be-?mail\b", ((("contact", "client_email"),),)),
+    (r"\b(phone|telephone|tel|mobile)\b", ((("contact", "phone_number"),),)),
+    (r"\b(contact person|representative|point of contact|(who|whom) (to|should we|do we) contact)\b",
+     ((("contact", "client_representative_name"),), (("contact", "client_email"),), (("contact", "phone_number"),))),
+    (r"\bwho is the client\b|\b(client|employer|purchaser) name\b|\bname of the (client|employer|purchaser)\b",
+     ((("contact", "client"),),)),
+    (r"\bsubmission address\b|\bwhere (to|do we|should we|must we|can we) submit\b",
+     ((("submission", "submission_address"),),)),
+    (r"\bsubmission (mode|platform)\b|\bhow (to|do we|should we|must we|can we) submit\b"
+     r"|\b(electronic|online|physical) submission\b",
+     ((("submission", "submission_mode"),), (("submission", "submission_platform"),))),
+    (r"\blanguage\b", ((("submission", "submission_language"),),)),
+    (r"\b(number of|how many) (hard |printed )?copies\b", ((("submission", "number_of_copies"),),)),
+    (r"\b(submission|tender|bid|document|processing) fees?\b",
+     ((("submission", "amount_of_submission_fees"), ("submission", "submission_fees_required")),)),
+    (r"\b(procurement|selection) method\b|\bqcbs\b", ((("procurement", "procurement_method"),),)),
+    (r"\bfund(s|ing|ed|er)?\b|\bdonor\b|\bfinanc(ed|ing) (by|agency)\b", ((("procurement", "funding_agency"),),)),
+    (r"\bcontract type\b|\btype of (the )?contract\b", ((("procurement", "contract_type"),),)),
+    (r"\bjoint venture\b|\bjv\b",
+     ((("procurement", "joint_venture_allowed"),), (("procurement", "max_no_of_firms_in_JV"),))),
+    (r"\bsub-?contract", ((("procurement", "subcontracting_allowed"),),)),
+    (r"\bbidding type\b|\b(national|international) (bidding|competition)\b", ((("procurement", "bidding_type"),),)),
+    (r"\bproject (title|name)\b|\b(title|name) of the project\b", ((("project", "project_title"),),)),
+    (r"\bservice type\b|\btype of (the )?services?\b", ((("project", "service_type"),),)),
+    (r"\bproject stage\b|\bstage of the project\b", ((("project", "project_stage"),),)),
+]]
+
+FACTOID_START = re.compile(r"^\s*(what|when|who|whom|where|which|how (much|many|long)|is|are|does|do|can|will)\b",
+                           re.IGNORECASE)
+# Questions needing more than a couple of chunks, whatever their length
+OPEN_ENDED = re.compile(r"\b(summar|evaluat|compar|assess|describ|explain)\w*"
+                        r"|\b(why|overview|difference|list|all|each|every|criteria|requirements?|scope|deliverables"
+                        r"|methodology|approach|pros|cons)\b", re.IGNORECASE)
+
+EMPTY_VALUES = {"", "null", "none", "n/a", "na", "not sure", "not specified", "not mentioned", "unknown"}
+
+
+@dataclass(frozen=True)
+class Route:
+    """Routing decision of a question: its path and, for "extraction", the schema fields answering it."""
+
+    kind: str
+    slots: Tuple[Slot, ...] = ()
+
+    @property
+    def k(self) -> int:
+        """Number of chunks to retrieve on this path."""
+
+        return FACTOID_K if self.kind == ROUTE_FACTOID else RAG_K
+
+
+def route_query(query: str) -> Route:
+    """Classifies a question, see the module docstring."""
+
+    words = len(query.split())
+    if not QUERY_ROUTER or words > FACTOID_MAX_WORDS or OPEN_ENDED.search(query):
+        return Route(ROUTE_RAG)
+
+    for pattern, slots in FIELD_ROUTES:
+        if pattern.search(query):
+            return Route(ROUTE_EXTRACTION, slots)
+
+    return Route(ROUTE_FACTOID) if FACTOID_START.match(query) else Route(ROUTE_RAG)
+
+
+def _has_value(value) -> bool:
+    return value is not None and not (isinstance(value, str) and value.strip().lower() in EMPTY_VALUES) and value != []
+
+
+def _label(field: str) -> str:
+    return field.replace("_", " ").strip().capitalize()
+
+
+def answer_from_extractions(route: Route, extractions: dict) -> str | None:
+    """
+    Answers an "extraction" route from cached extractions.
+
+    Parameters:
+        route (Route): The route of the question.
+        extractions (dict): Cached fields by schema, {schema_name: {field: value}}.
+
+    Returns:
+        str | None: One "Field: value" line per slot with a value, None if the first slot has none.
+    """
+    lines = []
+    for ind, slot in enumerate(route.slots):
+        value = next(((field, extractions[schema][field]) for schema, field in slot
+                      if _has_value(extractions.get(schema, {}).get(field))), None)
+        if value is None:
+            if ind == 0:
+                return None
+            continue
+        lines.append(f"{_label(value[0])}: {value[1]}")
+    return "\n\n".join(lines)
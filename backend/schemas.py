@@ -212,3 +212,13 @@ class RFPProjectInformation(BaseModel):
                               ))
 
 
+
+
+# Schemas by the name used by the API and the UI dropdown
+SCHEMAS = {
+    "keydates": RFPKeyDates,
+    "contact": RFPClientContactDetails,
+    "submission": RFPSubmissionDetails,
+    "procurement": RFPProcurementInformation,
+    "project": RFPProjectInformation,
+}
@@ -0,0 +1,176 @@
+import os
+from functools import lru_cache
+from typing import List, TYPE_CHECKING
+
+from backend.file_ops import VECTORSTORE_DIRECTORY
+from utils.logger_config import setup_logger
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+# "per_document": one Chroma database per document (default), "shared": one database for all the documents
+VECTORSTORE_MODE = os.getenv("VECTORSTORE_MODE", "per_document")
+
+# Workspace names cannot contain dots, so this never clashes with a workspace directory
+SHARED_STORE_DIRECTORY = os.getenv("SHARED_STORE_DIRECTORY", os.path.join(VECTORSTORE_DIRECTORY, ".shared"))
+SHARED_COLLECTION_NAME = "project_rfp_shared"
+
+
+def is_shared_mode() -> bool:
+    return VECTORSTORE_MODE == "shared"
+
+
+def document_id(workspace: str, filename: str) -> str:
+    """Returns the id of a document in the shared collection, unique across workspaces."""
+
+    return f"{workspace}/{os.path.basename(filename)}"
+
+
+def merge_filters(*filters: dict | None) -> dict | None:
+    """Combines Chroma `where` filters with $and, flattening the ones that are already $and."""
+
+    conditions = []
+    for where in filters:
+        if where:
+            conditions.extend(where["$and"] if "$and" in where else [where])
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+@lru_cache(maxsize=1)
+def get_shared_client():
+    """Returns the persistent Chroma client of the shared database, opened once per process."""
+
+    import chromadb
+
+    os.makedirs(SHARED_STORE_DIRECTORY, exist_ok=True)
+    logger.info(f"Opening shared vector store at {SHARED_STORE_DIRECTORY}")
+    return chromadb.PersistentClient(path=SHARED_STORE_DIRECTORY)
+
+
+@lru_cache(maxsize=4)
+def get_shared_vector_store(embedding_model: str = "text-embedding-3-large"):
+    """Returns the LangChain Chroma store over the shared collection, one per embedding model."""
+
+    from langchain_chroma import Chroma
+    from utils.helper_functions import load_embedding_model
+
+    return Chroma(
+        client=get_shared_client(),
+        collection_name=SHARED_COLLECTION_NAME,
+        embedding_function=load_embedding_model(embedding_model),
+    )
+
+
+class PartitionedStore:
+    """
+    A view of the shared vector store restricted to one document: every search gets a `document_id`
+    filter, combined with the caller's own metadata filter. Filtering happens inside Chroma, before
+    the vector search.
+    """
+
+    def __init__(self, store, doc_id: str):
+        self.store = store
+        self.doc_id = doc_id
+
+    @property
+    def partition_filter(self) -> dict:
+        return {"document_id": self.doc_id}
+
+    def as_retriever(self, **kwargs):
+        search_kwargs = dict(kwargs.pop("search_kwargs", {}))
+        search_kwargs["filter"] = merge_filters(self.partition_filter, search_kwargs.get("filter"))
+        return self.store.as_retriever(search_kwargs=search_kwargs, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> List["Document"]:
+        return self.store.similarity_search(query, k=k, filter=merge_filters(self.partition_filter, filter), **kwargs)
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> List["Document"]:
+        return self.store.max_marginal_relevance_search(
+            query, k=k, filter=merge_filters(self.partition_filter, filter), **kwargs
+        )
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, filter: dict | None = None,
+                                                **kwargs) -> List["Document"]:
+        return self.store.max_marginal_relevance_search_by_vector(
+            embedding, k=k, filter=merge_filters(self.partition_filter, filter), **kwargs
+        )
+
+    def __repr__(self):
+        return f"PartitionedStore({self.doc_id!r})"
+
+
+def has_document(doc_id: str, embedding_model: str = "text-embedding-3-large") -> bool:
+    """Checks whether a document already has chunks in the shared collection."""
+
+    collection = get_shared_vector_store(embedding_model)._collection
+    return bool(collection.get(where={"document_id": doc_id}, limit=1, include=[])["ids"])
+
+
+def index_document(chunks: List["Document"], workspace: str, filename: str,
+                   embedding_model: str = "text-embedding-3-large") -> int:
+    """
+    Embeds the chunks of a document into the shared collection, tagged with its workspace and document id.
+    Chunk ids are derived from the document id, so indexing twice overwrites instead of duplicating.
+
+    Returns:
+        int: Number of chunks indexed.
+    """
+    doc_id = document_id(workspace, filename)
+    for ind, chunk in enumerate(chunks):
+        chunk.metadata = {**chunk.metadata, "document_id": doc_id, "workspace": workspace,
+                          "filename": os.path.basename(filename)}
+    ids = [f"{doc_id}#{chunk.metadata.get('chunk_index', ind)}" for ind, chunk in enumerate(chunks)]
+
+    if chunks:
+        get_shared_vector_store(embedding_model).add_documents(chunks, ids=ids)
+    logger.info(f"Indexed {len(chunks)} chunks of {doc_id} in the shared vector store")
+    return len(chunks)
+
+
+async def load_or_index_document(filepath: str, workspace: str, build_chunks,
+                                 embedding_model: str = "text-embedding-3-large") -> PartitionedStore:
+    """
+    Returns the view of a document in the shared store, indexing it first if it is not there yet.
+    Callers serialize concurrent calls for the same document, across workers: `load_or_create_vector_store`
+    holds `file_lock(persist_path + ":build")` around it.
+
+    Parameters:
+        filepath (str): Name of the PDF file.
+        workspace (str): Workspace that owns the document.
+        build_chunks: Runnable turning `filepath` into chunks (parsing and splitting).
+        embedding_model (str): Name of the OpenAI embedding model.
+    """
+    doc_id = document_id(workspace, filepath)
+    if not has_document(doc_id, embedding_model):
+        chunks = await build_chunks.ainvoke(filepath)
+        index_document(chunks, workspace, filepath, embedding_model)
+
+    return PartitionedStore(get_shared_vector_store(embedding_model), doc_id)
+
+
+def delete_document_vectors(workspace: str, filename: str, embedding_model: str = "text-embedding-3-large"):
+    """Removes all the chunks of a document from the shared collection."""
+
+    doc_id = document_id(workspace, filename)
+    get_shared_vector_store(embedding_model)._collection.delete(where={"document_id": doc_id})
+    logger.info(f"Removed {doc_id} from the shared vector store")
+
+
+def search_documents(query: str, workspace: str, filenames: List[str] | None = None, k: int = 10,
+                     metadata_filter: dict | None = None, embedding_model: str = "text-embedding-3-large") -> List["Document"]:
+    """
+    Searches all the documents of a workspace, or some of them, with a single query on the shared collection.
+
+    Returns:
+        List["Document"]: The k most similar chunks, with their "filename" and page metadata.
+    """
+    where = {"workspace": workspace}
+    if filenames:
+        where = {"document_id": {"$in": [document_id(workspace, filename) for filename in filenames]}}
+
+    store = get_shared_vector_store(embedding_model)
+    return store.similarity_search(query, k=k, filter=merge_filters(where, metadata_filter))
@@ -0,0 +1,318 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterator
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+STORE_MAX_OPEN = int(os.getenv("STORE_MAX_OPEN", 16))
+STORE_COLD_AFTER_SECONDS = float(os.getenv("STORE_COLD_AFTER_SECONDS", 15 * 60))
+STORE_ARCHIVE_AFTER_SECONDS = float(os.getenv("STORE_ARCHIVE_AFTER_SECONDS", 7 * 24 * 3600))
+STORE_SWEEP_INTERVAL_SECONDS = float(os.getenv("STORE_SWEEP_INTERVAL_SECONDS", 5 * 60))
+
+
+def release_vector_store(persist_path: str):
+    """
+    Stops the Chroma system bound to `persist_path`, which closes its SQLite connections.
+
+    Chroma caches one system per persist directory for the whole process, so dropping the `Chroma`
+    object alone does not release the files. The system is removed from the cache as well, so the
+    next open starts a fresh one.
+    """
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+    except ImportError:
+        try:
+            from chromadb.api.client import SharedSystemClient
+        except ImportError:
+            return
+
+    system = SharedSystemClient._identifier_to_system.pop(persist_path, None)
+    if system is not None:
+        try:
+            system.stop()
+        except Exception as e:
+            logger.warning(f"Could not stop vector store system of {persist_path}: {str(e)}")
+
+
+# Main file of a vector store per backend, rewritten only when the store is built or restored
+STORE_MAIN_FILES = ("chroma.sqlite3", "flat_index.json")
+
+
+def _store_identity(persist_path: str):
+    """
+    Identifies the files currently at `persist_path`. It changes when another worker archives and
+    restores the store: the inode may be re-used, but the change time of the main file is the restore time.
+    """
+    for name in STORE_MAIN_FILES + ("",):
+        try:
+            stat = os.stat(os.path.join(persist_path, name))
+        except OSError:
+            continue
+        return stat.st_dev, stat.st_ino, stat.st_ctime_ns
+    return None
+
+
+class DocumentDeletedError(Exception):
+    """Raised when a document is accessed while, or after, it is being deleted."""
+
+
+class TieredStoreManager:
+    """
+    Keeps per-document vector stores in three tiers:
+
+    - hot: recently used stores stay open in memory, up to `max_open` of them (LRU).
+    - cold: stores idle for more than `cold_after` seconds are closed, they stay on disk.
+    - archived: stores idle for more than `archive_after` seconds are compressed by the document store
+      and rehydrated by it on the next query.
+
+    Idle stores are swept opportunistically, at most once every `sweep_interval` seconds, in a
+    background thread so requests never wait on compression.
+
+    The manager also reference-counts the readers of every store (`acquire`). A store that is in use
+    is never closed, archived or deleted under its readers: `exclusive` skips it and `delete` marks it
+    with a tombstone and leaves the files to be reclaimed by its last reader. New readers of a
+    tombstoned store fail fast with `DocumentDeletedError` instead of opening or recreating it.
+    """
+
+    def __init__(self,
+                 max_open: int = STORE_MAX_OPEN,
+                 cold_after: float = STORE_COLD_AFTER_SECONDS,
+                 archive_after: float = STORE_ARCHIVE_AFTER_SECONDS,
+                 sweep_interval: float = STORE_SWEEP_INTERVAL_SECONDS):
+        self.max_open = max_open
+        self.cold_after = cold_after
+        self.archive_after = archive_after
+        self.sweep_interval = sweep_interval
+
+        self._stores = OrderedDict() # persist_path -> [store, last_used, store identity]
+        self._refs = {}              # persist_path -> number of in-flight readers
+        self._exclusive = set()      # persist_paths being archived
+        self._tombstones = set()     # persist_paths being deleted
+        self._pending_reclaim = {}   # persist_path -> callable deleting the files once the last reader leaves
+        self._path_locks = {}        # persist_path -> lock serializing archive restores
+
+        self._lock = threading.RLock()
+        self._released = threading.Condition(self._lock)
+        self._last_sweep = time.monotonic()
+        self._sweeping = False
+
+    # ---------- Readers ----------
+    @contextmanager
+    def acquire(self, persist_path: str) -> Iterator[None]:
+        """
+        Registers a reader of a store for the duration of the `with` block.
+
+        Waits while the store is being archived and raises `DocumentDeletedError` if it is being deleted.
+        """
+        with self._released:
+            while persist_path in self._exclusive:
+                self._released.wait()
+            if persist_path in self._tombstones:
+                raise DocumentDeletedError(f"{persist_path} is being deleted.")
+            self._refs[persist_path] = self._refs.get(persist_path, 0) + 1
+
+        try:
+            yield
+        finally:
+            self._release(persist_path)
+
+    def _release(self, persist_path: str):
+        reclaim = None
+        with self._released:
+            self._refs[persist_path] -= 1
+            if self._refs[persist_path] == 0:
+                del self._refs[persist_path]
+                reclaim = self._pending_reclaim.pop(persist_path, None)
+                self._released.notify_all()
+
+        # The last reader of a deleted store reclaims its files
+        if reclaim is not None:
+            self._reclaim(persist_path, reclaim)
+
+    def in_use(self, persist_path: str) -> bool:
+        with self._lock:
+            return self._refs.get(persist_path, 0) > 0
+
+    def path_lock(self, persist_path: str) -> threading.Lock:
+        """Returns a lock dedicated to `persist_path`, used to restore an archive only once."""
+
+        with self._lock:
+            return self._path_locks.setdefault(persist_path, threading.Lock())
+
+    # ---------- Open stores ----------
+    def get(self, persist_path: str):
+        """Returns the open store of `persist_path`, or None if it is not hot."""
+
+        self.maybe_sweep()
+        with self._lock:
+            entry = self._stores.get(persist_path)
+            if entry is None:
+                return None
+            if entry[2] == _store_identity(persist_path):
+                entry[1] = time.monotonic()
+                self._stores.move_to_end(persist_path)
+                return entry[0]
+
+            # Another worker archived and restored the store: the open handle points to removed files
+            del self._stores[persist_path]
+
+        release_vector_store(persist_path)
+        logger.info(f"Dropped stale vector store {persist_path}, its files were replaced by another worker")
+        return None
+
+    def put(self, persist_path: str, store):
+        """Keeps a freshly opened store hot, closing the least recently used idle ones above `max_open`."""
+
+        evicted = []
+        with self._lock:
+            self._stores[persist_path] = [store, time.monotonic(), _store_identity(persist_path)]
+            self._stores.move_to_end(persist_path)
+
+            # Stores with in-flight readers are never closed, even if it means going over max_open
+            for path in list(self._stores):
+                if len(self._stores) <= self.max_open:
+                    break
+                if path != persist_path and not self._refs.get(path):
+                    del self._stores[path]
+                    evicted.append(path)
+
+        for path in evicted:
+            release_vector_store(path)
+            logger.info(f"Closed vector store {path} (LRU)")
+
+    def _close(self, persist_path: str) -> bool:
+        """Closes a store if it is open. Callers must make sure it has no readers."""
+
+        with self._lock:
+            entry = self._stores.pop(persist_path, None)
+        if entry is None:
+            return False
+        release_vector_store(persist_path)
+        return True
+
+    def hot_paths(self) -> set:
+        with self._lock:
+            return set(self._stores)
+
+    def close_idle(self) -> list:
+        """Closes the stores that were not used for more than `cold_after` seconds and have no readers."""
+
+        cutoff = time.monotonic() - self.cold_after
+        closed = []
+        with self._lock:
+            idle = [path for path, (_, last_used, _) in self._stores.items()
+                    if last_used < cutoff and not self._refs.get(path)]
+            for path in idle:
+                del self._stores[path]
+                closed.append(path)
+
+        for path in closed:
+            release_vector_store(path)
+            logger.info(f"Closed idle vector store {path}")
+        return closed
+
+    # ---------- Archiving and deletion ----------
+    @contextmanager
+    def exclusive(self, persist_path: str) -> Iterator[bool]:
+        """
+        Gives exclusive access to the files of a store, e.g. to archive it.
+
+        Yields False without waiting if the store has readers or is being deleted, so callers can
+        skip it. Otherwise the store is closed, new readers wait until the block exits, and True is yielded.
+        """
+        with self._lock:
+            available = (not self._refs.get(persist_path)
+                         and persist_path not in self._tombstones
+                         and persist_path not in self._exclusive)
+            if available:
+                self._exclusive.add(persist_path)
+
+        if not available:
+            yield False
+            return
+
+        try:
+            self._close(persist_path)
+            yield True
+        finally:
+            with self._released:
+                self._exclusive.discard(persist_path)
+                self._released.notify_all()
+
+    def delete(self, persist_path: str, reclaim: Callable[[], None], timeout: float = 0) -> str:
+        """
+        Deletes a store safely.
+
+        The store is tombstoned first, so new readers fail fast. Then, if it has no readers within
+        `timeout` seconds, it is closed and `reclaim` (which removes the files) runs right away.
+        Otherwise `reclaim` runs when the last reader leaves.
+
+        Returns:
+            str: "deleted" if the files were removed, "pending" if they will be removed by the last reader.
+        """
+        with self._released:
+            self._tombstones.add(persist_path)
+            is_free = self._released.wait_for(
+                lambda: not self._refs.get(persist_path) and persist_path not in self._exclusive,
+                timeout=timeout
+            )
+            if not is_free:
+                self._pending_reclaim[persist_path] = reclaim
+                logger.info(f"Deletion of {persist_path} deferred until its readers finish")
+                return "pending"
+
+        self._reclaim(persist_path, reclaim)
+        return "deleted"
+
+    def _reclaim(self, persist_path: str, reclaim: Callable[[], None]):
+        try:
+            self._close(persist_path)
+            reclaim()
+        except Exception as e:
+            logger.error(f"Could not reclaim {persist_path}: {str(e)}")
+        finally:
+            with self._lock:
+                self._tombstones.discard(persist_path)
+                self._path_locks.pop(persist_path, None)
+
+    # ---------- Sweeping ----------
+    def sweep(self):
+        """Closes idle stores and archives the very cold ones."""
+
+        from backend.document_store import get_document_store
+
+        self.close_idle()
+        get_document_store().archive_idle(self.archive_after, exclude_paths=self.hot_paths())
+
+    def maybe_sweep(self):
+        """Starts a background sweep if the last one is older than `sweep_interval`."""
+
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._sweeping = True
+
+        threading.Thread(target=self._run_sweep, name="store-sweep", daemon=True).start()
+
+    def _run_sweep(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            logger.error(f"Vector store sweep failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._last_sweep = time.monotonic()
+                self._sweeping = False
+
+
+@lru_cache(maxsize=1)
+def get_store_manager() -> TieredStoreManager:
+    """Returns the store manager shared by the whole process."""
+
+    return TieredStoreManager()
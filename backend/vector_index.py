@@ -0,0 +1,365 @@
+import json
+import mmap
+import os
+import tempfile
+from collections.abc import Sequence
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+# "chroma": one Chroma database per document (default), "flat": in-process NumPy index, see `FlatVectorIndex`
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_BACKENDS = ("chroma", "flat")
+
+FLAT_INDEX_VERSION = 2
+FLAT_HEADER_FILE = "flat_index.json"
+FLAT_EMBEDDINGS_FILE = "embeddings.npy"
+FLAT_TEXTS_FILE = "texts.bin"
+FLAT_METADATA_FILE = "metadata.bin"
+FLAT_OFFSETS_FILE = "offsets.npy"
+
+
+# ---------- Metadata filters ----------
+_OPERATORS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+
+def matches_filter(metadata: dict, where: dict | None) -> bool:
+    """
+    Evaluates a Chroma `where` filter (see `build_metadata_filter`) on the metadata of one chunk.
+    Supports field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, $and and $or.
+    """
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, target in condition.items():
+                if operator not in _OPERATORS:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                if not _OPERATORS[operator](value, target):
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _atomic_write(path: str, write):
+    """Writes a file through a temporary file in the same folder, so readers never see a partial file."""
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class MappedStrings(Sequence):
+    """
+    Read-only sequence of UTF-8 strings stored back to back in a file, with their boundaries in `offsets`.
+    The file is memory-mapped, so opening costs nothing and a string is only decoded when it is accessed.
+    """
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.offsets = offsets
+        if os.path.getsize(path):
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b"" # Empty files cannot be mapped
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        return self._map[int(self.offsets[row]):int(self.offsets[row + 1])].decode("utf-8")
+
+
+class FlatVectorIndex(VectorStore):
+    """
+    In-process vector store: a float32 matrix of L2-normalized embeddings searched by brute force.
+
+    A document has 50-300 chunks, so one matrix-vector product answers a query faster than an HNSW
+    index, with no SQLite database to open. Filters use the same `where` syntax as Chroma, so retrievers
+    work the same with both backends.
+
+    On disk, nothing is deserialized when an index is opened: the matrix (`embeddings.npy`), the chunk
+    texts (`texts.bin`) and the chunk ids and metadata (`metadata.bin`, one JSON object per chunk) are
+    memory-mapped read-only, with the boundaries of every chunk in `offsets.npy`. Workers opening the same
+    index share its pages through the OS page cache. Texts are decoded for the returned chunks only, and
+    metadata the first time a filter is used.
+    """
+
+    def __init__(self, embedding: Embeddings, vectors: np.ndarray | None = None,
+                 texts: Sequence[str] | None = None, records: Sequence[str] | None = None,
+                 persist_path: str | None = None, embedding_model: str = ""):
+        self._embedding = embedding
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self._texts = texts if texts is not None else []
+        self._records = records if records is not None else [] # JSON {"id", "metadata"} of every chunk
+        self._metadata = None # Decoded metadata of all the chunks, for filters
+        self.persist_path = persist_path
+        self.embedding_model = embedding_model
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    # ---------- Writing ----------
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(len(self) + ind) for ind in range(len(texts))]
+
+        new_vectors = _normalize_rows(self._embedding.embed_documents(texts))
+        # Appending copies the matrix: the index is built once per document, not incrementally
+        self.vectors = new_vectors if len(self.vectors) == 0 else np.vstack([self.vectors, new_vectors])
+        self._texts = list(self._texts) + texts
+        self._records = list(self._records) + [
+            json.dumps({"id": chunk_id, "metadata": metadata}, ensure_ascii=False)
+            for chunk_id, metadata in zip(ids, metadatas)
+        ]
+        self._metadata = None
+
+        if self.persist_path:
+            self.save(self.persist_path)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_path: str | None = None,
+                   embedding_model: str = "", **kwargs: Any) -> "FlatVectorIndex":
+        index = cls(embedding, persist_path=persist_path, embedding_model=embedding_model)
+        index.add_texts(texts, metadatas=metadatas, ids=ids)
+        return index
+
+    def save(self, persist_path: str):
+        """
+        Writes the index to `persist_path`. The header is written last, so an interrupted save is
+        never mistaken for a complete index.
+        """
+        os.makedirs(persist_path, exist_ok=True)
+        header_path = os.path.join(persist_path, FLAT_HEADER_FILE)
+        if os.path.exists(header_path):
+            os.remove(header_path)
+
+        _atomic_write(os.path.join(persist_path, FLAT_EMBEDDINGS_FILE),
+                      lambda f: np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32)))
+
+        def write_strings(strings, offsets):
+            def write(f):
+                for value in strings:
+                    data = value.encode("utf-8")
+                    f.write(data)
+                    offsets.append(offsets[-1] + len(data))
+            return write
+
+        text_offsets, record_offsets = [0], [0]
+        _atomic_write(os.path.join(persist_path, FLAT_TEXTS_FILE), write_strings(self._texts, text_offsets))
+        _atomic_write(os.path.join(persist_path, FLAT_METADATA_FILE), write_strings(self._records, record_offsets))
+        _atomic_write(os.path.join(persist_path, FLAT_OFFSETS_FILE),
+                      lambda f: np.save(f, np.array([text_offsets, record_offsets], dtype=np.int64)))
+
+        header = {
+            "version": FLAT_INDEX_VERSION,
+            "embedding_model": self.embedding_model,
+            "count": len(self),
+            "dim": int(self.vectors.shape[1]) if len(self) else 0,
+        }
+        _atomic_write(header_path, lambda f: f.write(json.dumps(header).encode("utf-8")))
+        self.persist_path = persist_path
+
+    # ---------- Reading ----------
+    @staticmethod
+    def _header(persist_path: str) -> dict | None:
+        try:
+            with open(os.path.join(persist_path, FLAT_HEADER_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def exists(cls, persist_path: str) -> bool:
+        """Checks whether a complete flat index is saved at `persist_path`."""
+
+        header = cls._header(persist_path)
+        return bool(header) and header.get("version") == FLAT_INDEX_VERSION
+
+    @classmethod
+    def load(cls, persist_path: str, embedding: Embeddings, embedding_model: str = "") -> "FlatVectorIndex":
+        """Opens a saved index, memory-mapped read-only (see the class docstring)."""
+
+        header = cls._header(persist_path)
+        if header is None:
+            raise FileNotFoundError(f"No flat vector index at {persist_path}")
+        if embedding_model and header.get("embedding_model") and header["embedding_model"] != embedding_model:
+            raise ValueError(f"{persist_path} was indexed with {header['embedding_model']}, not {embedding_model}")
+
+        vectors = np.load(os.path.join(persist_path, FLAT_EMBEDDINGS_FILE), mmap_mode="r")
+        text_offsets, record_offsets = np.load(os.path.join(persist_path, FLAT_OFFSETS_FILE), mmap_mode="r")
+        return cls(
+            embedding,
+            vectors=vectors,
+            texts=MappedStrings(os.path.join(persist_path, FLAT_TEXTS_FILE), text_offsets),
+            records=MappedStrings(os.path.join(persist_path, FLAT_METADATA_FILE), record_offsets),
+            persist_path=persist_path,
+            embedding_model=header.get("embedding_model", ""),
+        )
+
+    def _record(self, row: int) -> dict:
+        return json.loads(self._records[row])
+
+    # ---------- Search ----------
+    def _candidates(self, filter: dict | None) -> np.ndarray:
+        """Rows matching the metadata filter, evaluated before the vector search."""
+
+        if not filter:
+            return np.arange(len(self))
+        if self._metadata is None:
+            self._metadata = [self._record(row)["metadata"] for row in range(len(self))]
+        return np.array([row for row, metadata in enumerate(self._metadata)
+                         if matches_filter(metadata, filter)], dtype=np.int64)
+
+    def _search(self, embedding: List[float], k: int, filter: dict | None = None) -> List[Tuple[int, float]]:
+        """Returns the (row, cosine similarity) of the k most similar chunks."""
+
+        rows = self._candidates(filter)
+        if len(rows) == 0 or k <= 0:
+            return []
+        # Rows are normalized, so the dot product is the cosine similarity
+        scores = np.asarray(self.vectors @ _normalize_rows(embedding)[0])[rows]
+
+        if k < len(rows):
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [(int(rows[ind]), float(scores[ind])) for ind in top]
+
+    def _document(self, row: int) -> Document:
+        record = self._record(row)
+        return Document(page_content=self._texts[row], metadata=record["metadata"], id=record["id"])
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: dict | None = None) -> List[Tuple[Document, float]]:
+        # Scores are cosine distances, like Chroma's, lower is more similar
+        return [(self._document(row), 1.0 - score) for row, score in self._search(embedding, k, filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: dict | None = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [self._document(row) for row, _ in self._search(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: dict | None = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, filter: dict | None = None,
+                                                **kwargs: Any) -> List[Document]:
+        candidates = self._search(embedding, fetch_k, filter)
+        if not candidates:
+            return []
+        rows = [row for row, _ in candidates]
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32), np.asarray(self.vectors[rows]), lambda_mult=lambda_mult, k=k
+        )
+        return [self._document(rows[ind]) for ind in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      filter: dict | None = None, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+
+# ---------- Backend selection ----------
+def _check_backend(backend: str):
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend: {backend}, use one of {', '.join(VECTOR_BACKENDS)}")
+
+
+def index_exists(persist_path: str, backend: str = VECTOR_BACKEND) -> bool:
+    """Checks whether the vector store of `persist_path` exists for the given backend."""
+
+    _check_backend(backend)
+    if backend == "flat":
+        return FlatVectorIndex.exists(persist_path)
+    return os.path.exists(os.path.join(persist_path, "chroma.sqlite3"))
+
+
+def open_index(persist_path: str, embedding_model: str = "text-embedding-3-large", backend: str = VECTOR_BACKEND):
+    """Opens the existing vector store of `persist_path` with the given backend."""
+
+    from utils.helper_functions import load_embedding_model
+
+    _check_backend(backend)
+    embeddings = load_embedding_model(embedding_model)
+    if backend == "flat":
+        return FlatVectorIndex.load(persist_path, embeddings, embedding_model=embedding_model)
+
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=persist_path, embedding_function=embeddings, collection_name="project_rfp")
+
+
+def build_flat_index(chunks: List[Document], filepath: str, persist_directory: str = "vectorestores",
+                     embedding_model: str = "text-embedding-3-large") -> FlatVectorIndex:
+    """
+    Embeds the document chunks into a `FlatVectorIndex` saved under `persist_directory`, the flat
+    counterpart of `utils.helper_functions.vector_store`.
+    """
+    from backend.file_ops import vectorstore_name
+    from utils.helper_functions import load_embedding_model
+
+    persist_path = os.path.join(persist_directory, vectorstore_name(filepath))
+    logger.info(f"Creating new flat vector index at {persist_path}")
+
+    embeddings = load_embedding_model(embedding_model)
+    return FlatVectorIndex.from_documents(chunks, embeddings, persist_path=persist_path, embedding_model=embedding_model)
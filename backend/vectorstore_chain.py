@@ -1,6 +1,7 @@
 from utils.helper_functions import (
-    load_pdf_content, 
+    load_parsed_pdf, 
     split_text, 
+    split_document, 
     convert_numbered_headers_to_markdown,
     vector_store
     )
@@ -8,118 +9,211 @@ from langchain_core.runnables import RunnableLambda
 from utils.logger_config import setup_logger
 from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 from functools import partial
-from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
-from utils.helper_functions import load_config
+from utils.helper_functions import UPLOAD_DIRECTORY
+from utils.chunking import load_chunking_config
+from backend.file_ops import VECTORSTORE_DIRECTORY, vectorstore_name
+from backend.store_manager import get_store_manager
+from backend.file_lock import file_lock
+from backend.shared_store import is_shared_mode, load_or_index_document
+from backend.vector_index import VECTOR_BACKEND, build_flat_index, index_exists, open_index
+from backend.document_store import DEFAULT_WORKSPACE
+from backend.extraction_cache import get_extraction_cache
+from utils.parse_cache import file_content_hash
+from utils.pre_extraction import find_candidates
+from utils import telemetry
 
 import os
 
 logger = setup_logger(name="backend_log", log_file="logs/backend.log")
 
-def vector_store_chain(filepath: str, splitter_type=RecursiveCharacterTextSplitter):
+def vector_store_chain(filepath: str, 
+                       splitter_type=RecursiveCharacterTextSplitter, 
+                       upload_dir: str = UPLOAD_DIRECTORY,
+                       vectorstore_dir: str = VECTORSTORE_DIRECTORY):
     """
     Creates a LangChain-compatible processing pipeline to convert a PDF into a vector store for semantic search.
 
     This function dynamically builds a chain of operations that includes:
-        1. Loading the content from a PDF file.
-        2. (Optional) Preprocessing text to convert numbered headers to Markdown, if using MarkdownHeaderTextSplitter.
-        3. Splitting the text into chunks using the specified text splitter.
-        4. Creating a vector store from the resulting chunks.
+        1. Parsing the PDF file into a structured `ParsedDocument` (pages of text, table and OCR blocks),
+           or reading it from the parse cache if the same content was parsed before. The rule-based
+           pre-extraction candidates of the document are stored on the way, see `pre_extract`.
+        2. (Optional) Flattening it to text and converting numbered headers to Markdown, if using MarkdownHeaderTextSplitter.
+        3. Splitting the content into chunks using the specified text splitter.
+        4. Creating a vector store from the resulting chunks, with the backend of VECTOR_BACKEND (see `backend.vector_index`).
 
     The chain adapts its behavior based on the provided `splitter_type`. If the `MarkdownHeaderTextSplitter` is used,
-    it includes an additional preprocessing step to format headers as Markdown. Otherwise, it skips that step.
+    it includes an additional preprocessing step to format headers as Markdown. Otherwise, the parsed document is
+    split directly with `split_document`, which keeps tables whole and records the pages of every chunk. Its
+    strategy and sizes come from the CHUNKING_STRATEGY, CHUNK_SIZE and CHUNK_OVERLAP environment variables.
 
     Parameters:
         filepath (str): Path to the PDF file to be processed.
         splitter_type (type, optional): Text splitter class to use. Defaults to RecursiveCharacterTextSplitter.
+        upload_dir (str): Directory that contains the PDF file.
+        vectorstore_dir (str): Directory where the vector store is persisted.
 
     Returns:
         RunnableSequence: A LangChain-compatible chain for processing the PDF into a vector store.
     """
 
-    # Create Runnable to make a text_split_chain
-    r_pdf_loader = RunnableLambda(load_pdf_content)
+    # The flat backend embeds the same chunks into a `FlatVectorIndex` instead of a Chroma database
+    build_store = build_flat_index if VECTOR_BACKEND == "flat" else vector_store
+    vector_store_with_filepath = partial(build_store, filepath=filepath, persist_directory=vectorstore_dir)
+    r_vector_store = RunnableLambda(lambda chunks: vector_store_with_filepath(chunks))
+
+    vector_store_chain = (
+        document_chunks_chain(splitter_type, upload_dir) |
+        r_vector_store 
+        )
+        
+    return vector_store_chain
+
+
+def document_chunks_chain(splitter_type=RecursiveCharacterTextSplitter, upload_dir: str = UPLOAD_DIRECTORY):
+    """
+    Creates the parsing and splitting part of `vector_store_chain`: the chain takes the name of a PDF file
+    and returns its chunks.
+    """
+
+    # Create Runnable to make a text_split_chain, the parse goes through the pre-extraction unchanged
+    r_pdf_parser = RunnableLambda(lambda filepath: pre_extract(load_parsed_pdf(filepath, dir=upload_dir),
+                                                               filepath, upload_dir))
 
     if splitter_type == MarkdownHeaderTextSplitter:
+        r_to_text = RunnableLambda(lambda parsed: parsed.to_text())
         r_process_text = RunnableLambda(convert_numbered_headers_to_markdown) # Format the text of pdf in markup headings.
         # As split_text function takes arguments so before passing the function to RunnableLambda, it is required to call with the arguments. 
         split_with_chunks = partial(split_text, splitter_type=splitter_type) 
         r_split_text = RunnableLambda(lambda text: split_with_chunks(text))
 
-        vector_store_with_filepath = partial(vector_store, filepath=filepath)
-        r_vector_store = RunnableLambda(lambda chunks: vector_store_with_filepath(chunks))
-
-        vector_store_chain = (
-            r_pdf_loader | 
-            r_process_text | 
-            r_split_text |
-            r_vector_store 
-            )
-        
-        return vector_store_chain
+        return r_pdf_parser | r_to_text | r_process_text | r_split_text
     
-    split_with_chunks = partial(split_text, splitter_type=splitter_type) 
-    r_split_text = RunnableLambda(lambda text: split_with_chunks(text))
+    if splitter_type != RecursiveCharacterTextSplitter:
+        raise ValueError("Unsupported splitter type: Use RecursiveCharacterTextSplitter or MarkdownHeaderTextSplitter")
 
-    vector_store_with_filepath = partial(vector_store, filepath=filepath)
-    r_vector_store = RunnableLambda(lambda chunks: vector_store_with_filepath(chunks))
+    r_split_document = RunnableLambda(partial(split_document, config=load_chunking_config()))
 
-    vector_store_chain = (
-        r_pdf_loader | 
-        r_split_text |
-        r_vector_store 
-        )
-        
-    return vector_store_chain
+    return r_pdf_parser | r_split_document
     
 
+def pre_extract(parsed, filepath: str, upload_dir: str = UPLOAD_DIRECTORY, content_hash: str | None = None):
+    """
+    Stores the rule-based pre-extraction candidates of a parsed document (see `utils.pre_extraction`),
+    unless its content was pre-extracted before. Failures are logged, the parse is returned either way.
+    """
+    try:
+        content_hash = content_hash or file_content_hash(os.path.join(upload_dir, filepath))
+        cache = get_extraction_cache()
+        if cache.get_candidates(content_hash) is None:
+            with telemetry.span("pre_extract"):
+                candidates = find_candidates(parsed)
+            cache.put_candidates(content_hash, candidates)
+            logger.info(f"Pre-extracted {len(candidates)} candidates from {filepath}")
+    except Exception as e:
+        logger.warning(f"Pre-extraction of {filepath} failed: {str(e)}")
+    return parsed
+
+
+def load_candidates(filepath: str, upload_dir: str = UPLOAD_DIRECTORY, content_hash: str | None = None) -> list:
+    """
+    Returns the pre-extraction candidates of a document, parsing it (through the parse cache) if it was
+    never pre-extracted. Parsing here means the vector store built next reads the parse from the cache.
+
+    The parse holds a lock on the content hash: concurrent requests for the same document (the partial
+    table and the extraction of the UI, precomputed schemas) wait for the first one and read its candidates.
+    """
+    content_hash = content_hash or file_content_hash(os.path.join(upload_dir, filepath))
+    cache = get_extraction_cache()
+    candidates = cache.get_candidates(content_hash)
+    telemetry.record_cache("pre_extraction", candidates is not None)
+    if candidates is None:
+        with file_lock(content_hash + ":pre_extract"):
+            candidates = cache.get_candidates(content_hash) # Pre-extracted while waiting for the lock
+            if candidates is None:
+                pre_extract(load_parsed_pdf(filepath, dir=upload_dir), filepath, upload_dir, content_hash)
+                candidates = cache.get_candidates(content_hash) or []
+    return candidates
+
+
 def vectorstore_exists(persist_path: str) ->bool:
     """ Check if the vector store already exists at the given path."""
     
-    return os.path.exists(os.path.join(persist_path, "chroma.sqlite3"))
+    return index_exists(persist_path, VECTOR_BACKEND)
 
 
 async def load_or_create_vector_store(filepath, 
-                                      vectorstore_dir="vectorestores",  
-                                      embedding_model: str = "text-embedding-3-large") -> Chroma:
+                                      vectorstore_dir=VECTORSTORE_DIRECTORY,  
+                                      embedding_model: str = "text-embedding-3-large",
+                                      upload_dir: str = UPLOAD_DIRECTORY,
+                                      workspace: str = DEFAULT_WORKSPACE) -> Chroma:
     """
     Loads an existing vector store from disk or creates a new one from the given PDF file.
 
-    This function first checks whether a vector store already exists for the given `filepath`. If it does,
-    it loads the Chroma vector store using the specified embedding model. If not, it builds a new vector store
-    by processing the PDF using a LangChain-based pipeline (`vector_store_chain`) and persists it to disk.
+    This function first checks whether the vector store of the given `filepath` is already open in memory
+    (see `TieredStoreManager`) and returns it. Otherwise, if it exists on disk, it loads the Chroma vector
+    store using the specified embedding model. If not, it builds a new vector store by processing the PDF
+    using a LangChain-based pipeline (`vector_store_chain`) and persists it to disk. Opened stores are kept
+    hot by the store manager.
+
+    With VECTORSTORE_MODE=shared, all the documents live in one Chroma database instead, and a view of the
+    document (`PartitionedStore`) is returned, see `backend.shared_store`.
 
     Parameters:
         filepath (str): Path to the PDF document.
         vectorstore_dir (str): Directory to store or look for existing vector stores. Default is "vectorestores".
         embedding_model (str): Name of the OpenAI embedding model to use. Default is "text-embedding-3-large".
+        upload_dir (str): Directory that contains the PDF file. Default is "uploads".
+        workspace (str): Workspace that owns the document, used to partition the shared store.
 
     Returns:
-        Chroma: A `Chroma` vector store instance loaded from or created at the specified path.
+        Chroma: A `Chroma` vector store instance loaded from or created at the specified path
+            (a `FlatVectorIndex` with VECTOR_BACKEND=flat).
     """
 
     # Check if if the vector store already exists.
     logger.info(f"filepath is: {filepath}")
     
 
-    filename = os.path.basename(filepath).replace(".pdf", "").replace(" ", "_") # eg. "D:\Projects\RFPs\rfp.pdf" => "rfp"
+    filename = vectorstore_name(filepath) # eg. "D:\Projects\RFPs\rfp.pdf" => "rfp"
     persist_path = os.path.join(vectorstore_dir, filename)
     logger.info(f"persist_path is: {persist_path}")
 
+    manager = get_store_manager()
+    if is_shared_mode():
+        try:
+            with file_lock(persist_path + ":build"): # Concurrent first queries, in any worker, index the document once
+                return await load_or_index_document(filepath, workspace, document_chunks_chain(upload_dir=upload_dir),
+                                                    embedding_model)
+        except Exception as e:
+            logger.error(f"error loading or indexing document in the shared vector store: {str(e)}")
+            raise RuntimeError(f"Error loading or creating vector store, {str(e)}")
+
+    store = manager.get(persist_path)
+    telemetry.record_cache("store", store is not None)
+    if store is not None:
+        logger.info(f"Using open vector store of {persist_path}")
+        return store
+
     try:
-        if vectorstore_exists(persist_path):
-            logger.info(f"Loading existing vector store from {persist_path}")
-            return Chroma(
-                persist_directory=persist_path,
-                embedding_function=OpenAIEmbeddings(model=embedding_model, api_key=load_config()),
-                collection_name="project_rfp"
-            )
-
-        else:
-            logger.info(f"Creating a new vector store for {filepath} at {persist_path}")
-            store = await vector_store_chain(filepath).ainvoke(filepath)
-            
-            return store
+        # Concurrent first queries, in any worker, build the store only once
+        with file_lock(persist_path + ":build"):
+            store = manager.get(persist_path) # Opened by another thread while waiting for the lock
+            if store is not None:
+                return store
+
+            if vectorstore_exists(persist_path):
+                logger.info(f"Loading existing vector store from {persist_path}")
+                with telemetry.span("open_store"):
+                    store = open_index(persist_path, embedding_model, VECTOR_BACKEND)
+
+            else:
+                logger.info(f"Creating a new vector store for {filepath} at {persist_path}")
+                with telemetry.span("ingest"):
+                    store = await vector_store_chain(filepath, upload_dir=upload_dir, vectorstore_dir=vectorstore_dir).ainvoke(filepath)
+
+            manager.put(persist_path, store)
+        return store
     except Exception as e:
         logger.error(f"error loading or creating vector store: {str(e)}")
         raise RuntimeError(f"Error loading or creating vector store, {str(e)}")
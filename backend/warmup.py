@@ -0,0 +1,128 @@
+"""
+Warmup of the API processes, for the multi-worker mode (see `gunicorn.conf.py`).
+
+- `preload_modules` runs once in the gunicorn master before the workers are forked, so the heavy
+  imports are shared copy-on-write by all the workers instead of being paid by each of them.
+- `warm_worker` runs in every worker after the fork: it creates the OpenAI clients (HTTP connection
+  pools must not cross a fork) and opens the most recently used vector stores.
+
+`readiness` reports which of these steps are done, for the /ready endpoint.
+"""
+import asyncio
+import importlib
+import os
+import threading
+import time
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(name="backend_log", log_file="logs/backend.log")
+
+WARMUP_STORES = int(os.getenv("WARMUP_STORES", 8)) # Vector stores opened by every worker on startup
+HEAVY_MODULES = (
+    "numpy", "pandas", "pdfplumber", "pdf2image", "pytesseract", "chromadb",
+    "langchain_openai", "langchain_chroma", "langchain_text_splitters",
+)
+
+_state = {"imports": False, "clients": False, "indexes": False}
+_errors = {}
+_state_lock = threading.Lock()
+
+
+def _mark(step: str, error: Exception | None = None):
+    with _state_lock:
+        _state[step] = error is None
+        if error is not None:
+            _errors[step] = str(error)
+        else:
+            _errors.pop(step, None)
+
+
+def preload_modules():
+    """Imports the heavy third-party modules and loads the tokenizer, so they are ready before any request."""
+
+    from utils.chunking import count_tokens
+
+    start = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Warmup could not import {name}: {str(e)}")
+    count_tokens("warmup") # Loads the tiktoken encoding
+    _mark("imports")
+    logger.info(f"Preloaded modules in {time.perf_counter() - start:.2f}s (pid {os.getpid()})")
+
+
+def warm_clients():
+    """Creates the chat and embedding clients of this process."""
+
+    from utils.helper_functions import load_embedding_model, load_openai_model
+
+    try:
+        load_openai_model()
+        load_embedding_model()
+        _mark("clients")
+    except Exception as e:
+        logger.error(f"Warmup could not create the OpenAI clients: {str(e)}")
+        _mark("clients", e)
+
+
+def warm_indexes(limit: int = WARMUP_STORES):
+    """Opens the vector stores of the most recently used documents. Missing stores are not built here."""
+
+    from backend.document_store import get_document_store
+    from backend.file_lock import file_lock
+    from backend.shared_store import get_shared_vector_store, is_shared_mode
+    from backend.vectorstore_chain import load_or_create_vector_store, vectorstore_exists
+
+    try:
+        if is_shared_mode():
+            get_shared_vector_store()
+            _mark("indexes")
+            return
+
+        store = get_document_store()
+        opened = 0
+        for workspace, filename in store.recent_documents(limit):
+            persist_path = store.vectorstore_path(workspace, filename)
+            # A shared lock, so another worker cannot archive the store while it is opened
+            with file_lock(persist_path, shared=True):
+                if not vectorstore_exists(persist_path):
+                    continue
+                asyncio.run(load_or_create_vector_store(filename,
+                                                        vectorstore_dir=store.vectorstore_dir(workspace),
+                                                        upload_dir=store.upload_dir(workspace),
+                                                        workspace=workspace))
+            opened += 1
+        _mark("indexes")
+        logger.info(f"Opened {opened} vector stores (pid {os.getpid()})")
+    except Exception as e:
+        logger.error(f"Warmup could not open the vector stores: {str(e)}")
+        _mark("indexes", e)
+
+
+def warm_worker():
+    """Warms up a worker process: modules (if not preloaded), clients, then vector stores."""
+
+    start = time.perf_counter()
+    if not _state["imports"]:
+        preload_modules()
+    warm_clients()
+    warm_indexes()
+    logger.info(f"Worker {os.getpid()} warmed up in {time.perf_counter() - start:.2f}s")
+
+
+def start_warmup() -> threading.Thread:
+    """Warms up the worker in the background, so it answers /health and /ready meanwhile."""
+
+    thread = threading.Thread(target=warm_worker, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness() -> dict:
+    """Returns {"ready": bool, "checks": {step: done}, "errors": {step: message}} for this worker."""
+
+    with _state_lock:
+        return {"ready": all(_state.values()), "checks": dict(_state), "errors": dict(_errors), "pid": os.getpid()}
@@ -0,0 +1,262 @@
+"""
+Offline benchmark of chunking configurations (see `utils.chunking`).
+
+For every configuration, the document is chunked and embedded with a local stand-in embedding model,
+then every question of a labeled set is answered by a top-k similarity search. Reported per configuration:
+
+- chunks: number of chunks, and their average size in tokens
+- embed tokens: tokens sent to the embedding model to index the document
+- hit@k: share of questions whose answer is in one of the k retrieved chunks, and the MRR
+- prompt tokens: average size of the k retrieved chunks, i.e. the context sent to the chat model
+
+By default the document is a synthetic RFP with known facts and questions. A real document can be used
+with --pdf and --questions, a JSON list of {"question": ..., "answer": ...} where the answer is a
+verbatim snippet of the document.
+
+Usage:
+    python -m benchmarks.chunking_benchmark
+    python -m benchmarks.chunking_benchmark --configs recursive:5000:200 section:384:48 --k 10
+    python -m benchmarks.chunking_benchmark --pdf uploads/rfp.pdf --questions questions.json --json report.json
+"""
+import argparse
+import json
+import random
+import re
+import textwrap
+import time
+from typing import List, Tuple
+
+from benchmarks.fakes import HashingEmbeddings
+from utils.chunking import ChunkingConfig, chunk_document, count_tokens
+from utils.page_model import Block, Page, ParsedDocument, BLOCK_TEXT
+
+DEFAULT_CONFIGS = [
+    "recursive:5000:200",
+    "recursive:1500:150",
+    "token:512:64",
+    "token:256:32",
+    "sentence:384:48",
+    "section:384:48",
+    "section:256:32",
+    "section:256:32:0",
+]
+
+# ---------- Synthetic RFP ----------
+SECTION_TITLES = [
+    "INSTRUCTIONS TO CONSULTANTS", "DATA SHEET", "EVALUATION CRITERIA", "TERMS OF REFERENCE",
+    "SCOPE OF SERVICES", "DELIVERABLES AND REPORTING", "STAFFING AND TEAM COMPOSITION",
+    "FINANCIAL PROPOSAL", "GENERAL CONDITIONS OF CONTRACT", "SPECIAL CONDITIONS OF CONTRACT",
+    "PAYMENT SCHEDULE", "ELIGIBILITY AND QUALIFICATION",
+]
+SUBSECTION_TITLES = ["Background", "Objectives", "Requirements", "Procedure", "Documents", "Obligations"]
+FILLER_WORDS = (
+    "consultant client proposal project hydropower feasibility study design evaluation criteria technical financial "
+    "contract payment schedule submission documents services report team experience quality method bid security "
+    "deadline meeting guarantee validity score weight site duration liquidated damages milestone queries"
+).split()
+PLACES = ["Kathmandu", "Pokhara", "Dhangadhi", "Biratnagar", "Butwal", "Nepalgunj", "Hetauda", "Janakpur"]
+MILESTONES = ["Inception Report", "Interim Report", "Draft Final Report", "Final Report", "Tender Documents"]
+
+# (sentence of the document, question, value generator)
+FACTS = [
+    ("The bid security shall be {value}.", "What is the amount of the bid security?",
+     lambda rng: f"USD {rng.randint(5, 90) * 1000:,}"),
+    ("Proposals must be submitted no later than {value}.", "What is the deadline for submitting proposals?",
+     lambda rng: f"{rng.randint(1, 28)} {rng.choice(['March', 'April', 'May', 'June'])} 2025, 12:00 noon"),
+    ("A pre-proposal meeting will be held on {value}.", "When is the pre-proposal meeting?",
+     lambda rng: f"{rng.randint(1, 28)} {rng.choice(['January', 'February'])} 2025 at 11:00 AM"),
+    ("The duration of the assignment is {value}.", "What is the duration of the assignment?",
+     lambda rng: f"{rng.randint(6, 36)} months"),
+    ("The performance guarantee shall be {value} of the contract price.", "How much is the performance guarantee?",
+     lambda rng: f"{rng.choice([5, 10, 15])} percent"),
+    ("Requests for clarification shall be sent by e-mail to {value}.", "Where should requests for clarification be sent?",
+     lambda rng: f"procurement{rng.randint(10, 99)}@hydro-authority.gov.np"),
+    ("The minimum technical score required to pass is {value}.", "What is the minimum technical score required to pass?",
+     lambda rng: f"{rng.choice([65, 70, 75, 80])} points"),
+    ("Proposals shall remain valid for {value} after the submission deadline.", "How long shall proposals remain valid?",
+     lambda rng: f"{rng.choice([90, 120, 150, 180])} days"),
+    ("Liquidated damages are charged at {value} of the contract price per week of delay.",
+     "What is the rate of liquidated damages?", lambda rng: f"{rng.choice([0.05, 0.1, 0.5])} percent"),
+    ("The technical proposal carries a weight of {value} in the combined evaluation.",
+     "What is the weight of the technical proposal?", lambda rng: f"{rng.choice([70, 75, 80, 90])}%"),
+    ("The project site is located near {value}.", "Where is the project site located?",
+     lambda rng: f"{rng.choice(PLACES)}, Province {rng.randint(1, 7)}"),
+    ("The team leader shall have at least {value} of experience in hydropower projects.",
+     "How much experience must the team leader have?", lambda rng: f"{rng.randint(10, 20)} years"),
+]
+
+# Sentences sharing the words of the questions, without their answers
+DISTRACTORS = [
+    "The bid security form is provided in the annex and shall be signed by an authorized bank.",
+    "Late proposals received after the deadline will be rejected and returned unopened.",
+    "Minutes of the meeting will be shared with all the consultants who purchased the documents.",
+    "Any extension of the duration of the assignment requires the written approval of the client.",
+    "The guarantee shall be issued by a commercial bank acceptable to the client.",
+    "Requests for clarification received late may not be answered by the client.",
+    "The technical score is computed from the criteria and sub-criteria of the data sheet.",
+    "The validity of the proposals may be extended at the request of the client.",
+    "The team leader is responsible for the quality of all the deliverables and reports.",
+    "The weight of every criterion is indicated in the evaluation table below.",
+]
+
+
+def _filler_sentence(rng: random.Random) -> str:
+    words = rng.choices(FILLER_WORDS, k=rng.randint(8, 22))
+    return " ".join(words).capitalize() + "."
+
+
+def generate_document(n_sections: int = 12, sentences_per_subsection: int = 18,
+                      sentences_per_page: int = 45, seed: int = 42) -> Tuple[ParsedDocument, List[dict]]:
+    """
+    Generates a synthetic RFP as a `ParsedDocument`, with numbered sections and subsections, wrapped
+    lines, filler and distractor sentences, known facts spread in the text and a milestone table.
+
+    Returns:
+        (ParsedDocument, list[dict]): The document and its labeled questions {"question", "answer"}.
+    """
+    rng = random.Random(seed)
+    facts = [(sentence, question, make_value(rng)) for sentence, question, make_value in FACTS]
+    rng.shuffle(facts)
+    questions = [{"question": question, "answer": value} for _, question, value in facts]
+
+    # Every fact goes to a random subsection, the table goes to the middle of the document
+    slots = {}
+    for fact in facts:
+        slots.setdefault((rng.randrange(n_sections), rng.randrange(len(SUBSECTION_TITLES))), []).append(fact)
+    table_section = n_sections // 2
+
+    pages, lines_on_page, blocks = [], [], []
+    def new_page():
+        nonlocal lines_on_page, blocks
+        if lines_on_page:
+            blocks.append(Block(BLOCK_TEXT, len(pages) + 1, "\n".join(lines_on_page), (0, 0, 612, 792)))
+        if blocks:
+            pages.append(Page(len(pages) + 1, 612, 792, blocks))
+        lines_on_page, blocks = [], []
+
+    sentence_count = 0
+    for section_ind in range(n_sections):
+        lines_on_page.append(f"{section_ind + 1}. {SECTION_TITLES[section_ind % len(SECTION_TITLES)]}")
+        for sub_ind, sub_title in enumerate(SUBSECTION_TITLES):
+            lines_on_page.append(f"{section_ind + 1}.{sub_ind + 1} {sub_title}")
+            sentences = [_filler_sentence(rng) for _ in range(sentences_per_subsection)]
+            sentences += rng.sample(DISTRACTORS, 2)
+            for sentence, _, value in slots.get((section_ind, sub_ind), []):
+                sentences.insert(rng.randrange(len(sentences)), sentence.format(value=value))
+
+            for sentence_ind in range(0, len(sentences), 4):
+                paragraph = " ".join(sentences[sentence_ind:sentence_ind + 4])
+                lines_on_page.extend(textwrap.wrap(paragraph, 95))
+                sentence_count += 4
+                if sentence_count >= sentences_per_page:
+                    new_page()
+                    sentence_count = 0
+
+            if section_ind == table_section and sub_ind == 0:
+                rows = [["Milestone", "Deadline"]]
+                for milestone in MILESTONES:
+                    deadline = f"Week {rng.randint(2, 60)} after signing"
+                    rows.append([milestone, deadline])
+                    questions.append({"question": f"When is the {milestone} due?", "answer": f"{milestone} | {deadline}"})
+                blocks.append(Block(BLOCK_TEXT, len(pages) + 1, "\n".join(lines_on_page), (0, 0, 612, 400)))
+                blocks.append(Block.table(len(pages) + 1, rows, (0, 400, 612, 500)))
+                lines_on_page = []
+    new_page()
+
+    return ParsedDocument("synthetic_rfp.pdf", pages), questions
+
+
+# ---------- Benchmark ----------
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def parse_config(spec: str) -> ChunkingConfig:
+    """Parses "strategy:chunk_size:chunk_overlap[:prefix_chars]", e.g. "section:384:48" or "token:256:32:0"."""
+
+    strategy, chunk_size, chunk_overlap, *prefix_chars = spec.split(":")
+    return ChunkingConfig(strategy=strategy, chunk_size=int(chunk_size), chunk_overlap=int(chunk_overlap),
+                          prefix_chars=int(prefix_chars[0]) if prefix_chars else 500)
+
+
+def run_config(parsed: ParsedDocument, questions: List[dict], config: ChunkingConfig, k: int) -> dict:
+    """Chunks, embeds and queries the document with one configuration and returns its metrics."""
+
+    start = time.perf_counter()
+    chunks = chunk_document(parsed, config)
+    chunk_seconds = time.perf_counter() - start
+
+    embeddings = HashingEmbeddings()
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    index_tokens = embeddings.tokens_embedded
+    chunk_tokens = [count_tokens(chunk.page_content) for chunk in chunks]
+    normalized_chunks = [_normalize(chunk.page_content) for chunk in chunks]
+
+    hits, reciprocal_ranks, prompt_tokens = 0, 0.0, []
+    for item in questions:
+        query = embeddings.embed_query(item["question"])
+        scores = [sum(q * v for q, v in zip(query, vector)) for vector in vectors]
+        top_k = sorted(range(len(chunks)), key=lambda ind: scores[ind], reverse=True)[:k]
+
+        answer = _normalize(item["answer"])
+        rank = next((rank for rank, ind in enumerate(top_k, start=1) if answer in normalized_chunks[ind]), None)
+        if rank:
+            hits += 1
+            reciprocal_ranks += 1 / rank
+        prompt_tokens.append(sum(chunk_tokens[ind] for ind in top_k))
+
+    n_questions = len(questions) or 1
+    return {
+        "config": config.describe() + ("" if config.prefix_chars else " no prefix"),
+        "chunks": len(chunks),
+        "avg_chunk_tokens": round(sum(chunk_tokens) / (len(chunks) or 1), 1),
+        "embedding_tokens": index_tokens,
+        "hit_rate": round(hits / n_questions, 3),
+        "mrr": round(reciprocal_ranks / n_questions, 3),
+        "avg_prompt_tokens": round(sum(prompt_tokens) / n_questions, 1),
+        "chunking_ms": round(chunk_seconds * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS, help="strategy:chunk_size:chunk_overlap[:prefix_chars]")
+    parser.add_argument("--k", type=int, default=10, help="Chunks retrieved per question")
+    parser.add_argument("--pdf", help="Benchmark a real PDF instead of the synthetic document")
+    parser.add_argument("--questions", help="JSON list of {question, answer}, required with --pdf")
+    parser.add_argument("--sections", type=int, default=12, help="Sections of the synthetic document")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    if args.pdf:
+        if not args.questions:
+            parser.error("--questions is required with --pdf")
+        import os
+        from utils.helper_functions import load_parsed_pdf
+
+        parsed = load_parsed_pdf(os.path.basename(args.pdf), dir=os.path.dirname(args.pdf) or ".")
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+    else:
+        parsed, questions = generate_document(n_sections=args.sections, seed=args.seed)
+
+    print(f"{parsed.source}: {len(parsed)} pages, {count_tokens(parsed.to_text())} tokens, "
+          f"{len(questions)} questions, k={args.k}\n")
+    print(f"{'config':<34} {'chunks':>7} {'avg tok':>8} {'embed tok':>10} {'hit@k':>6} {'MRR':>6} {'prompt tok':>11} {'ms':>8}")
+
+    results = []
+    for spec in args.configs:
+        result = run_config(parsed, questions, parse_config(spec), args.k)
+        results.append(result)
+        print(f"{result['config']:<34} {result['chunks']:>7} {result['avg_chunk_tokens']:>8} {result['embedding_tokens']:>10} "
+              f"{result['hit_rate']:>6} {result['mrr']:>6} {result['avg_prompt_tokens']:>11} {result['chunking_ms']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"document": parsed.source, "pages": len(parsed), "questions": len(questions),
+                       "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Local stand-ins for the OpenAI models, so benchmarks run offline, for free and deterministically.
+"""
+import math
+import re
+import zlib
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from utils.chunking import count_tokens
+
+WORD_PATTERN = re.compile(r"[a-z0-9@.\-]+[a-z0-9]|[a-z0-9]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or shall that the this to was were will with".split()
+)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Stand-in for `OpenAIEmbeddings`: words and word pairs hashed into `dim` signed buckets, L2 normalized.
+
+    Texts sharing words get similar vectors, so retrieval quality moves in the same direction as with a
+    real model when chunking changes, without any API call. The tokens sent to `embed_*` are counted
+    like the embedding API would bill them.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.tokens_embedded = 0
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+        for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            vector[hashed % self.dim] += 1.0 if (hashed >> 16) & 1 else -1.0
+
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.tokens_embedded += sum(count_tokens(text) for text in texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.tokens_embedded += count_tokens(text)
+        return self._embed(text)
@@ -0,0 +1,133 @@
+"""
+Benchmark of `convert_numbered_headers_to_markdown` against the previous implementation.
+
+Generates large synthetic RFP-like texts, checks that both implementations produce identical
+output and reports the timings.
+
+Usage:
+    python -m benchmarks.header_conversion_benchmark --lines 200000 --repeat 3
+"""
+import argparse
+import random
+import re
+import time
+
+from utils.helper_functions import convert_numbered_headers_to_markdown
+
+
+# ---------- Previous implementation, kept as the reference ----------
+def legacy_is_likely_section_header(line: str) -> bool:
+    line = line.strip()
+    pattern1 = r"^\d+\.?\s+[A-Z][A-Z\s&()\-,:]+$"
+    return bool(re.match(pattern1, line))
+
+
+def legacy_normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def legacy_convert_numbered_headers_to_markdown(text: str) -> str:
+    lines = text.splitlines()
+    markdown_lines = []
+    i = 0
+
+    while i < len(lines):
+        current_line = lines[i].strip()
+
+        if legacy_is_likely_section_header(current_line):
+            markdown_header = re.sub(r"^\d+\.?", "#", current_line)
+            markdown_lines.append(f"{markdown_header}\n")
+            i += 1
+            continue
+
+        match = re.match(r"^[A-Z]\.\s+(.*)", current_line)
+        heading_main = match.group(1).strip() if match else current_line
+
+        next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
+        next_next_line = lines[i + 2].strip() if i + 2 < len(lines) else ""
+
+        line_1_norm = legacy_normalize_text(heading_main)
+        line_2_norm = legacy_normalize_text(next_line)
+        line_3_norm = legacy_normalize_text(next_next_line)
+
+        combined_1_2 = legacy_normalize_text(f"{heading_main} {next_line}")
+        combined_1_2_3 = legacy_normalize_text(f"{heading_main} {next_line} {next_next_line}")
+
+        if line_1_norm == line_2_norm or \
+           combined_1_2 == line_3_norm or \
+           combined_1_2_3 == line_3_norm:
+            markdown_lines.append(f"# {current_line} {next_line}".strip() + "\n")
+            i += 3
+            continue
+
+        markdown_lines.append(current_line)
+        i += 1
+
+    return "\n".join(markdown_lines)
+
+
+# ---------- Synthetic documents ----------
+WORDS = ("consultant shall submit the proposal project hydropower feasibility study design "
+         "evaluation criteria technical financial client employer contract payment schedule").split()
+
+
+def generate_text(n_lines: int, seed: int = 42) -> str:
+    """
+    Generates RFP-like text with numbered and lettered headers, headers repeated over two lines,
+    blank lines, tabs and irregular spacing, so every branch of the converter is exercised.
+    """
+    rng = random.Random(seed)
+    lines = []
+    section = 1
+    while len(lines) < n_lines:
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append(f"{section}. {' '.join(rng.choices(WORDS, k=3)).upper()}")
+            section += 1
+        elif kind < 0.08:
+            title = " ".join(rng.choices(WORDS, k=2)).title()
+            lines.append(f"{rng.choice('ABCDEFGH')}. {title}")
+            lines.append(title.upper())
+        elif kind < 0.10:
+            first, second = " ".join(rng.choices(WORDS, k=2)), " ".join(rng.choices(WORDS, k=2))
+            lines.extend([first, second, f"  {first}\t{second.upper()} "])
+        elif kind < 0.15:
+            lines.append(rng.choice(["", "   ", "\t"]))
+        else:
+            lines.append("  ".join(rng.choices(WORDS, k=rng.randint(4, 14))))
+    return "\n".join(lines)
+
+
+def time_function(func, text: str, repeat: int) -> float:
+    """Returns the best wall time of `repeat` runs, in seconds."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, nargs="+", default=[10_000, 100_000, 300_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'lines':>10} {'legacy (s)':>12} {'current (s)':>12} {'speedup':>8} identical")
+    for n_lines in args.lines:
+        text = generate_text(n_lines, seed=args.seed)
+
+        identical = legacy_convert_numbered_headers_to_markdown(text) == convert_numbered_headers_to_markdown(text)
+        legacy = time_function(legacy_convert_numbered_headers_to_markdown, text, args.repeat)
+        current = time_function(convert_numbered_headers_to_markdown, text, args.repeat)
+
+        print(f"{n_lines:>10} {legacy:>12.3f} {current:>12.3f} {legacy / current:>7.1f}x {identical}")
+        if not identical:
+            raise SystemExit("Outputs differ from the previous implementation.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Load test of the API with virtual users, to find how many concurrent users one instance supports.
+
+Every virtual user runs sessions of a profile, with a random think time between requests:
+
+- reader: asks questions about documents already indexed (/query-document/, some /extract-data/)
+- extractor: runs every extraction schema of a document, then asks a few questions
+- uploader: uploads a new tender (/upload-pdf/), which the first request indexes, extracts and queries it,
+  then deletes it (/delete-file/)
+
+The number of users grows by stages (--users); every stage runs for --duration seconds. Per stage, the
+report gives the throughput, the error rate (by status code) and the p50/p95/p99 latency of every
+endpoint. The saturation point is the first stage where the throughput stops growing with the users, the
+error rate exceeds --max-error-rate or the p95 exceeds --slo-p95. The capacity is the last stage before it.
+
+By default the app runs locally against the mock OpenAI API (see `benchmarks.offline_benchmark`), so
+the model latency is --chat-latency; --url drives an app that is already running instead.
+
+Usage:
+    python -m benchmarks.load_benchmark
+    python -m benchmarks.load_benchmark --users 1 4 8 16 32 --duration 60 --mix reader=6 extractor=3 uploader=1
+    python -m benchmarks.load_benchmark --workers 4 --think 2 --slo-p95 5000 --json load.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import List
+
+from benchmarks.mock_openai import MockOpenAIServer
+from benchmarks.offline_benchmark import QUERIES, SCHEMAS, latency_summary, running_app
+from benchmarks.rfp_pdfs import generate_rfp_pdf
+
+ENDPOINTS = ("/upload-pdf/", "/extract-data/", "/query-document/", "/delete-file/")
+DEFAULT_MIX = {"reader": 6, "extractor": 3, "uploader": 1}
+
+
+# ---------- Sessions ----------
+def reader_session(rng: random.Random, documents: List[str], pool: List[str]) -> List[tuple]:
+    document = rng.choice(documents)
+    actions = [("query", document, rng.choice(QUERIES)) for _ in range(rng.randint(3, 8))]
+    if rng.random() < 0.3:
+        actions.insert(rng.randrange(len(actions)), ("extract", document, rng.choice(SCHEMAS)))
+    return actions
+
+
+def extractor_session(rng: random.Random, documents: List[str], pool: List[str]) -> List[tuple]:
+    document = rng.choice(documents)
+    return [("extract", document, schema) for schema in SCHEMAS] + \
+           [("query", document, rng.choice(QUERIES)) for _ in range(2)]
+
+
+def uploader_session(rng: random.Random, documents: List[str], pool: List[str]) -> List[tuple]:
+    source = rng.choice(pool)
+    filename = f"load_{uuid.uuid4().hex[:10]}.pdf" # A new document every time, its store is built on first use
+    return [("upload", source, filename)] + \
+           [("extract", filename, schema) for schema in rng.sample(SCHEMAS, 2)] + \
+           [("query", filename, rng.choice(QUERIES)) for _ in range(3)] + \
+           [("delete", filename, None)]
+
+
+PROFILES = {"reader": reader_session, "extractor": extractor_session, "uploader": uploader_session}
+
+
+def parse_mix(items: List[str]) -> dict:
+    """Parses ["reader=6", "uploader=1"] into {"reader": 6.0, "uploader": 1.0}."""
+
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in PROFILES:
+            raise ValueError(f"Unknown user profile {name!r}, use one of {', '.join(PROFILES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ---------- Virtual users ----------
+class Recorder:
+    """Thread-safe record of the requests of a stage: (endpoint, seconds, status), status 0 on connection errors."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, seconds: float, status: int):
+        with self._lock:
+            self.records.append((endpoint, seconds, status))
+
+
+def _request(session, base_url: str, action: tuple, workspace: str):
+    kind, target, arg = action
+    headers = {"X-Workspace": workspace}
+    if kind == "upload":
+        with open(target, "rb") as f:
+            return "/upload-pdf/", session.post(f"{base_url}/upload-pdf/", files={"file": (arg, f, "application/pdf")},
+                                                headers=headers, timeout=600)
+    if kind == "extract":
+        return "/extract-data/", session.get(f"{base_url}/extract-data/", params={"filepath": target, "schema_name": arg},
+                                             headers=headers, timeout=600)
+    if kind == "query":
+        return "/query-document/", session.get(f"{base_url}/query-document/", params={"filepath": target, "query": arg},
+                                               headers=headers, timeout=600)
+    return "/delete-file/", session.delete(f"{base_url}/delete-file/{target}", headers=headers, timeout=600)
+
+
+def virtual_user(base_url: str, mix: dict, documents: List[str], pool: List[str], think: float, stop_at: float,
+                 recorder: Recorder, seed: int, workspace: str):
+    """Runs sessions until `stop_at`. The request in flight at `stop_at` is finished and recorded."""
+
+    import requests
+
+    rng = random.Random(seed)
+    session = requests.Session()
+    profiles, weights = list(mix), list(mix.values())
+    uploaded = set()
+    while time.time() < stop_at:
+        profile = PROFILES[rng.choices(profiles, weights)[0]]
+        for action in profile(rng, documents, pool):
+            # After the stage, the session stops, but the documents it uploaded are still deleted
+            if time.time() >= stop_at and not (action[0] == "delete" and action[1] in uploaded):
+                continue
+            start = time.perf_counter()
+            try:
+                endpoint, response = _request(session, base_url, action, workspace)
+                status = response.status_code
+            except requests.RequestException:
+                endpoint, status = {"upload": "/upload-pdf/", "extract": "/extract-data/", "query": "/query-document/",
+                                    "delete": "/delete-file/"}[action[0]], 0
+            recorder.add(endpoint, time.perf_counter() - start, status)
+            if action[0] == "upload" and status == 200:
+                uploaded.add(action[2])
+            elif action[0] == "delete":
+                uploaded.discard(action[1])
+            if think and time.time() < stop_at:
+                time.sleep(rng.expovariate(1 / think)) # Think times are exponential, like independent users
+
+
+def run_stage(base_url: str, users: int, duration: float, mix: dict, documents: List[str], pool: List[str],
+              think: float, workspace: str, seed: int) -> dict:
+    """Runs `users` virtual users for `duration` seconds, returns the summary of the stage."""
+
+    recorder = Recorder()
+    start = time.time()
+    threads = [threading.Thread(target=virtual_user, daemon=True,
+                                args=(base_url, mix, documents, pool, think, start + duration, recorder, seed * 1000 + ind, workspace))
+               for ind in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start # Includes the requests finished after `duration`
+
+    records = recorder.records
+    ok = [(endpoint, latency) for endpoint, latency, status in records if status == 200]
+    stage = {
+        "users": users,
+        "seconds": round(seconds, 1),
+        "requests": len(records),
+        "throughput_rps": round(len(ok) / seconds, 2),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "statuses": dict(Counter(str(status) for _, _, status in records)),
+        "all": latency_summary([latency for _, latency in ok], len(records) - len(ok), seconds),
+        "endpoints": {},
+    }
+    by_endpoint = defaultdict(list)
+    for endpoint, latency, status in records:
+        by_endpoint[endpoint].append((latency, status))
+    for endpoint in ENDPOINTS:
+        if endpoint in by_endpoint:
+            values = by_endpoint[endpoint]
+            stage["endpoints"][endpoint] = latency_summary([latency for latency, status in values if status == 200],
+                                                           sum(1 for _, status in values if status != 200), seconds)
+    return stage
+
+
+def find_saturation(stages: List[dict], max_error_rate: float, slo_p95_ms: float | None, min_gain: float = 0.1) -> dict:
+    """
+    Finds the first stage that is saturated: throughput growing by less than `min_gain` (relative) while the
+    users grew, error rate above `max_error_rate`, or p95 above `slo_p95_ms`.
+
+    Returns:
+        dict: {"saturated_at": users or None, "reason": str, "capacity_users": last good stage, "capacity_rps"}
+    """
+    previous = None
+    for stage in stages:
+        reason = None
+        if stage["error_rate"] > max_error_rate:
+            reason = f"error rate {stage['error_rate']:.1%}"
+        elif slo_p95_ms is not None and (stage["all"]["p95_ms"] or 0) > slo_p95_ms:
+            reason = f"p95 {stage['all']['p95_ms']} ms above {slo_p95_ms} ms"
+        elif previous and stage["users"] > previous["users"] and \
+                stage["throughput_rps"] < previous["throughput_rps"] * (1 + min_gain):
+            reason = f"throughput {previous['throughput_rps']} -> {stage['throughput_rps']} req/s"
+
+        if reason:
+            return {"saturated_at": stage["users"], "reason": reason,
+                    "capacity_users": previous["users"] if previous else None,
+                    "capacity_rps": previous["throughput_rps"] if previous else None}
+        previous = stage
+
+    return {"saturated_at": None, "reason": "not reached",
+            "capacity_users": previous["users"] if previous else None,
+            "capacity_rps": previous["throughput_rps"] if previous else None}
+
+
+# ---------- Main ----------
+def prepare_documents(base_url: str, pool: List[str], n_documents: int, workspace: str) -> List[str]:
+    """Uploads and indexes the documents read by the readers and extractors, returns their names."""
+
+    import requests
+
+    names = []
+    for ind in range(n_documents):
+        name = f"tender_{ind + 1}.pdf"
+        with open(pool[ind % len(pool)], "rb") as f:
+            requests.post(f"{base_url}/upload-pdf/", files={"file": (name, f, "application/pdf")},
+                          headers={"X-Workspace": workspace}, timeout=600).raise_for_status()
+        # The first query builds the vector store, so the stages measure warm documents
+        requests.get(f"{base_url}/query-document/", params={"filepath": name, "query": QUERIES[0]},
+                     headers={"X-Workspace": workspace}, timeout=900).raise_for_status()
+        names.append(name)
+    return names
+
+
+def print_stage(stage: dict):
+    print(f"{stage['users']:>6} {stage['requests']:>9} {stage['throughput_rps']:>7} {stage['error_rate']:>7.1%} "
+          f"{stage['all']['p50_ms']!s:>8} {stage['all']['p95_ms']!s:>8} {stage['all']['p99_ms']!s:>8}  "
+          + "  ".join(f"{endpoint.strip('/')}: {summary['p95_ms']}" for endpoint, summary in stage["endpoints"].items()))
+
+
+def run_load_test(base_url: str, args, pool: List[str]) -> dict:
+    mix = parse_mix(args.mix)
+    documents = prepare_documents(base_url, pool, args.documents, args.workspace)
+
+    print(f"mix: {mix}, think time: {args.think}s, {args.duration}s per stage\n")
+    print(f"{'users':>6} {'requests':>9} {'req/s':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  p95 ms per endpoint")
+    stages = []
+    for stage_ind, users in enumerate(args.users):
+        stage = run_stage(base_url, users, args.duration, mix, documents, pool, args.think, args.workspace, stage_ind)
+        stages.append(stage)
+        print_stage(stage)
+
+    saturation = find_saturation(stages, args.max_error_rate, args.slo_p95)
+    if saturation["saturated_at"] is None:
+        print(f"\nsaturation: not reached, {saturation['capacity_users']} users at {saturation['capacity_rps']} req/s")
+    else:
+        print(f"\nsaturation: {saturation['saturated_at']} users ({saturation['reason']}), "
+              f"capacity: {saturation['capacity_users']} users at {saturation['capacity_rps']} req/s")
+    return {"mix": mix, "documents": documents, "stages": stages, "saturation": saturation}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running app; by default one is started with the mock OpenAI API")
+    parser.add_argument("--users", nargs="+", type=int, default=[1, 2, 4, 8, 16], help="Concurrent users of every stage")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per stage")
+    parser.add_argument("--mix", nargs="+", default=[f"{name}={weight}" for name, weight in DEFAULT_MIX.items()],
+                        help="User profiles and their weights, e.g. reader=6 extractor=3 uploader=1")
+    parser.add_argument("--think", type=float, default=1.0, help="Mean think time between requests, in seconds")
+    parser.add_argument("--documents", type=int, default=3, help="Documents indexed before the test, read by the users")
+    parser.add_argument("--sections", type=int, default=4, help="Size of the generated documents, in sections")
+    parser.add_argument("--scanned", type=float, default=0.1, help="Share of scanned pages of the generated documents")
+    parser.add_argument("--workspace", default="default", help="X-Workspace of the virtual users")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error rate that counts as saturated")
+    parser.add_argument("--slo-p95", type=float, help="p95 latency (ms) of all requests that counts as saturated")
+    parser.add_argument("--workers", type=int, default=1, help="Workers of the local app, more than 1 runs gunicorn")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Seconds per mock chat completion")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per mock embedding request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock OpenAI requests failing")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    try:
+        # A few distinct tenders, re-uploaded under new names by the uploaders
+        pool = [generate_rfp_pdf(os.path.join(workdir, "rfps", f"rfp_{seed + 1}.pdf"), args.sections, args.scanned, seed)["path"]
+                for seed in range(4)]
+
+        if args.url:
+            report = run_load_test(args.url.rstrip("/"), args, pool)
+        else:
+            mock = MockOpenAIServer(chat_latency=args.chat_latency, embed_latency=args.embed_latency,
+                                    error_rate=args.error_rate).start()
+            try:
+                with running_app(workdir, mock.url, args.workers) as (base_url, _):
+                    report = run_load_test(base_url, args, pool)
+            finally:
+                mock.shutdown()
+            report["mock_requests"] = dict(mock.requests)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), **report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Local stand-in for the OpenAI API, so the app can be benchmarked end to end without network or costs.
+
+Answers `POST /v1/embeddings` with the vectors of `HashingEmbeddings` (similar texts get similar vectors)
+and `POST /v1/chat/completions` with a short answer, or a call of the first tool with a placeholder for
+every field. Both wait a configurable latency first, like the real API does, and report token usage. Chat
+completions also report cached prompt tokens like OpenAI's prompt cache: the longest prefix (tools, then
+messages) shared with a recent prompt, in steps of 128 tokens from 1024.
+
+The app uses it when OPENAI_BASE_URL points to it:
+
+    python -m benchmarks.mock_openai --port 8900 --chat-latency 0.8
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=mock uvicorn backend.api:app
+"""
+import argparse
+import base64
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fakes import HashingEmbeddings
+from utils.chunking import count_tokens
+
+EMBEDDING_DIM = 3072 # text-embedding-3-large
+CACHE_MIN_TOKENS = 1024 # OpenAI caches prompts from 1024 tokens, in steps of 128
+CACHE_STEP_TOKENS = 128
+CACHED_PROMPTS = 256 # Recent prompts kept for the prefix matching
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    HTTP server of the mock API, one thread per connection.
+
+    Parameters:
+        port (int): Port to listen on, 0 for a free one.
+        chat_latency (float): Seconds before every chat completion.
+        embed_latency (float): Seconds before every embedding request.
+        jitter (float): Latencies vary uniformly by this share, e.g. 0.2 for +/- 20%.
+        error_rate (float): Share of the requests answered with a 500 error.
+        dim (int): Dimensions of the embeddings.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, chat_latency: float = 0.8, embed_latency: float = 0.05,
+                 jitter: float = 0.2, error_rate: float = 0.0, dim: int = EMBEDDING_DIM):
+        super().__init__(("127.0.0.1", port), MockOpenAIHandler)
+        self.chat_latency = chat_latency
+        self.embed_latency = embed_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.embeddings = HashingEmbeddings(dim)
+        self.requests = {"chat": 0, "embeddings": 0, "errors": 0}
+        self.prompt_tokens = {"total": 0, "cached": 0}
+        self._prompts = deque(maxlen=CACHED_PROMPTS)
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        """Serves in a background thread, returns the server."""
+
+        threading.Thread(target=self.serve_forever, name="mock-openai", daemon=True).start()
+        return self
+
+    def wait(self, latency: float):
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, latency * factor))
+
+    def count(self, kind: str) -> bool:
+        """Counts a request, returns False if it must fail."""
+
+        with self._lock:
+            self.requests[kind] += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.requests["errors"] += 1
+        return not failed
+
+    def cached_tokens(self, prompt: str, prompt_tokens: int) -> int:
+        """Tokens of the longest prefix of `prompt` shared with a recent prompt, like OpenAI's prompt cache."""
+
+        cached = 0
+        if prompt_tokens >= CACHE_MIN_TOKENS:
+            with self._lock:
+                recent = list(self._prompts)
+            shared = max((_common_prefix(prompt, other) for other in recent), default=0)
+            tokens = count_tokens(prompt[:shared]) if shared else 0
+            if tokens >= CACHE_MIN_TOKENS:
+                cached = min(tokens, prompt_tokens) // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS
+
+        with self._lock:
+            self._prompts.append(prompt)
+            self.prompt_tokens["total"] += prompt_tokens
+            self.prompt_tokens["cached"] += cached
+        return cached
+
+
+def _common_prefix(a: str, b: str) -> int:
+    """Length of the common prefix of two strings, by bisection on slice comparisons."""
+
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _placeholder(name: str, schema: dict):
+    """Value of a tool argument: a string mentioning the field, whatever its declared type."""
+
+    types = [schema.get("type")] + [option.get("type") for option in schema.get("anyOf", [])]
+    if "string" in types:
+        return f"Mock {name.replace('_', ' ')}"
+    if "integer" in types or "number" in types:
+        return 1
+    if "array" in types:
+        return []
+    return None
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    server: MockOpenAIServer
+    protocol_version = "HTTP/1.1" # Keep-alive, like the OpenAI client expects
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/embeddings"):
+            kind, handler, latency = "embeddings", self._embeddings, self.server.embed_latency
+        elif self.path.endswith("/chat/completions"):
+            kind, handler, latency = "chat", self._chat, self.server.chat_latency
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        self.server.wait(latency)
+        if not self.server.count(kind):
+            self._send(500, {"error": {"message": "Injected failure", "type": "server_error"}})
+            return
+        self._send(200, handler(body))
+
+    def _embeddings(self, body: dict) -> dict:
+        inputs = body.get("input", [])
+        # A single text or tokens, or a list of them: the client sends token ids by default
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        data, tokens = [], 0
+        for ind, item in enumerate(inputs):
+            if isinstance(item, str):
+                text = item
+                tokens += count_tokens(item)
+            else:
+                text = " ".join(f"t{token}" for token in item) # Same tokens, same words, same vector
+                tokens += len(item)
+
+            vector = self.server.embeddings._embed(text)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": ind, "embedding": vector})
+
+        return {"object": "list", "data": data, "model": body.get("model", ""),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def _chat(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        prompt = "\n".join(message.get("content") or "" for message in messages if isinstance(message.get("content"), str))
+        tools = body.get("tools") or []
+        # The tool definitions come first in the prompt, like the real API
+        tools_text = json.dumps(tools, sort_keys=True) if tools else ""
+        prompt_tokens = count_tokens(tools_text + prompt)
+        cached_tokens = self.server.cached_tokens(tools_text + prompt, prompt_tokens)
+
+        if tools:
+            function = tools[0]["function"]
+            properties = function.get("parameters", {}).get("properties", {})
+            arguments = json.dumps({name: _placeholder(name, schema) for name, schema in properties.items()})
+            message = {"role": "assistant", "content": None, "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                "function": {"name": function["name"], "arguments": arguments}}]}
+            finish_reason, completion_tokens = "tool_calls", count_tokens(arguments)
+        else:
+            # The first words of the prompt context, so answers differ with the retrieved chunks
+            answer = "Based on the provided context: " + " ".join(prompt.split()[40:80])
+            message = {"role": "assistant", "content": answer}
+            finish_reason, completion_tokens = "stop", count_tokens(answer)
+
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Seconds per chat completion")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency variation, as a share")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 500")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM, help="Embedding dimensions")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.port, args.chat_latency, args.embed_latency, args.jitter, args.error_rate, args.dim)
+    print(f"Mock OpenAI API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+End-to-end benchmark of the API, offline: the app runs against a local mock of the OpenAI API
+(`benchmarks.mock_openai`) and ingests generated RFP PDFs (`benchmarks.rfp_pdfs`), some pages scanned.
+
+The app is started with uvicorn (or gunicorn with --workers) in a temporary directory, so its uploads,
+vector stores and caches start empty. Reported:
+
+- ingest: pages/sec of the first query of every document, which parses, OCRs, chunks, embeds and stores
+  it (the "ingest" stage of the Server-Timing header, see `utils.telemetry`)
+- store: size on disk of the vector stores, per page
+- peak RSS: peak resident memory of the app processes (Linux only)
+- latency: p50/p95 of /extract-data/ and /query-document/ with --concurrency requests in flight
+
+The JSON report (--json) records the settings and the git revision; --baseline prints the change
+of the main numbers against an earlier report, e.g. of the previous release.
+
+Usage:
+    python -m benchmarks.offline_benchmark
+    python -m benchmarks.offline_benchmark --sections 2 5 12 --scanned 0.2 --concurrency 8 --json report.json
+    python -m benchmarks.offline_benchmark --chat-latency 0.2 --baseline report_v1.json
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from benchmarks.mock_openai import MockOpenAIServer
+from benchmarks.rfp_pdfs import generate_rfp_pdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMAS = ["keydates", "contact", "submission", "procurement", "project"]
+QUERIES = [
+    "What is the bid security amount?",
+    "When is the proposal submission deadline?",
+    "Where should requests for clarification be sent?",
+    "What is the duration of the assignment?",
+    "What are the evaluation criteria weights?",
+]
+
+
+# ---------- App process ----------
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_health(base_url: str, process: subprocess.Popen, timeout: float):
+    import requests
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"The app exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"The app did not answer on {base_url} within {timeout}s")
+
+
+@contextmanager
+def running_app(workdir: str, openai_url: str, workers: int = 1, env: dict | None = None,
+                timeout: float = 120) -> Iterator[tuple]:
+    """
+    Runs the API in `workdir` against the mock OpenAI API at `openai_url`, yields (base_url, process).
+
+    One worker runs under uvicorn, more under gunicorn with the settings of `gunicorn.conf.py`.
+    """
+    port = _free_port()
+    app_env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+        "OPENAI_API_KEY": "mock-key",
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_BASE": openai_url,
+        "SERVER_TIMING": "true",
+        "WARMUP_STORES": "0",
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(workers),
+        **(env or {}),
+    }
+    if workers > 1:
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py"), "backend.api:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(port), "--log-level", "warning"]
+
+    with open(os.path.join(workdir, "app.log"), "wb") as log:
+        process = subprocess.Popen(command, cwd=workdir, env=app_env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_for_health(base_url, process, timeout)
+        yield base_url, process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def peak_rss_mb(pid: int) -> float | None:
+    """Peak resident memory (VmHWM) of a process and its children, in MB. None where /proc is missing."""
+
+    def read_peak(pid: int) -> int:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+            children = [int(child) for child in f.read().split()]
+        return round(sum(read_peak(process) for process in [pid] + children) / 1e6, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def folder_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+# ---------- Measures ----------
+def parse_server_timing(header: str) -> dict:
+    """Parses a Server-Timing header into {stage: milliseconds}."""
+
+    timings = {}
+    for entry in filter(None, (entry.strip() for entry in (header or "").split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            if param.startswith("dur="):
+                timings[name] = float(param[len("dur="):])
+    return timings
+
+
+def latency_summary(latencies: List[float], errors: int = 0, seconds: float | None = None) -> dict:
+    """p50/p95/p99/max of latencies in seconds, in milliseconds, with the error count and the throughput."""
+
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float | None:
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+    summary = {
+        "requests": len(ordered) + errors,
+        "errors": errors,
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1) if ordered else None,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 1) if ordered else None,
+    }
+    if seconds:
+        summary["throughput_rps"] = round(len(ordered) / seconds, 2)
+    return summary
+
+
+def upload(base_url: str, path: str, workspace: str = "default", session=None):
+    import requests
+
+    with open(path, "rb") as f:
+        return (session or requests).post(f"{base_url}/upload-pdf/", files={"file": (os.path.basename(path), f, "application/pdf")},
+                                          headers={"X-Workspace": workspace}, timeout=300)
+
+
+def ingest_documents(base_url: str, documents: List[dict]) -> List[dict]:
+    """Uploads the documents and indexes them one at a time with a first query, returns their ingest measures."""
+
+    import requests
+
+    results = []
+    for document in documents:
+        filename = os.path.basename(document["path"])
+        response = upload(base_url, document["path"])
+        response.raise_for_status()
+
+        start = time.perf_counter()
+        response = requests.get(f"{base_url}/query-document/", {"filepath": filename, "query": QUERIES[0]}, timeout=900)
+        request_s = time.perf_counter() - start
+        response.raise_for_status()
+
+        timings = parse_server_timing(response.headers.get("Server-Timing", ""))
+        # Without the ingest stage (e.g. the shared store), the whole first query is counted
+        ingest_s = timings["ingest"] / 1000 if "ingest" in timings else request_s
+        results.append({
+            "document": filename, "pages": document["pages"], "scanned_pages": document["scanned_pages"],
+            "pdf_kb": round(document["bytes"] / 1024, 1), "ingest_s": round(ingest_s, 3),
+            "pages_per_s": round(document["pages"] / ingest_s, 2), "first_query_s": round(request_s, 3),
+        })
+    return results
+
+
+def measure_latency(base_url: str, filenames: List[str], n_requests: int, concurrency: int) -> dict:
+    """Sends `n_requests` extractions and `n_requests` queries, `concurrency` at a time, over the ingested documents."""
+
+    import requests
+
+    sessions = threading.local()
+    jobs = []
+    for ind, (filename, schema, query) in zip(range(n_requests),
+                                             zip(itertools.cycle(filenames), itertools.cycle(SCHEMAS), itertools.cycle(QUERIES))):
+        jobs.append(("/extract-data/", {"filepath": filename, "schema_name": schema}))
+        jobs.append(("/query-document/", {"filepath": filename, "query": query}))
+
+    def run(job):
+        endpoint, params = job
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = sessions.session.get(f"{base_url}{endpoint}", params=params, timeout=300).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return endpoint, time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(run, jobs))
+    seconds = time.perf_counter() - start
+
+    report = {}
+    for endpoint in ("/extract-data/", "/query-document/"):
+        latencies = [latency for name, latency, ok in results if name == endpoint and ok]
+        errors = sum(1 for name, _, ok in results if name == endpoint and not ok)
+        report[endpoint] = latency_summary(latencies, errors, seconds)
+    return report
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------- Report ----------
+def _main_numbers(report: dict) -> dict:
+    numbers = {
+        "ingest pages/s": report["ingest"]["pages_per_s"],
+        "store KB/page": report["store"]["kb_per_page"],
+        "peak RSS MB": report["peak_rss_mb"],
+        "cached prompt share": report.get("prompt_cache", {}).get("cached_share"),
+    }
+    for endpoint, summary in report["latency"].items():
+        numbers[f"{endpoint} p50 ms"] = summary["p50_ms"]
+        numbers[f"{endpoint} p95 ms"] = summary["p95_ms"]
+    return numbers
+
+
+def print_comparison(report: dict, baseline: dict):
+    print(f"\nAgainst {baseline.get('revision') or 'baseline'} ({baseline.get('created', '')}):")
+    current, previous = _main_numbers(report), _main_numbers(baseline)
+    for name, value in current.items():
+        old = previous.get(name)
+        change = f"{(value - old) / old * 100:+.1f}%" if value is not None and old else "n/a"
+        print(f"    {name:<28} {old!s:>10} -> {value!s:>10}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", nargs="+", type=int, default=[2, 5, 12], help="Size of every document, in sections (about 4 pages each)")
+    parser.add_argument("--scanned", type=float, default=0.2, help="Share of scanned pages")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per endpoint in the latency phase")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight in the latency phase")
+    parser.add_argument("--workers", type=int, default=1, help="App workers, more than 1 runs gunicorn")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="Seconds per mock chat completion")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per mock embedding request")
+    parser.add_argument("--vector-backend", choices=["chroma", "flat"], help="VECTOR_BACKEND of the app")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    mock = MockOpenAIServer(chat_latency=args.chat_latency, embed_latency=args.embed_latency).start()
+    workdir = tempfile.mkdtemp(prefix="offline_benchmark_")
+    env = {"VECTOR_BACKEND": args.vector_backend} if args.vector_backend else {}
+
+    try:
+        documents = [generate_rfp_pdf(os.path.join(workdir, "rfps", f"rfp_{seed + 1}.pdf"), n_sections, args.scanned, seed)
+                     for seed, n_sections in enumerate(args.sections)]
+        print(f"{len(documents)} documents, {sum(d['pages'] for d in documents)} pages "
+              f"({sum(d['scanned_pages'] for d in documents)} scanned), working directory {workdir}\n")
+
+        with running_app(workdir, mock.url, args.workers, env) as (base_url, process):
+            ingest = ingest_documents(base_url, documents)
+            print(f"{'document':<12} {'pages':>6} {'scanned':>8} {'ingest s':>9} {'pages/s':>8}")
+            for result in ingest:
+                print(f"{result['document']:<12} {result['pages']:>6} {result['scanned_pages']:>8} {result['ingest_s']:>9} {result['pages_per_s']:>8}")
+
+            latency = measure_latency(base_url, [result["document"] for result in ingest], args.requests, args.concurrency)
+            peak_rss = peak_rss_mb(process.pid)
+
+        pages = sum(result["pages"] for result in ingest)
+        ingest_s = sum(result["ingest_s"] for result in ingest)
+        store_bytes = folder_size(os.path.join(workdir, "vectorestores"))
+        report = {
+            "revision": git_revision(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "settings": vars(args),
+            "ingest": {"pages": pages, "seconds": round(ingest_s, 3), "pages_per_s": round(pages / ingest_s, 2),
+                       "documents": ingest},
+            "store": {"bytes": store_bytes, "kb_per_page": round(store_bytes / 1024 / pages, 1)},
+            "peak_rss_mb": peak_rss,
+            "latency": latency,
+            "mock_requests": dict(mock.requests),
+            # Share of the prompt tokens the real API would have read from its prompt cache
+            "prompt_cache": {**mock.prompt_tokens,
+                             "cached_share": round(mock.prompt_tokens["cached"] / max(mock.prompt_tokens["total"], 1), 3)},
+        }
+
+        print(f"\ningest: {report['ingest']['pages_per_s']} pages/s, store: {report['store']['kb_per_page']} KB/page, "
+              f"peak RSS: {peak_rss} MB, cached prompt tokens: {report['prompt_cache']['cached_share'] * 100:.1f}%\n")
+        print(f"{'endpoint':<18} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>7}  (concurrency {args.concurrency})")
+        for endpoint, summary in latency.items():
+            print(f"{endpoint:<18} {summary['requests']:>9} {summary['errors']:>7} {summary['p50_ms']!s:>8} "
+                  f"{summary['p95_ms']!s:>8} {summary['throughput_rps']!s:>7}")
+    finally:
+        mock.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
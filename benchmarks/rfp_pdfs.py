@@ -0,0 +1,227 @@
+"""
+Generates RFP-like PDF files for the offline benchmarks, without any PDF library.
+
+The text is the synthetic RFP of `benchmarks.chunking_benchmark` (numbered sections, filler, facts and a
+milestone table), laid out with Helvetica on Letter pages. Tables are drawn with ruling lines, so pdfplumber
+finds them like in real tenders. A share of the pages can be "scanned": the page is rendered to an image,
+with no text layer, so the app has to OCR it. Scanned pages need Pillow (installed with pdf2image); without it
+all the pages are native text.
+
+Usage:
+    python -m benchmarks.rfp_pdfs --out rfps --sections 2 5 12 --scanned 0.2
+"""
+import argparse
+import os
+import random
+import textwrap
+import zlib
+from typing import List, Tuple
+
+from benchmarks.chunking_benchmark import generate_document
+from utils.page_model import BLOCK_TABLE
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 56
+FONT_SIZE = 10
+LINE_HEIGHT = 13
+SCAN_DPI = 150
+WRAP_CHARS = 95
+
+Line = Tuple[str, object] # ("text", str) or ("table", rows)
+
+
+def _escape(text: str) -> str:
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _layout(lines: List[Line]) -> List[List[tuple]]:
+    """Places the lines and tables on pages: [[("text", x, y, str) | ("rule", x0, y0, x1, y1)]] in PDF points."""
+
+    pages, items, y = [], [], PAGE_HEIGHT - MARGIN
+
+    def new_page():
+        nonlocal items, y
+        if items:
+            pages.append(items)
+        items, y = [], PAGE_HEIGHT - MARGIN
+
+    for kind, value in lines:
+        if kind == "text":
+            if y < MARGIN:
+                new_page()
+            items.append(("text", MARGIN, y, value))
+            y -= LINE_HEIGHT
+            continue
+
+        # Tables: one row per line, cells in equal columns, ruled
+        rows = value
+        height = (len(rows) + 1) * (LINE_HEIGHT + 6)
+        if y - height < MARGIN:
+            new_page()
+        y -= 6
+        column_width = (PAGE_WIDTH - 2 * MARGIN) / max(len(row) for row in rows)
+        top = y + LINE_HEIGHT - 2
+        for row in rows:
+            for ind, cell in enumerate(row):
+                items.append(("text", MARGIN + ind * column_width + 4, y, str(cell or "")))
+            y -= LINE_HEIGHT + 6
+        bottom = y + LINE_HEIGHT - 2
+        for ind in range(len(rows) + 1):
+            row_y = top - ind * (LINE_HEIGHT + 6)
+            items.append(("rule", MARGIN, row_y, PAGE_WIDTH - MARGIN, row_y))
+        for ind in range(len(rows[0]) + 1):
+            x = MARGIN + ind * column_width
+            items.append(("rule", x, top, x, bottom))
+        y -= LINE_HEIGHT
+
+    new_page()
+    return pages
+
+
+def _text_stream(items: List[tuple]) -> bytes:
+    ops = []
+    for item in items:
+        if item[0] == "text":
+            _, x, y, text = item
+            ops.append(f"BT /F1 {FONT_SIZE} Tf {x:.1f} {y:.1f} Td ({_escape(text)}) Tj ET")
+        else:
+            _, x0, y0, x1, y1 = item
+            ops.append(f"0.5 w {x0:.1f} {y0:.1f} m {x1:.1f} {y1:.1f} l S")
+    return "\n".join(ops).encode("latin-1")
+
+
+def _scanned_image(items: List[tuple], rng: random.Random):
+    """Renders the page like a scanner would: grayscale, slightly noisy. Returns (width, height, pixels) or None."""
+
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        return None
+
+    scale = SCAN_DPI / 72
+    width, height = int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=int(FONT_SIZE * scale))
+    except TypeError: # Pillow < 10.1 has a single bitmap font size
+        font = ImageFont.load_default()
+
+    for item in items:
+        if item[0] == "text":
+            _, x, y, text = item
+            draw.text((x * scale, (PAGE_HEIGHT - y - FONT_SIZE) * scale), text, fill=rng.randint(0, 40), font=font)
+        else:
+            _, x0, y0, x1, y1 = item
+            draw.line((x0 * scale, (PAGE_HEIGHT - y0) * scale, x1 * scale, (PAGE_HEIGHT - y1) * scale), fill=0, width=2)
+
+    # Scanner noise
+    pixels = image.load()
+    for _ in range(width * height // 400):
+        pixels[rng.randrange(width), rng.randrange(height)] = rng.randint(150, 230)
+    return width, height, image.tobytes()
+
+
+def write_pdf(path: str, pages: List[List[tuple]], scanned: set, seed: int = 0) -> int:
+    """Writes the laid out pages to `path`, the page numbers (0-based) in `scanned` as images. Returns the page count."""
+
+    rng = random.Random(seed)
+    objects = [] # Object bodies, object n is objects[n - 1]
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    def stream(header: str, data: bytes) -> bytes:
+        return f"<< {header} /Length {len(data)} >>\nstream\n".encode("latin-1") + data + b"\nendstream"
+
+    catalog = add(b"") # Filled in at the end, when the page tree is known
+    page_tree = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    page_ids = []
+    for ind, items in enumerate(pages):
+        image = _scanned_image(items, rng) if ind in scanned else None
+        if image is None:
+            content = add(stream("/Filter /FlateDecode", zlib.compress(_text_stream(items))))
+            resources = f"<< /Font << /F1 {font} 0 R >> >>"
+        else:
+            width, height, pixels = image
+            xobject = add(stream(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                 f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode", zlib.compress(pixels)))
+            content = add(stream("", f"q {PAGE_WIDTH} 0 0 {PAGE_HEIGHT} 0 0 cm /Im1 Do Q".encode("latin-1")))
+            resources = f"<< /XObject << /Im1 {xobject} 0 R >> >>"
+
+        page_ids.append(add(f"<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                            f"/Resources {resources} /Contents {content} 0 R >>".encode("latin-1")))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {page_tree} 0 R >>".encode("latin-1")
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[page_tree - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("latin-1")
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n"
+
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(output)
+    return len(pages)
+
+
+def generate_rfp_pdf(path: str, n_sections: int = 5, scanned_share: float = 0.0, seed: int = 0) -> dict:
+    """
+    Writes a synthetic RFP of `n_sections` sections (about 4 pages each) to `path`.
+
+    Parameters:
+        path (str): Output PDF file.
+        n_sections (int): Size of the document.
+        scanned_share (float): Share of the pages rendered as scanned images, needing OCR.
+        seed (int): Seed of the text and of the scanned pages.
+
+    Returns:
+        dict: {"path", "pages", "scanned_pages", "bytes", "questions"}, the questions being those of
+            `generate_document`, answerable from the document.
+    """
+    parsed, questions = generate_document(n_sections=n_sections, seed=seed)
+
+    lines: List[Line] = []
+    for page in parsed.pages:
+        for block in page.blocks:
+            if block.kind == BLOCK_TABLE:
+                lines.append(("table", block.rows))
+            else:
+                lines.extend(("text", line) for text_line in block.text.splitlines()
+                             for line in textwrap.wrap(text_line, WRAP_CHARS) or [""])
+
+    pages = _layout(lines)
+    rng = random.Random(seed)
+    scanned = set(rng.sample(range(len(pages)), round(len(pages) * scanned_share)))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    n_pages = write_pdf(path, pages, scanned, seed=seed)
+    return {"path": path, "pages": n_pages, "scanned_pages": len(scanned), "bytes": os.path.getsize(path),
+            "questions": questions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="benchmark_rfps", help="Output directory")
+    parser.add_argument("--sections", nargs="+", type=int, default=[2, 5, 12], help="Size of every document, in sections")
+    parser.add_argument("--scanned", type=float, default=0.2, help="Share of scanned pages")
+    args = parser.parse_args()
+
+    for seed, n_sections in enumerate(args.sections):
+        info = generate_rfp_pdf(os.path.join(args.out, f"rfp_{seed + 1}.pdf"), n_sections, args.scanned, seed)
+        print(f"{info['path']}: {info['pages']} pages, {info['scanned_pages']} scanned, {info['bytes'] // 1024} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Startup profile of the API: how long importing the app takes and which packages it spends it on.
+
+Every module is imported in a fresh interpreter with `python -X importtime`; the report lists the import
+time of the module and the packages with the largest self time (time spent in their own module code,
+children excluded). `backend.api` should stay light: the extraction and RAG pipelines and the Dash UI
+are imported on first use, so they are listed separately to show what the first request pays.
+
+With --serve, the API is started with uvicorn and the time to the first 200 of /health (process up)
+and /ready (worker warm, needs an OpenAI key) is measured.
+
+Usage:
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --modules backend.api --top 25
+    python -m benchmarks.startup_profile --serve --json startup.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+DEFAULT_MODULES = ["backend.api", "backend.extraction_and_rag_service", "ui"]
+
+
+def profile_import(module: str) -> dict:
+    """Imports `module` in a fresh interpreter and aggregates the `-X importtime` report by top-level package."""
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    wall_s = time.perf_counter() - start
+
+    packages = defaultdict(int)
+    modules = 0
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules += 1
+        packages[name.strip().split(".")[0]] += int(self_us)
+        # Modules are listed after their imports: the last one is `module`, its cumulative time covers the import
+        total_us = int(cumulative_us)
+
+    return {
+        "module": module,
+        "ok": result.returncode == 0,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode else "",
+        "wall_s": round(wall_s, 3),
+        "import_s": round(total_us / 1e6, 3),
+        "modules": modules,
+        "packages": sorted(({"package": name, "self_s": round(us / 1e6, 3)} for name, us in packages.items()),
+                           key=lambda item: -item["self_s"]),
+    }
+
+
+def _wait_for(url: str, timeout: float) -> float | None:
+    """Polls `url` until it answers 200, returns the seconds waited or None on timeout."""
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return round(time.perf_counter() - start, 3)
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def profile_serve(port: int, timeout: float) -> dict:
+    """Starts the API with uvicorn and measures the time to the first /health and /ready answers."""
+
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        health_s = _wait_for(f"http://127.0.0.1:{port}/health", timeout)
+        ready_s = _wait_for(f"http://127.0.0.1:{port}/ready", timeout) if health_s is not None else None
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    # /ready is measured from process start too
+    return {"health_s": health_s, "ready_s": None if ready_s is None else round(health_s + ready_s, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=12, help="Packages listed per module")
+    parser.add_argument("--serve", action="store_true", help="Also time /health and /ready of a uvicorn server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    baseline = profile_import("os")["wall_s"] # Interpreter start-up, paid whatever is imported
+    print(f"interpreter start-up: {baseline:.3f}s\n")
+
+    report = {"interpreter_s": baseline, "imports": []}
+    for module in args.modules:
+        result = profile_import(module)
+        report["imports"].append(result)
+        if not result["ok"]:
+            print(f"{module}: import failed ({result['error']})\n")
+            continue
+
+        print(f"{module}: {result['import_s']:.3f}s import, {result['wall_s']:.3f}s process, {result['modules']} modules")
+        for item in result["packages"][:args.top]:
+            print(f"    {item['package']:<32} {item['self_s']:>7.3f}s")
+        print()
+
+    if args.serve:
+        report["serve"] = profile_serve(args.port, args.timeout)
+        print(f"uvicorn: /health after {report['serve']['health_s']}s, /ready after {report['serve']['ready_s']}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark of the vector backends (see `backend.vector_index`): Chroma against the flat NumPy index.
+
+Synthetic RFPs are chunked like the app does, embedded with a local stand-in embedding model of the
+size of text-embedding-3-large, and saved with every backend. The stores are then opened and queried
+in a fresh process, like a worker after a restart. Reported per backend:
+
+- build ms: time to embed and persist one document (the stand-in embedding cost is the same for both)
+- disk KB: size of one store on disk
+- open ms: time to open one existing store
+- query p50/p95 ms: latency of the MMR search used by `run_rag` (k=5, fetch_k=20)
+- filtered ms: the same search with a page and content type filter
+- RAM MB: private resident memory added by opening all the stores and querying them once, paid by every worker
+- shared MB: resident memory backed by the files of the stores (memory-mapped), shared by all the workers
+
+Chroma is skipped if `langchain_chroma` is not installed.
+
+Usage:
+    python -m benchmarks.vector_backend_benchmark
+    python -m benchmarks.vector_backend_benchmark --docs 50 --backends flat --json report.json
+"""
+import argparse
+import json
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List
+
+from benchmarks.chunking_benchmark import generate_document
+from benchmarks.fakes import HashingEmbeddings
+from utils.chunking import ChunkingConfig, chunk_document
+
+EMBEDDING_DIM = 3072 # text-embedding-3-large
+QUERIES = [
+    "What is the bid security amount?",
+    "When is the proposal submission deadline?",
+    "Who is the contact person of the client?",
+    "What is the duration of the assignment?",
+    "What are the evaluation criteria weights?",
+]
+
+
+def _memory_bytes() -> tuple:
+    """
+    Current (private, shared) resident memory of the process. Shared memory is backed by files, e.g.
+    memory-mapped indexes, and is counted once in the page cache for all the workers.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            _, resident, shared = (int(value) * os.sysconf("SC_PAGE_SIZE") for value in f.read().split()[:3])
+        return resident - shared, shared
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 0 # peak, not current, on this platform
+
+
+def _folder_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def _build(backend: str, chunks, persist_path: str, embeddings):
+    if backend == "flat":
+        from backend.vector_index import FlatVectorIndex
+        return FlatVectorIndex.from_documents(chunks, embeddings, persist_path=persist_path)
+
+    from langchain_chroma import Chroma
+    return Chroma.from_documents(chunks, embedding=embeddings, persist_directory=persist_path,
+                                 collection_name="project_rfp")
+
+
+def _open(backend: str, persist_path: str, embeddings):
+    if backend == "flat":
+        from backend.vector_index import FlatVectorIndex
+        return FlatVectorIndex.load(persist_path, embeddings)
+
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=persist_path, embedding_function=embeddings, collection_name="project_rfp")
+
+
+def _measure(backend: str, paths: List[str], dim: int, repeat: int) -> dict:
+    """Runs in a fresh process: opens every store, then queries them."""
+
+    from utils.helper_functions import build_metadata_filter
+
+    embeddings = HashingEmbeddings(dim)
+    # Query vectors are computed up front, so only the search is timed
+    query_vectors = [embeddings.embed_query(query) for query in QUERIES]
+    page_filter = build_metadata_filter(page=3, content_type="text")
+
+    # Imported before the first measure on purpose: imports are not part of the memory of the stores
+    if backend == "flat":
+        import backend.vector_index as preloaded
+    else:
+        import langchain_chroma as preloaded
+    _ = preloaded # Only imported, for its memory
+
+    private_before, shared_before = _memory_bytes()
+    open_ms, stores = [], []
+    for path in paths:
+        start = time.perf_counter()
+        stores.append(_open(backend, path, embeddings))
+        open_ms.append((time.perf_counter() - start) * 1000)
+
+    query_ms, filtered_ms = [], []
+    for _ in range(repeat):
+        for store in stores:
+            for vector in query_vectors:
+                start = time.perf_counter()
+                store.max_marginal_relevance_search_by_vector(vector, k=5, fetch_k=20)
+                query_ms.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                store.max_marginal_relevance_search_by_vector(vector, k=5, fetch_k=20, filter=page_filter)
+                filtered_ms.append((time.perf_counter() - start) * 1000)
+
+    private_after, shared_after = _memory_bytes()
+    return {
+        "open_ms": round(statistics.median(open_ms), 2),
+        "query_p50_ms": round(statistics.median(query_ms), 3),
+        "query_p95_ms": round(statistics.quantiles(query_ms, n=20)[-1], 3),
+        "filtered_p50_ms": round(statistics.median(filtered_ms), 3),
+        "ram_mb": round((private_after - private_before) / 1e6, 1),
+        "shared_mb": round((shared_after - shared_before) / 1e6, 1),
+    }
+
+
+def run_backend(backend: str, documents: list, workdir: str, dim: int, repeat: int) -> dict:
+    embeddings = HashingEmbeddings(dim)
+    paths, build_ms = [], []
+    for ind, chunks in enumerate(documents):
+        path = os.path.join(workdir, backend, f"rfp_{ind}")
+        start = time.perf_counter()
+        _build(backend, chunks, path, embeddings)
+        build_ms.append((time.perf_counter() - start) * 1000)
+        paths.append(path)
+
+    if backend == "chroma":
+        # Chroma keeps its databases open for the whole process
+        from backend.store_manager import release_vector_store
+        for path in paths:
+            release_vector_store(path)
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        measures = pool.apply(_measure, (backend, paths, dim, repeat))
+
+    return {
+        "backend": backend,
+        "build_ms": round(statistics.median(build_ms), 1),
+        "disk_kb": round(statistics.median(_folder_size(path) for path in paths) / 1024, 1),
+        **measures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["chroma", "flat"], choices=["chroma", "flat"])
+    parser.add_argument("--docs", type=int, default=20, help="Number of documents (stores)")
+    parser.add_argument("--sections", type=int, default=12, help="Sections per synthetic document")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM, help="Embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=3, help="Query rounds over all the stores")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    backends = list(args.backends)
+    if "chroma" in backends:
+        if importlib.util.find_spec("langchain_chroma") is None:
+            print("langchain_chroma is not installed, skipping chroma\n")
+            backends.remove("chroma")
+
+    config = ChunkingConfig("section", 384, 48)
+    documents = [chunk_document(generate_document(n_sections=args.sections, seed=seed)[0], config)
+                 for seed in range(args.docs)]
+    n_chunks = sum(len(chunks) for chunks in documents)
+    print(f"{args.docs} documents, {n_chunks // args.docs} chunks per document, {args.dim} dimensions\n")
+    print(f"{'backend':<8} {'build ms':>9} {'disk KB':>9} {'open ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'filtered ms':>12} {'RAM MB':>7} {'shared MB':>10}")
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="vector_backend_benchmark_")
+    try:
+        for backend in backends:
+            result = run_backend(backend, documents, workdir, args.dim, args.repeat)
+            results.append(result)
+            print(f"{backend:<8} {result['build_ms']:>9} {result['disk_kb']:>9} {result['open_ms']:>8} "
+                  f"{result['query_p50_ms']:>8} {result['query_p95_ms']:>8} {result['filtered_p50_ms']:>12} {result['ram_mb']:>7} {result['shared_mb']:>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"documents": args.docs, "chunks": n_chunks, "dim": args.dim, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
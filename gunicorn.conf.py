@@ -0,0 +1,36 @@
+"""
+Gunicorn settings of the multi-worker mode:
+
+    gunicorn -c gunicorn.conf.py backend.api:app
+
+Several uvicorn workers serve the app behind one port. The app is imported once in the master
+(`preload_app`) after the heavy modules are preloaded, and the workers are forked from it, sharing that
+memory copy-on-write. Each worker then creates its own OpenAI clients and opens the recently used vector
+stores (see `backend.warmup`); GET /ready returns 200 once a worker is warm.
+
+Workers share the files on disk (uploads, vector stores, archives, caches and the SQLite document index):
+creating, restoring, archiving and deleting vector stores is serialized across workers with file locks
+(see `backend.file_lock`), and the caches are written atomically.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Extraction and RAG calls wait for the LLM, a worker can be busy for minutes
+timeout = int(os.getenv("WORKER_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    from backend.warmup import preload_modules
+
+    preload_modules()
+
+
+def when_ready(server):
+    server.log.info(f"Serving with {server.cfg.workers} workers, GET /ready reports when each one is warm")
@@ -0,0 +1,91 @@
+from utils.page_model import BLOCK_TEXT, Block, Page, ParsedDocument
+from utils.pre_extraction import find_candidates, resolve_fields
+
+
+def _document(*texts: str, tables: tuple = ()) -> ParsedDocument:
+    blocks = [Block(BLOCK_TEXT, 1, text, (0, 0, 100, 100)) for text in texts]
+    blocks += [Block.table(1, rows, (0, 0, 100, 100)) for rows in tables]
+    return ParsedDocument("rfp.pdf", [Page(1, 612, 792, blocks)])
+
+
+def _resolve(schema_name: str, *texts: str, tables: tuple = ()):
+    return resolve_fields(find_candidates(_document(*texts, tables=tables)), schema_name)
+
+
+def test_labels_right_before_their_value_resolve():
+    resolved, ambiguous = _resolve(
+        "keydates",
+        "RFP No.: UNDP/RFP/2025/014\nDate of issue: 3 February 2025\nSubmission deadline: 12 March 2025 at 10:00 hrs",
+        "Opening date\n13 March 2025",
+        tables=([["Pre-bid meeting", "03/04/2025", "11:00 AM"]],))
+
+    assert resolved == {"Document_num": "UNDP/RFP/2025/014", "issued_date": "3 February 2025",
+                        "final_submission_date": "12 March 2025", "Final_submission_time": "10:00 hrs",
+                        "opening_date": "13 March 2025", "prebid_meeting_date": "03/04/2025",
+                        "prebid_meeting_time": "11:00 AM"}
+    assert ambiguous == {}
+
+
+def test_keyword_inside_a_sentence_is_only_a_hint():
+    resolved, ambiguous = _resolve(
+        "keydates",
+        "This RFP is issued through open competitive bidding, and proposals are due on 12 March 2025.")
+
+    assert resolved == {}
+    assert [candidate["value"] for candidate in ambiguous["final_submission_date"]] == ["12 March 2025"]
+    assert "opening_date" not in ambiguous
+
+
+def test_reference_to_another_document_is_only_a_hint():
+    resolved, ambiguous = _resolve(
+        "keydates",
+        "The services are procured in accordance with the Procurement Manual dated 1 July 2019 of the Ministry.")
+
+    assert "issued_date" not in resolved
+    assert [candidate["value"] for candidate in ambiguous["issued_date"]] == ["1 July 2019"]
+
+
+def test_sentence_broken_over_two_lines_is_only_a_hint():
+    resolved, ambiguous = _resolve("keydates", "Bids will be opened in public on\n13 March 2025")
+
+    assert resolved == {}
+    assert [candidate["value"] for candidate in ambiguous["opening_date"]] == ["13 March 2025"]
+
+
+def test_labelled_value_wins_over_the_same_value_in_a_sentence():
+    resolved, _ = _resolve("keydates", "Proposals submitted after 12 March 2025 will be rejected.",
+                           "Submission deadline: 12 March 2025")
+
+    assert resolved["final_submission_date"] == "12 March 2025"
+
+
+def test_several_values_stay_ambiguous():
+    resolved, ambiguous = _resolve("keydates", "Submission deadline: 12 March 2025",
+                                   "Submission deadline (extended): 19 March 2025")
+
+    assert "final_submission_date" not in resolved
+    assert len(ambiguous["final_submission_date"]) == 2
+
+
+def test_contact_needs_its_label_right_before_the_value():
+    resolved, ambiguous = _resolve(
+        "contact",
+        "Tel: +1 212 906 5000\nEmail: procurement@undp.org",
+        "Complaints may be sent to oversight@undp.org or by phone to the hotline of the Office of Audit.")
+
+    assert resolved == {"phone_number": "+1 212 906 5000"}
+    assert [candidate["value"] for candidate in ambiguous["client_email"]] == ["procurement@undp.org",
+                                                                               "oversight@undp.org"]
+
+    resolved, ambiguous = _resolve("contact", "Our office (phone numbers on the website) +1 212 906 5000")
+    assert resolved == {}
+    assert [candidate["value"] for candidate in ambiguous["phone_number"]] == ["+1 212 906 5000"]
+
+
+def test_clause_numbers_are_not_dates():
+    resolved, ambiguous = _resolve(
+        "keydates",
+        "Submission deadline:\n2.3.14 Late proposals will be rejected.\n1.2.2025 Opening date: 13.03.2025")
+
+    assert "final_submission_date" not in resolved and "final_submission_date" not in ambiguous
+    assert resolved["opening_date"] == "13.03.2025"
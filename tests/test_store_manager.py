@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from backend.file_lock import file_lock
+from backend.store_manager import DocumentDeletedError, TieredStoreManager
+
+STORE = "vectorestores/default/rfp"
+
+
+def test_deletion_waits_for_an_open_reader():
+    manager, reclaimed = TieredStoreManager(), []
+    reading, done = threading.Event(), threading.Event()
+
+    def reader():
+        with manager.acquire(STORE):
+            reading.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    reading.wait(5)
+    timer = threading.Timer(0.2, lambda: (reclaimed.append("before release"), done.set()))
+    timer.start()
+
+    assert manager.delete(STORE, lambda: reclaimed.append("reclaimed"), timeout=5) == "deleted"
+    assert reclaimed == ["before release", "reclaimed"]
+    thread.join()
+
+
+def test_deletion_timing_out_is_reclaimed_by_the_last_reader():
+    manager, reclaimed = TieredStoreManager(), []
+
+    with manager.acquire(STORE):
+        with manager.acquire(STORE):
+            assert manager.delete(STORE, lambda: reclaimed.append(STORE), timeout=0.05) == "pending"
+        assert reclaimed == []
+    assert reclaimed == [STORE]
+
+    # Once reclaimed, the path can be used by a new document of the same name
+    with manager.acquire(STORE):
+        assert manager.in_use(STORE)
+
+
+def test_tombstoned_store_fails_fast():
+    manager = TieredStoreManager()
+
+    with manager.acquire(STORE):
+        manager.delete(STORE, lambda: None, timeout=0)
+        with pytest.raises(DocumentDeletedError):
+            with manager.acquire(STORE):
+                pass
+        with manager.exclusive(STORE) as available:
+            assert not available
+
+
+def test_file_lock_excludes_writers_but_not_readers(tmp_path):
+    lock_dir = str(tmp_path)
+
+    with file_lock(STORE, lock_dir=lock_dir):
+        with file_lock(STORE, blocking=False, lock_dir=lock_dir) as acquired:
+            assert not acquired
+        with file_lock(STORE + ":build", blocking=False, lock_dir=lock_dir) as acquired:
+            assert acquired
+
+    with file_lock(STORE, shared=True, lock_dir=lock_dir):
+        with file_lock(STORE, shared=True, blocking=False, lock_dir=lock_dir) as acquired:
+            assert acquired
+        with file_lock(STORE, blocking=False, lock_dir=lock_dir) as acquired:
+            assert not acquired
@@ -1,7 +1,8 @@
-import requests
-
 from utils import mathjax_utils as mu
 from utils.logger_config import setup_logger
+from backend.api_client import get_api_client, DEFAULT_WORKSPACE
+from backend.errors import ServiceError
+from backend.file_ops import iter_base64_chunks
 
 import dash 
 from dash import html, dcc, Dash
@@ -9,21 +10,10 @@ from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc 
 from dash import dash_table
 from dash import callback_context
-from flask import Flask
-
-import time
+from flask import request
 
 import pandas as pd
 
-import os  
-import base64
-
-# Endpoints of FAST API
-UPLOAD_ENDPOINT = "http://127.0.0.1:8000/upload-pdf/"
-EXTRACTION_ENDPOINT = "http://127.0.0.1:8000/extract-data/"
-RAG_ENDPOINT = "http://127.0.0.1:8000/query-document/"
-DELETE_ENDPOINT = "http://127.0.0.1:8000/delete-file/"
-
 logger = setup_logger(name="frontend", log_file="logs/ui.log")
 logger.info("Starting main application")
 
@@ -35,11 +25,12 @@ logger.info("Starting main application")
 # dash_app.title = "EOI/RFP Assistant"
 
 
-# Check and create a pdf upload directory
-UPLOAD_DIRECTORY = "./uploads"
-
-if not os.path.exists(UPLOAD_DIRECTORY):
-    os.makedirs(UPLOAD_DIRECTORY)
+def current_workspace() -> str:
+    """
+    Returns the workspace of the user making the request. The workspace is set in the `X-Workspace`
+    header by the authenticating proxy in front of the app, otherwise the default workspace is used.
+    """
+    return request.headers.get("X-Workspace", DEFAULT_WORKSPACE)
 
 
 # Creaate a layout of Dash app.
@@ -54,6 +45,9 @@ def create_dash_app():
     mu.inject_mathjax_index(dash_app)
     dash_app.title = "EOI/RFP Assistant"
 
+    # In-process service calls by default, HTTP only for split deployments (RFP_API_MODE=http)
+    api_client = get_api_client()
+
     dash_app.layout = dbc.Container(
         fluid=True,
         style={
@@ -375,6 +369,8 @@ def create_dash_app():
                                                 type="circle",
                                                 color="#707070",
                                                 children= [
+                                                    # Conversation of the selected document, follow-up questions keep its history
+                                                    dcc.Store(id="rag_session"),
                                                     html.Div(
                                                         # mu.render_text_with_mathjax(cleaned_text),
                                                         id="rag_output",
@@ -512,16 +508,16 @@ def create_dash_app():
     )
     def upload_to_api(contents, filename):
         """
-        Callback to handle file uploads via the Dash interface and delegate storage to a FastAPI backend.
+        Callback to handle file uploads via the Dash interface and delegate storage to the service layer.
 
         This callback is triggered when a user uploads a file using the "upload_eoi" Dash `dcc.Upload` component.
-        Instead of saving the file directly within Dash, it forwards the file to a FastAPI endpoint (`UPLOAD_ENDPOINT`)
-        for validation and storage.
+        Instead of saving the file directly within Dash, it hands the file to the API client, which calls the
+        service layer in-process (or the FastAPI `/upload-pdf/` endpoint in split deployments).
 
         Key Behaviors:
         --------------
-        - Decodes the uploaded file content from base64.
-        - Sends the file as a multipart/form-data request to the FastAPI `/upload-pdf/` endpoint.
+        - Decodes the uploaded file content from base64, chunk by chunk.
+        - Streams the decoded chunks to `api_client.upload`.
         - Relies on the backend to:
             - Enforce a maximum file limit (e.g., 3 files).
             - Validate file type (PDF only).
@@ -539,7 +535,7 @@ def create_dash_app():
         Returns:
         --------
         dash.html.Div
-            A styled success or error message, depending on the upload result returned by the FastAPI service.
+            A styled success or error message, depending on the upload result returned by the service layer.
         
         """
         
@@ -547,35 +543,16 @@ def create_dash_app():
             if contents:
                 # Split metadata and base64 content 
                 content_type, content_string = contents.split(",")
-                file_bytes = base64.b64decode(content_string)
+                # Decode chunk by chunk while the file is streamed to disk
+                response = api_client.upload(iter_base64_chunks(content_string), filename, current_workspace())
+                message = response['message']
+                logger.info(message)
+                return html.P(message, style={'color': 'green'})
+
+        except ServiceError as se:
+            logger.info(f'The file cannot uploaded. {se.status_code}: {se.detail}')
+            return html.P(se.detail, style={'color': 'red'})
 
-                # Prepare the request payload
-                files = {
-                    "file": (filename, file_bytes, "application/pdf")
-                }
-            
-                # Send to FastAPI 
-                response = requests.post(UPLOAD_ENDPOINT, files=files)
-
-                if response.status_code == 200:
-                    message = response.json()['message']
-                    logger.info(message)
-                    return html.P(message, style={'color': 'green'})
-                    # return html.Div(
-                    #     [
-                    #         html.P(message, style={'color': 'green'})
-                    #     ]
-                    # )
-                else:
-                    error_message = response.json()['detail']
-                    print(f'The file cannot uploaded. {response.status_code}')
-                    logger.info(error_message) 
-                    return html.P(error_message, style={'color': 'red'})
-                    # return html.Div(
-                    #     [
-                    #         html.P(error_message, style={'color': 'crimson'})
-                    #     ]
-                    # )
         except Exception as e:
             logger.error(f"Something went wrong: {str(e)}")
         
@@ -585,7 +562,7 @@ def create_dash_app():
     @dash_app.callback(
         Output("select_document", "options"),
         [
-            Input("upload_eoi", "contents"),
+            Input("upload_status", "children"),
             Input("initial-load-trigger", "n_intervals"),
             Input("delete_file", "n_clicks"),
         ],
@@ -595,7 +572,7 @@ def create_dash_app():
         ],
         prevent_initial_call=True,
     )
-    def update_radio_items(upload_contents, n_intervals, delete_clicks, uploaded_filename, selected_file):
+    def update_radio_items(upload_status, n_intervals, delete_clicks, uploaded_filename, selected_file):
         """
         Dynamically updates the radio button options (`select_document`) when:
 
@@ -606,13 +583,13 @@ def create_dash_app():
         Core Logic:
         -----------
         - On app load: checks for existing files in the upload directory and lists them.
-        - On upload: if a valid file is uploaded, the radio list is refreshed.
-        - On delete: calls the FastAPI delete endpoint, then refreshes the list.
+        - On upload: once the upload callback has reported its status, the radio list is refreshed.
+        - On delete: deletes the file through the API client, then refreshes the list.
 
         Parameters:
         -----------
-        upload_contents : str or None
-            Base64 content from the upload component, only used to detect upload trigger.
+        upload_status : dash component or None
+            Upload status message, only used to detect upload trigger.
         n_intervals : int
             Interval value from `dcc.Interval` used to detect app load.
         delete_clicks : int
@@ -631,8 +608,7 @@ def create_dash_app():
         triggered_id = callback_context.triggered[0]["prop_id"].split(".")[0]
 
         # Handle file upload
-        if triggered_id == "upload_eoi":
-            time.sleep(1)
+        if triggered_id == "upload_status":
             if not uploaded_filename: # If user does cancels file upload
                 raise dash.exceptions.PreventUpdate
 
@@ -641,19 +617,18 @@ def create_dash_app():
             if not selected_file: # If user does not selecs any file
                 raise dash.exceptions.PreventUpdate
             try:
-                delete_url = f"http://127.0.0.1:8000/delete-file/{selected_file}"
-                response = requests.delete(delete_url)
-                if response.status_code == 200:
-                    logger.info(response.json()['file_message'])
-                    logger.info(response.json()['folder_message'])
-                else:
-                    logger.info(response.json()['detail'])
+                messages = api_client.delete(selected_file, current_workspace())
+                logger.info(messages['file_message'])
+                logger.info(messages['folder_message'])
 
-            except Exception as e:
+            except ServiceError as se:
+                logger.info(se.detail)
+
+            except Exception:
                 logger.error("Something went srong while deleting the file")
 
-        # Scan and return current files in upload directory
-        files = [f for f in os.listdir(UPLOAD_DIRECTORY)]
+        # Return current files in upload directory
+        files = api_client.list_documents(current_workspace())
         return [{"label": f[:-4], "value": f} for f in files]
 
 
@@ -716,23 +691,50 @@ def create_dash_app():
         """
         if file_selected and schema_selected:
             try:
-                # Send GET request to FastAPI
-                params = {"filepath": file_selected, "schema_name": schema_selected}
-                response = requests.get(EXTRACTION_ENDPOINT, params)
-
-                if response.status_code == 200:
-                    payload = response.json()
-                    logger.info(f"Succesfull extracted data of {schema_selected}. ")
-                    return payload['rows'], payload['cols']
-                else:
-                    logger.info(f"Extraction of data related to {schema_selected} did not happened.")
-                    return [], []
+                payload = api_client.extract(file_selected, schema_selected, current_workspace())
+                logger.info(f"Succesfull extracted data of {schema_selected}. ")
+                return payload['rows'], payload['cols']
+
+            except ServiceError as se:
+                logger.info(f"Extraction of data related to {schema_selected} did not happened. {se.detail}")
+                return [], []
 
             except Exception as e:
                 logger.error(f"Extraction API error: {str(e)}")
                 return [], []
         return [], []
-            
+
+
+    # Call back to show the pre-extracted fields while the extraction runs
+    @dash_app.callback(
+        Output("data_table", "data", allow_duplicate=True),
+        Output("data_table", "columns", allow_duplicate=True),
+        State("select_document", "value"),
+        Input("dropdown", "value"),
+        prevent_initial_call=True,
+    )
+    def show_pre_extracted(file_selected, schema_selected):
+        """
+        Callback filling the Dash DataTable with the fields found by the pre-extraction rules (dates, emails,
+        phone numbers, document number), within a moment of the schema selection. `auto_extract` replaces
+        them with the complete extraction once the LLM is done.
+
+        If nothing was pre-extracted, the table is left as it is.
+        """
+        if not (file_selected and schema_selected):
+            raise dash.exceptions.PreventUpdate
+
+        try:
+            payload = api_client.pre_extracted(file_selected, schema_selected, current_workspace())
+        except ServiceError as se:
+            logger.info(f"No pre-extracted {schema_selected} fields. {se.detail}")
+            raise dash.exceptions.PreventUpdate
+        except Exception as e:
+            logger.error(f"Pre-extraction API error: {str(e)}")
+            raise dash.exceptions.PreventUpdate
+
+        return payload['rows'], payload['cols']
+
 
 
     # Callback to download the csv.
@@ -771,19 +773,22 @@ def create_dash_app():
     # Callback for rag
     @dash_app.callback(
         Output("rag_output", "children"),
+        Output("rag_session", "data"),
         Input("ask_button", "n_clicks"),
         Input("rag_query", "n_submit"),
         State("rag_query", "value"),
-        State("select_document", "value")
+        State("select_document", "value"),
+        State("rag_session", "data")
     )
 
-    def get_rag_response(n_clicks, n_submit, user_query, file_selected):
+    def get_rag_response(n_clicks, n_submit, user_query, file_selected, session):
         """
         Generates a response from RAG system based on the user input. 
 
         This callback is triggered either when the `Ask` button is clicked or the user press Enter
         inside the input box. It takes user's query and the selected document file, process the 
         query using a RAG pipeline, and returns a Markdown-formatted answer with LaTex math support.
+        Questions on the same document form a conversation: follow-ups are answered with its history.
 
         Inputs:
         --------
@@ -791,40 +796,48 @@ def create_dash_app():
         - n_submit (int): Number of times the Enter key is pressed in the input box.
         - user_query (str): The user's query string to send to the RAG system.
         - file_selected (str): The selected document file to use for retrieval.
+        - session (dict): The conversation so far, {"session_id", "filename"}, if any.
 
         Returns:
         --------
         - dcc.Markdown: A formatted answer with simplified LaTeX math rendering if applicable.
         - str: An error message if an exception occurs or if inputs are invalid.
+        - dict: The conversation to continue with the next question.
         """
         ctx = callback_context
         
         if not ctx.triggered:
-            return "" 
+            return "", session
         
         try:
             # Make sure the input is valid 
             if user_query and file_selected:
-                print(file_selected)
-
-
-                params = {"filepath": file_selected, "query": user_query}
-                response = requests.get(RAG_ENDPOINT, params)
-                if response.status_code == 200:
-                    logger.info(f"RAG operation successfully executed")
-                    payload = response.json()
-                    answer = payload.get('answer', "")
-
-                    clean_answer = mu.simplify_latex_math(answer)
-                    return dcc.Markdown(clean_answer, mathjax=True)
-                else:
-                    logger.error("RAG operation failed")
-                    return f"Error from server: {response.status_code} - {response.text}"
+                workspace = current_workspace()
+                # Selecting another document starts a new conversation
+                if not session or session.get("filename") != file_selected:
+                    session = api_client.start_conversation(file_selected, workspace)
+                try:
+                    payload = api_client.ask(session["session_id"], user_query, workspace)
+                except ServiceError as se:
+                    if se.status_code != 404:
+                        raise
+                    # The conversation expired, start over
+                    session = api_client.start_conversation(file_selected, workspace)
+                    payload = api_client.ask(session["session_id"], user_query, workspace)
+                logger.info("RAG operation successfully executed")
+                answer = payload.get('answer', "")
+
+                clean_answer = mu.simplify_latex_math(answer)
+                return dcc.Markdown(clean_answer, mathjax=True), session
             else:
-                return "Please enter a query and select a document."
+                return "Please enter a query and select a document.", session
+
+        except ServiceError as se:
+            logger.error("RAG operation failed")
+            return f"Error from server: {se.status_code} - {se.detail}", session
                 
         except Exception as e:
-            return f"Error: {e.args}"
+            return f"Error: {e.args}", session
 
 
     # if __name__ == "__main__":
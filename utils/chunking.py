@@ -0,0 +1,477 @@
+"""
+Chunking strategies for parsed PDFs.
+
+- recursive: the historical strategy. Sizes in characters, cuts on paragraphs, then lines, then words.
+- token: same boundaries, sizes in tokens of the embedding model, so every chunk has a predictable
+  embedding and prompt cost.
+- sentence: sizes in tokens, chunks are cut between sentences only (a sentence larger than a chunk is
+  cut by tokens) and the overlap is made of whole sentences.
+- section: sentence chunks that never cross a section header. Sections up to `max_section_size` tokens
+  stay in one chunk, sections smaller than `min_section_size` are merged with the next one, and longer
+  sections are split into `chunk_size` chunks that all start with the section title.
+
+With every strategy, tables are never mixed with text: each table becomes its own chunk(s), cut only
+between rows. Every chunk records its page range, section path, position and content type (see
+`chunk_metadata`), so searches can be narrowed with metadata filters. `benchmarks/chunking_benchmark.py` compares configurations on chunk count, embedding
+tokens, retrieval hit rate and prompt size.
+"""
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.page_model import Block, ParsedDocument, BLOCK_OCR, BLOCK_TABLE, BLOCK_TEXT, render_table
+
+TOKEN_ENCODING = "cl100k_base" # Tokenizer of the text-embedding-3 models
+
+STRATEGY_RECURSIVE = "recursive"
+STRATEGY_TOKEN = "token"
+STRATEGY_SENTENCE = "sentence"
+STRATEGY_SECTION = "section"
+STRATEGIES = (STRATEGY_RECURSIVE, STRATEGY_TOKEN, STRATEGY_SENTENCE, STRATEGY_SECTION)
+
+# Default (chunk_size, chunk_overlap) of every strategy, in characters for "recursive" and in tokens otherwise
+DEFAULT_SIZES = {
+    STRATEGY_RECURSIVE: (5000, 200),
+    STRATEGY_TOKEN: (512, 64),
+    STRATEGY_SENTENCE: (384, 48),
+    STRATEGY_SECTION: (384, 48),
+}
+
+SECTION_HEADER_PATTERN = re.compile(r"^\d+\.?\s+[A-Z][A-Z\s&()\-,:]+$")         # e.g. "2. SCOPE OF WORK"
+SUBSECTION_HEADER_PATTERN = re.compile(r"^\d+(?:\.\d+)+\.?\s+[A-Z][^.;:]{0,100}$")  # e.g. "2.3 Deliverables"
+MARKDOWN_HEADER_PATTERN = re.compile(r"^#{1,6}\s+\S")
+LIST_ITEM_PATTERN = re.compile(r"^(?:[-•*▪●]|\(?[a-zA-Z0-9]{1,3}[.)])\s+")
+SENTENCE_END_PATTERN = re.compile(r"[.!?][\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+BLANK_LINE_PATTERN = re.compile(r"\n\s*\n")
+SECTION_NUMBER_PATTERN = re.compile(r"^(\d+(?:\.\d+)*)\.?\s")
+MARKDOWN_LEVEL_PATTERN = re.compile(r"^(#{1,6})\s+")
+PAGE_MARKER_PATTERN = re.compile(r"^\[Page (\d+)\]$", re.MULTILINE)
+
+# Words ending with a dot that do not end a sentence
+ABBREVIATIONS = frozenset({
+    "no", "nos", "nr", "mr", "mrs", "ms", "dr", "prof", "st", "etc", "vs", "viz", "fig", "figs", "art", "sec",
+    "para", "ref", "approx", "incl", "excl", "dept", "govt", "ltd", "co", "inc", "corp", "rs", "e.g", "i.e",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec", "vol", "ch", "cl",
+})
+
+
+@dataclass(frozen=True)
+class ChunkingConfig:
+    """
+    Chunking configuration. `chunk_size` and `chunk_overlap` are in characters for the "recursive"
+    strategy and in tokens for the others.
+    """
+    strategy: str = STRATEGY_RECURSIVE
+    chunk_size: int = 5000
+    chunk_overlap: int = 200
+    min_section_size: int = 64   # section: smaller sections are merged with the next one
+    max_section_size: int = 0    # section: larger sections are split, 0 means 2 x chunk_size
+    prefix_chars: int = 500      # First characters of the document added to every other chunk, 0 to disable
+
+    def __post_init__(self):
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Unsupported chunking strategy {self.strategy!r}, use one of {', '.join(STRATEGIES)}")
+        if self.chunk_size <= 0 or not 0 <= self.chunk_overlap < self.chunk_size:
+            raise ValueError("chunk_size must be positive and chunk_overlap between 0 and chunk_size.")
+
+    def describe(self) -> str:
+        unit = "chars" if self.strategy == STRATEGY_RECURSIVE else "tokens"
+        return f"{self.strategy} {self.chunk_size}/{self.chunk_overlap} {unit}"
+
+
+def load_chunking_config() -> ChunkingConfig:
+    """Reads the chunking configuration from CHUNKING_STRATEGY, CHUNK_SIZE and CHUNK_OVERLAP."""
+
+    strategy = os.getenv("CHUNKING_STRATEGY", STRATEGY_RECURSIVE)
+    chunk_size, chunk_overlap = DEFAULT_SIZES.get(strategy, DEFAULT_SIZES[STRATEGY_RECURSIVE])
+    return ChunkingConfig(
+        strategy=strategy,
+        chunk_size=int(os.getenv("CHUNK_SIZE", chunk_size)),
+        chunk_overlap=int(os.getenv("CHUNK_OVERLAP", chunk_overlap)),
+    )
+
+
+# ---------- Tokens and sentences ----------
+@lru_cache(maxsize=1)
+def _token_encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception:
+        # tiktoken is not installed, or its encoding cannot be downloaded (offline)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Counts the tokens of a text for the embedding model, or estimates them (4 chars per token) without tiktoken."""
+
+    encoder = _token_encoder()
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def _token_tail(text: str, n_tokens: int) -> str:
+    """Returns the last `n_tokens` tokens of a text."""
+
+    encoder = _token_encoder()
+    if encoder is None:
+        return text[-4 * n_tokens:]
+    return encoder.decode(encoder.encode(text, disallowed_special=())[-n_tokens:])
+
+
+def is_section_heading(line: str) -> bool:
+    """Checks whether a line is a numbered section or subsection header, or a markdown header."""
+
+    line = line.strip()
+    return bool(SECTION_HEADER_PATTERN.match(line)
+                or SUBSECTION_HEADER_PATTERN.match(line)
+                or MARKDOWN_HEADER_PATTERN.match(line))
+
+
+class SectionTracker:
+    """
+    Follows the section headers of a document in reading order. `path` holds the (depth, number, title)
+    of the current section and of its parents, e.g. "5. EVALUATION CRITERIA" > "5.2 Technical Score".
+    """
+
+    def __init__(self):
+        self.path = []
+
+    def _enter(self, line: str):
+        markdown = MARKDOWN_LEVEL_PATTERN.match(line)
+        if markdown:
+            depth, number = len(markdown.group(1)), ""
+        else:
+            number = SECTION_NUMBER_PATTERN.match(line).group(1)
+            depth = number.count(".") + 1
+        self.path = [entry for entry in self.path if entry[0] < depth] + [(depth, number, line)]
+
+    def feed(self, text: str) -> tuple:
+        """
+        Reads the headers of a piece of text and returns the section path at its start, including a
+        header on its first line.
+        """
+        start = None
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or PAGE_MARKER_PATTERN.match(line):
+                continue
+            if is_section_heading(line):
+                self._enter(line)
+            if start is None:
+                start = tuple(self.path)
+        return start if start is not None else tuple(self.path)
+
+
+def chunk_metadata(section_path: tuple) -> dict:
+    """
+    Returns the section metadata of a chunk. Chroma only stores scalars, so the path is flattened:
+
+    - section: title of the innermost section, section_path: titles joined with " > "
+    - section_number: number of the innermost numbered section, e.g. "5.2.1"
+    - top_section (int) and subsection: its first one and two levels, e.g. 5 and "5.2", to filter on a
+      section and all its subsections. 0 and "" when unknown.
+    """
+    numbers = [number for _, number, _ in section_path if number]
+    number = numbers[-1] if numbers else ""
+    parts = number.split(".") if number else []
+    return {
+        "section": section_path[-1][2] if section_path else "",
+        "section_path": " > ".join(title for _, _, title in section_path),
+        "section_number": number,
+        "top_section": int(parts[0]) if parts else 0,
+        "subsection": ".".join(parts[:2]) if len(parts) >= 2 else "",
+    }
+
+
+def page_span(text: str, current_page: int) -> Tuple[int, int]:
+    """
+    Returns the (first, last) page of a chunk of flattened text, from the `[Page N]` markers written by
+    `ParsedDocument.to_text`. `current_page` is the page at the end of the previous chunk.
+    """
+    pages = [int(number) for number in PAGE_MARKER_PATTERN.findall(text)]
+    if not pages:
+        return current_page, current_page
+    starts_with_marker = PAGE_MARKER_PATTERN.match(text.lstrip()) is not None
+    return (pages[0] if starts_with_marker else current_page), pages[-1]
+
+
+def _split_line_sentences(text: str) -> List[str]:
+    sentences, start = [], 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        if text[match.start()] == ".":
+            last_word = text[start:match.start()].rsplit(None, 1)[-1] if text[start:match.start()].strip() else ""
+            last_word = last_word.strip("\"'()[]").lower()
+            # "No. 5", "e.g. This", "J. Smith" or "3. The" do not end a sentence
+            if last_word in ABBREVIATIONS or len(last_word) <= 1 or last_word.isdigit():
+                continue
+        sentences.append(text[start:match.end()].strip())
+        start = match.end()
+
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits text extracted from a PDF into sentences. Wrapped lines are joined back, while headers and
+    list items always start a new sentence, and headers are sentences of their own.
+    """
+    sentences = []
+    for paragraph in BLANK_LINE_PATTERN.split(text):
+        lines = []
+        for line in paragraph.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            is_heading = is_section_heading(line)
+            if lines and (is_heading or LIST_ITEM_PATTERN.match(line)):
+                sentences.extend(_split_line_sentences(" ".join(lines)))
+                lines = []
+            if is_heading:
+                sentences.append(line)
+            else:
+                lines.append(line)
+        if lines:
+            sentences.extend(_split_line_sentences(" ".join(lines)))
+    return sentences
+
+
+# ---------- Tables ----------
+def split_table(rows: List[List[str]], chunk_size: int, length: Callable[[str], int] = len) -> List[str]:
+    """
+    Splits a table into markdown tables of at most `chunk_size` (measured with `length`), cutting only
+    between rows. The header row is repeated in every part. A single row larger than `chunk_size` stays whole.
+    """
+    header, body = rows[0], rows[1:]
+    parts, group = [], []
+    for row in body:
+        if group and length(render_table([header] + group + [row])) > chunk_size:
+            parts.append(render_table([header] + group))
+            group = []
+        group.append(row)
+
+    parts.append(render_table([header] + group))
+    return parts
+
+
+# ---------- Packing ----------
+class _ChunkBuilder:
+    """
+    Packs pieces of text (in reading order) into chunks of at most `chunk_size`, carrying the end of
+    every chunk over to the next one. `tail` chooses the pieces carried over.
+    """
+
+    def __init__(self, chunk_size: int, length: Callable[[str], int], separator: str,
+                 tail: Callable[[List[str], List[int]], List[str]]):
+        self.chunk_size = chunk_size
+        self.length = length
+        self.separator = separator
+        self.separator_size = length(separator) or 1
+        self.tail = tail
+        self.header = ""
+        self.chunks = [] # dicts with "text", "page_start", "page_end", "content_type" and "section_path"
+        self._reset([], None)
+
+    def _reset(self, carried: List[str], page: Optional[int]):
+        head = [self.header] if self.header else []
+        self.pieces = head + carried
+        self.sizes = [self.length(piece) for piece in self.pieces]
+        self.pages = [page] * len(carried) if page is not None else []
+        self.kinds = set()
+        self.section_path = ()
+        self.size = sum(size + self.separator_size for size in self.sizes)
+        self.has_content = False # False while the buffer only holds the header and the overlap
+
+    def start_section(self, header: str):
+        self.flush(carry_over=False)
+        self.header = header
+        self._reset([], None)
+
+    def add(self, piece: str, page: int, kind: str, section_path: tuple = ()):
+        piece_size = self.length(piece)
+        if self.has_content and self.size + piece_size + self.separator_size > self.chunk_size:
+            self.flush(carry_over=True)
+
+        if not self.has_content:
+            # A chunk belongs to the section its content starts in
+            self.section_path = section_path
+
+        self.pieces.append(piece)
+        self.sizes.append(piece_size)
+        self.pages.append(page)
+        self.kinds.add(kind)
+        self.size += piece_size + self.separator_size
+        self.has_content = True
+
+    def add_table(self, text: str, page: int, section_path: tuple = ()):
+        self.chunks.append({"text": text, "page_start": page, "page_end": page,
+                            "content_type": BLOCK_TABLE, "section_path": section_path})
+
+    def flush(self, carry_over: bool = False):
+        carried, page = [], None
+        if self.has_content:
+            self.chunks.append({
+                "text": self.separator.join(self.pieces),
+                "page_start": min(self.pages),
+                "page_end": max(self.pages),
+                "content_type": BLOCK_OCR if self.kinds == {BLOCK_OCR} else BLOCK_TEXT,
+                "section_path": self.section_path,
+            })
+            if carry_over:
+                n_head = 1 if self.header else 0
+                carried, page = self.tail(self.pieces[n_head:], self.sizes[n_head:]), self.pages[-1]
+        self._reset(carried, page)
+
+
+def _whole_pieces_tail(chunk_overlap: int):
+    """Carries over the last whole pieces (e.g. sentences) that fit in `chunk_overlap`."""
+
+    def tail(pieces: List[str], sizes: List[int]) -> List[str]:
+        carried, total = [], 0
+        for piece, size in zip(reversed(pieces), reversed(sizes)):
+            if total + size > chunk_overlap:
+                break
+            carried.insert(0, piece)
+            total += size
+        return carried
+    return tail
+
+
+def _pack_blocks(blocks, builder: _ChunkBuilder, split_piece: Callable[[str], List[str]], table_size: int):
+    sections = SectionTracker()
+    for block in blocks:
+        if block.kind == BLOCK_TABLE:
+            builder.flush(carry_over=False)
+            for table_text in split_table(block.rows, table_size, builder.length):
+                builder.add_table(table_text, block.page, tuple(sections.path))
+            continue
+        for piece in split_piece(block.text):
+            builder.add(piece, block.page, block.kind, sections.feed(piece))
+    builder.flush()
+
+
+def _sentence_pieces(text: str, max_tokens: int) -> List[str]:
+    """Sentences of a text, with sentences larger than `max_tokens` cut by tokens."""
+
+    token_splitter = RecursiveCharacterTextSplitter(chunk_size=max_tokens, chunk_overlap=0, length_function=count_tokens)
+    pieces = []
+    for sentence in split_sentences(text):
+        pieces.extend(token_splitter.split_text(sentence) if count_tokens(sentence) > max_tokens else [sentence])
+    return pieces
+
+
+def _sections(parsed: ParsedDocument) -> List[dict]:
+    """Groups the sentences and tables of a document by section, a section starting at every header."""
+
+    tracker = SectionTracker()
+    sections = [{"title": "", "path": (), "items": [], "size": 0}]
+    for block in parsed.blocks():
+        if block.kind == BLOCK_TABLE:
+            sections[-1]["items"].append(block)
+            sections[-1]["size"] += count_tokens(block.text)
+            continue
+        for sentence in split_sentences(block.text):
+            if is_section_heading(sentence):
+                sections.append({"title": sentence, "path": tracker.feed(sentence), "items": [], "size": 0})
+                continue
+            sections[-1]["items"].append(Block(block.kind, block.page, sentence, block.bbox))
+            sections[-1]["size"] += count_tokens(sentence) + 1
+    return [section for section in sections if section["items"] or section["title"]]
+
+
+def _merge_small_sections(sections: List[dict], min_size: int) -> List[dict]:
+    """Merges every section smaller than `min_size` with the next one, keeping both titles."""
+
+    merged = []
+    for section in sections:
+        if merged and merged[-1]["size"] < min_size:
+            previous = merged[-1]
+            previous["title"] = "\n".join(title for title in (previous["title"], section["title"]) if title)
+            if not previous["items"]:
+                previous["path"] = section["path"]
+            previous["items"].extend(section["items"])
+            previous["size"] += section["size"]
+        else:
+            merged.append(dict(section, items=list(section["items"])))
+    return merged
+
+
+def chunk_document(parsed: ParsedDocument, config: ChunkingConfig = ChunkingConfig()) -> List[Document]:
+    """
+    Splits a structured `ParsedDocument` into chunks with the strategy of `config`.
+
+    Parameters:
+        parsed (ParsedDocument): The parsed PDF.
+        config (ChunkingConfig): Strategy and sizes. Defaults to the historical 5000/200 characters.
+
+    Returns:
+        List[Document]: Chunks with "page_start", "page_end", "chunk_index", "content_type" ("text", "table"
+        or "ocr") and section (see `chunk_metadata`) metadata.
+    """
+    size, overlap = config.chunk_size, config.chunk_overlap
+
+    if config.strategy == STRATEGY_RECURSIVE:
+        # Pieces leave room for the overlap carried over from the previous chunk
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=max(size - overlap - 2, 1), chunk_overlap=0)
+        char_tail = lambda pieces, sizes: ["\n\n".join(pieces)[-overlap:]] if overlap and pieces else []
+        builder = _ChunkBuilder(size, len, "\n\n", char_tail)
+        _pack_blocks(parsed.blocks(), builder, text_splitter.split_text, size)
+
+    elif config.strategy == STRATEGY_TOKEN:
+        token_splitter = RecursiveCharacterTextSplitter(chunk_size=max(size - overlap - 1, 1), chunk_overlap=0,
+                                                        length_function=count_tokens)
+        token_tail = lambda pieces, sizes: [_token_tail("\n\n".join(pieces), overlap)] if overlap and pieces else []
+        builder = _ChunkBuilder(size, count_tokens, "\n\n", token_tail)
+        _pack_blocks(parsed.blocks(), builder, token_splitter.split_text, size)
+
+    elif config.strategy == STRATEGY_SENTENCE:
+        builder = _ChunkBuilder(size, count_tokens, "\n", _whole_pieces_tail(overlap))
+        _pack_blocks(parsed.blocks(), builder, lambda text: _sentence_pieces(text, size - overlap - 1), size)
+
+    else:
+        max_section_size = config.max_section_size or 2 * size
+        builder = _ChunkBuilder(size, count_tokens, "\n", _whole_pieces_tail(overlap))
+        for section in _merge_small_sections(_sections(parsed), config.min_section_size):
+            builder.start_section(section["title"])
+            title_size = count_tokens(section["title"]) + 1 if section["title"] else 0
+            # Sections that fit stay whole, the others are split on sentences
+            builder.chunk_size = max_section_size if section["size"] + title_size <= max_section_size else size
+            budget = max(size - title_size - overlap - 1, 1)
+            for item in section["items"]:
+                if item.kind == BLOCK_TABLE:
+                    builder.flush(carry_over=False)
+                    for table_text in split_table(item.rows, max(size - title_size, 1), count_tokens):
+                        builder.add_table(f"{section['title']}\n{table_text}" if section["title"] else table_text,
+                                          item.page, section["path"])
+                    continue
+                for piece in _sentence_pieces(item.text, budget):
+                    builder.add(piece, item.page, item.kind, section["path"])
+        builder.flush()
+
+    chunks = builder.chunks
+    if not chunks:
+        return []
+
+    # Add the first characters of the first chunk to all the other chunks
+    prefix = chunks[0]["text"][:config.prefix_chars] if config.prefix_chars else ""
+    documents = []
+    for ind, chunk in enumerate(chunks):
+        metadata = {
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"],
+            "chunk_index": ind,
+            "content_type": chunk["content_type"],
+            **chunk_metadata(chunk["section_path"]),
+        }
+        documents.append(Document(page_content=chunk["text"] if ind == 0 else prefix + chunk["text"], metadata=metadata))
+
+    return documents
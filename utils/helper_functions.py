@@ -2,21 +2,27 @@ import re
 
 import logging
 import os
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
 
-from langchain_community.vectorstores import Chroma
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from langchain_unstructured import UnstructuredLoader
-from langchain_openai import ChatOpenAI
-from typing import List, Type, Union
-from langchain_openai import OpenAIEmbeddings
+from typing import List, Type, Union, TYPE_CHECKING
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
 
-import pdfplumber 
-from pdf2image import convert_from_path 
-import pytesseract
+# The OpenAI, Chroma and PDF packages are slow to import, they are imported by the functions using them
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import Chroma
+from utils import telemetry
 from utils.logger_config import setup_logger
+from utils.page_model import Block, Page, ParsedDocument, BLOCK_TEXT, BLOCK_TABLE, BLOCK_OCR
+from utils.chunking import (
+    ChunkingConfig, SectionTracker, chunk_document, chunk_metadata, count_tokens, page_span, SECTION_HEADER_PATTERN
+)
+from utils.ocr_planner import OCR_CACHE_DIRECTORY, plan_page_ocr, run_ocr_plan
+from utils.parse_cache import PARSE_CACHE_DIRECTORY, file_content_hash, load_parsed, save_parsed
 
 logger= setup_logger(name="helper_logs", log_file="logs/helper_function.log")
 
@@ -31,8 +37,14 @@ def load_config(api_key="OPENAI_API_KEY"):
     return key
 
 
+@lru_cache(maxsize=4)
 def load_openai_model(model="gpt-4o-mini"):
-    """Loads the OpenAI model with the specified openai model name and API key."""
+    """
+    Loads the OpenAI model with the specified openai model name and API key.
+    The client is created once per process and model, so requests re-use its HTTP connections.
+    """
+    from langchain_openai import ChatOpenAI
+
     try:
         api_key = load_config("OPENAI_API_KEY")
         llm = ChatOpenAI(model=model,
@@ -45,112 +57,221 @@ def load_openai_model(model="gpt-4o-mini"):
         logger.error(f"LLM is not configured correctly, see the error below:\n{e.args}")
         raise
 
+
+class InstrumentedEmbeddings(Embeddings):
+    """
+    Embedding model timing its batches and counting their tokens, see `utils.telemetry`.
+
+    Texts are sent in batches of the `chunk_size` of the wrapped model, the size it would use itself,
+    so every batch is one request to OpenAI and one "embed" span.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str):
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_size = getattr(embeddings, "chunk_size", 1000)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            with telemetry.span("embed"):
+                vectors.extend(self.embeddings.embed_documents(batch))
+            telemetry.count_tokens_used(self.model, "embedding", sum(count_tokens(text) for text in batch))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        with telemetry.span("embed_query"):
+            vector = self.embeddings.embed_query(text)
+        telemetry.count_tokens_used(self.model, "embedding", count_tokens(text))
+        return vector
+
+
+@lru_cache(maxsize=4)
+def load_embedding_model(model: str = "text-embedding-3-large") -> InstrumentedEmbeddings:
+    """Loads the OpenAI embedding model, once per process and model like `load_openai_model`."""
+
+    from langchain_openai import OpenAIEmbeddings
+
+    return InstrumentedEmbeddings(OpenAIEmbeddings(model=model, api_key=load_config()), model)
+
     
 UPLOAD_DIRECTORY = "uploads"
 
-async def load_pdf_content(filename, dir=UPLOAD_DIRECTORY, dpi=200):
+def _within(obj: dict, bbox: tuple) -> bool:
+    """Checks whether a pdfplumber object lies inside a bounding box."""
+
+    x0, top, x1, bottom = bbox
+    return obj.get("x0", -1) >= x0 and obj.get("x1", -1) <= x1 and obj.get("top", -1) >= top and obj.get("bottom", -1) <= bottom
+
+
+def _extract_text_block(page, page_number: int, band_top: float, band_bottom: float, table_bboxes: list) -> Block | None:
+    """Extracts the native text of a horizontal band of the page, leaving out the tables."""
+
+    def keep(obj):
+        top = obj.get("top", -1)
+        return band_top <= top < band_bottom and not any(_within(obj, bbox) for bbox in table_bboxes)
+
+    region = page.filter(keep)
+    text = (region.extract_text() or "").strip()
+    if not text:
+        return None
+    
+    chars = region.chars
+    bbox = (min(c["x0"] for c in chars), min(c["top"] for c in chars), 
+            max(c["x1"] for c in chars), max(c["bottom"] for c in chars)) if chars else (0, band_top, page.width, band_bottom)
+    return Block(BLOCK_TEXT, page_number, text, bbox)
+
+
+def parse_pdf(filename, dir=UPLOAD_DIRECTORY, dpi=200, ocr_cache_dir=OCR_CACHE_DIRECTORY) -> ParsedDocument:
     """
-    Extracts all readable text from a PDF, including:
-    - Native text 
-    - Tables 
-    - Images or scanned content (via OCR)
+    Parses a PDF into a structured `ParsedDocument`: per page, blocks of native text, tables and
+    OCR output, in reading order, with their page number and bounding box.
+
+    - Tables are kept as rows of cells and their text is left out of the surrounding text blocks.
+    - OCR is planned per page (see `utils.ocr_planner`): blank pages are skipped, scanned pages and the
+      image regions of mixed pages are OCRed, and OCR results are cached by image hash.
 
     Args:
         filename (str) : a name or path of the pdf file
         dir (str) : a directory that contains the pdf file 
-        dpi (int): resolution for pdf2image rendering. Default : 300
+        dpi (int): resolution for pdf2image rendering. Default : 200
+        ocr_cache_dir (str): directory of the OCR cache. Default : "ocr_cache"
 
     Returns:
-        str: All extracted text from the document.
+        ParsedDocument: the pages and blocks of the document.
     """
 
+    import pdfplumber
+
     logging.getLogger('pdfminer').setLevel(logging.ERROR)
-    full_text = ""
     filepath = os.path.join(dir, filename)
+    document = ParsedDocument(source=os.path.basename(filepath))
+    stats = {}
 
     try:
-        # Load all page images once for OCR 
-        images = convert_from_path(filepath, dpi=dpi, poppler_path="/usr/bin")
-
         with pdfplumber.open(filepath) as pdf:
-            for i, page in enumerate(pdf.pages):
-                page_text = ""
-                
-                tables = page.extract_tables()
-                if tables:
-                    for table_ind, table in enumerate(tables):
-                        # table_text = f"\n[Page {i+1} - Table {table_ind + 1}]: \n"
-                        # full_text += table_text
-
-                        for row_ind, row in enumerate(table):
-                                table_text = " | ".join(cell or "" for cell in row)
-        
-                            # if row_ind == 0:
-                            #     header_text = f"Table_{table_ind+1}_header ----- " + " | ".join(cell or "" for cell in row) + "\n"
-                            #     full_text += header_text
-                            # else:
-                            #     body_row_text = f"Table_{table_ind+1}_content ----" + " | ".join(cell or  "" for cell in row) + "\n"
-    
-                                full_text += table_text
+            for i, pdf_page in enumerate(pdf.pages):
+                page_start = time.perf_counter()
+                page = Page(number=i + 1, width=float(pdf_page.width), height=float(pdf_page.height))
+
+                # Tables, top to bottom
+                tables = sorted(pdf_page.find_tables(), key=lambda table: table.bbox[1])
+                table_bboxes = [table.bbox for table in tables]
+
+                # Text above the first table, then every table followed by the text down to the next one
+                band_tops = [0] + [bbox[1] for bbox in table_bboxes] + [float(pdf_page.height) + 1]
+                text_block = _extract_text_block(pdf_page, page.number, band_tops[0], band_tops[1], table_bboxes)
+                if text_block:
+                    page.blocks.append(text_block)
+
+                for table_ind, table in enumerate(tables):
+                    rows = table.extract()
+                    if rows and any(any(cell for cell in row) for row in rows):
+                        page.blocks.append(Block.table(page.number, rows, tuple(table.bbox)))
+
+                    text_block = _extract_text_block(pdf_page, page.number, band_tops[table_ind + 1], band_tops[table_ind + 2], table_bboxes)
+                    if text_block:
+                        page.blocks.append(text_block)
+
+                # OCR only what has no native text, pages are rendered lazily
+                plan = plan_page_ocr(pdf_page, page.word_count())
+                stats[plan.kind] = stats.get(plan.kind, 0) + 1
+                if plan.regions:
+                    page.blocks.extend(run_ocr_plan(plan, filepath, page.number, dpi=dpi, cache_dir=ocr_cache_dir, stats=stats))
+                    page.blocks.sort(key=lambda block: block.bbox[1])
+
+                document.pages.append(page)
+                telemetry.record_span("parse_page", time.perf_counter() - page_start, kind=plan.kind)
+
+        logger.info(f"Parsed {document.source}: {stats}")
+        return document
 
-                # Extract normal text 
-                text = page.extract_text()
-                if text :
-                    page_text += text.strip() 
-                    full_text += text
+    except Exception as e:
+        raise RuntimeError(f"Error while extracting PDF content: {e}")
 
-                
-                # # Extaract and format table 
-                # tables = page.extract_tables()
-                # if tables:
-                #     for table_index, table in enumerate(tables):
-                #         if not table or not any(table):
-                #             continue
-                #         table_text +=f"\n]Table {table_index + 1}]\n"
 
-                #         # Clean adn format as markdown 
+def load_parsed_pdf(filename, dir=UPLOAD_DIRECTORY, dpi=200, cache_dir=PARSE_CACHE_DIRECTORY) -> ParsedDocument:
+    """
+    Returns the structured parse of a PDF from the parse cache, parsing it (and caching the result)
+    only if the content of the file was never parsed before.
 
-                #         for row_num, row in enumerate(table):
-                #             clean_row = [" " if cell is None else str(cell).strip() for cell in row]
-                #             table_text += "| " +  " | ".join(clean_row) + " |\n"
+    Args:
+        filename (str) : a name or path of the pdf file
+        dir (str) : a directory that contains the pdf file 
+        dpi (int): resolution for pdf2image rendering. Default : 200
+        cache_dir (str): directory of the parse cache. Default : "parse_cache"
 
-                #             if row_num == 0: 
-                #                 table_text += "| " + " | ".join("---" for _ in clean_row) + " |\n"
+    Returns:
+        ParsedDocument: the pages and blocks of the document.
+    """
+    content_hash = file_content_hash(os.path.join(dir, filename))
 
-                        
+    parsed = load_parsed(content_hash, dpi, cache_dir)
+    telemetry.record_cache("parse", parsed is not None)
+    if parsed is not None:
+        logger.info(f"Parse cache hit for {filename}")
+        return parsed
+    
+    logger.info(f"Parse cache miss for {filename}, parsing the PDF")
+    with telemetry.span("parse"):
+        parsed = parse_pdf(filename, dir=dir, dpi=dpi)
+    try:
+        save_parsed(parsed, content_hash, dpi, cache_dir)
+    except OSError as e:
+        logger.warning(f"Could not write the parse cache of {filename}: {str(e)}")
 
-                # If no text found, use OCR 
-                if not page_text.strip() or len(page_text.strip().split()) <= 3:
-                    ocr_text = pytesseract.image_to_string(images[i])
-                    page_text += f"\n[Page {i + 1}]\n"
-                    page_text += ocr_text.strip()
+    return parsed
 
-                    full_text += page_text
 
+async def load_pdf_content(filename, dir=UPLOAD_DIRECTORY, dpi=200):
+    """
+    Extracts all readable text from a PDF, including:
+    - Native text 
+    - Tables (as markdown tables)
+    - Images or scanned content (via OCR)
 
-               
+    Every page starts with a `[Page N]` line. See `parse_pdf` for the structured version.
+    The parse is read from the parse cache when available.
+
+    Args:
+        filename (str) : a name or path of the pdf file
+        dir (str) : a directory that contains the pdf file 
+        dpi (int): resolution for pdf2image rendering. Default : 200
+
+    Returns:
+        str: All extracted text from the document.
+    """
+
+    return load_parsed_pdf(filename, dir=dir, dpi=dpi).to_text()
 
-        return full_text.strip()
 
-    except Exception as e:
-        raise RuntimeError(f"Error while extracting PDF content: {e}")
 
+# SECTION_PATTERN = re.compile(r"^Section\s+\d+[:\-\.]\s+.+")
+SECTION_NUMBER_PATTERN = re.compile(r"^\d+\.?")
+LETTER_HEADER_PATTERN = re.compile(r"^[A-Z]\.\s+(.*)")
+WHITESPACE_PATTERN = re.compile(r"\s+")
 
 
 def is_likely_section_header(line: str) -> bool:
     """Determines whether a line is likely a section header using a specified """
     
-    line = line.strip()
-    pattern1 = r"^\d+\.?\s+[A-Z][A-Z\s&()\-,:]+$" 
-    # pattern2 = r"^Section\s+\d+[:\-\.]\s+.+"
- 
-    return bool (re.match(pattern1, line))
+    return bool(SECTION_HEADER_PATTERN.match(line.strip()))
 
   
 def normalize_text(text: str) -> str:
     """Normalizes the text by removing extra spaces, converting to lowercase"""
     
-    return re.sub(r"\s+", " ", text).strip().lower()
+    return WHITESPACE_PATTERN.sub(" ", text).strip().lower()
+
+
+def _join_normalized(*parts: str) -> str:
+    """
+    Joins already normalized strings as `normalize_text` would normalize their space separated concatenation,
+    i.e. _join_normalized(normalize_text(a), normalize_text(b)) == normalize_text(f"{a} {b}").
+    """
+    return " ".join(part for part in parts if part)
+
 
 def convert_numbered_headers_to_markdown(text: str) -> str:
     """Checks if the line of a text is a main section header and converts the numbered or lettered
@@ -158,45 +279,39 @@ def convert_numbered_headers_to_markdown(text: str) -> str:
     for example: A. Heading => # Heading
     1.2.3 Heading => # Heading
 
+    Every line is stripped and normalized once; the 3-line window only compares the cached values.
+
     parameter:
     text (str): the input text
     """
     
-    lines = text.splitlines()
+    lines = [line.strip() for line in text.splitlines()]
+    normalized = [normalize_text(line) for line in lines]
+    line_count = len(lines)
     markdown_lines = []
     i = 0
 
-    while i < len(lines):
-        current_line = lines[i].strip()
+    while i < line_count:
+        current_line = lines[i]
 
         # Checks if the line is section heas that starts with a number
-        if is_likely_section_header(current_line):
-            markdown_header = re.sub(r"^\d+\.?", "#", current_line)
+        if SECTION_HEADER_PATTERN.match(current_line):
+            markdown_header = SECTION_NUMBER_PATTERN.sub("#", current_line, count=1)
             markdown_lines.append(f"{markdown_header}\n")
             i += 1
             continue
 
-
         # Check if the line is a letter header (e.g., "A. Heading")
-        match = re.match(r"^[A-Z]\.\s+(.*)", current_line)
-        # has_letter_header = bool(match)
-        heading_main = match.group(1).strip() if match else current_line
-
-        next_line = lines[i + 1].strip() if i + 1 < len(lines) else ""
-        next_next_line = lines[i + 2].strip() if i + 2 < len(lines) else ""
-
-        # Try combinations of lines
-        line_1_norm = normalize_text(heading_main)
-        line_2_norm = normalize_text(next_line)
-        line_3_norm = normalize_text(next_next_line)
+        match = LETTER_HEADER_PATTERN.match(current_line)
+        line_1_norm = normalize_text(match.group(1)) if match else normalized[i]
 
-        combined_1_2 = normalize_text(f"{heading_main} {next_line}")
-        combined_1_2_3 = normalize_text(f"{heading_main} {next_line} {next_next_line}")
+        next_line = lines[i + 1] if i + 1 < line_count else ""
+        line_2_norm = normalized[i + 1] if i + 1 < line_count else ""
+        line_3_norm = normalized[i + 2] if i + 2 < line_count else ""
 
-        # If any combination matches a later line (i.e., repetition)
-        if line_1_norm == line_2_norm or \
-           combined_1_2 == line_3_norm or \
-           combined_1_2_3 == line_3_norm:
+        # If any combination matches a later line (i.e., repetition).
+        # "line 1 + line 2 + line 3 == line 3" only holds when lines 1 and 2 are empty, which the first test covers.
+        if line_1_norm == line_2_norm or _join_normalized(line_1_norm, line_2_norm) == line_3_norm:
             markdown_lines.append(f"# {current_line} {next_line}".strip() + "\n")
             i += 3
             continue
@@ -224,14 +339,14 @@ def combine_all_relevant_chunks_text(retrieved_chunks):
         str: A single string combining the content of all retrieved chunks.
     """
     # for ind, chunk in enumerate(retrieved_chunks):
-
-    #     print(f"Retrieved Chunk {ind+1}: \n {chunk.page_content}....\n\n")
+    #     logger.debug("Retrieved Chunk %d:\n%s", ind + 1, chunk.page_content)
 
     combined_text = "\n\n".join([document.page_content for document in retrieved_chunks ])
 
     return combined_text
 
 
+@telemetry.traced("split")
 def split_text(
         text: str, 
         splitter_type: Union[Type[RecursiveCharacterTextSplitter], 
@@ -255,6 +370,8 @@ def split_text(
 
     Returns:
         List[str | Documents]: A list of text chunks  or document objects resulting from the specified splitting strategy.
+            Every chunk has "page_start", "page_end" (from the `[Page N]` markers), "chunk_index", "content_type"
+            and section metadata.
     """
     
     if splitter_type == RecursiveCharacterTextSplitter:
@@ -272,11 +389,16 @@ def split_text(
         # Add first 500 chars firm first chunk to all the other chunks
         prefix = chunks[0][:500]
 
-        documents = [Document(page_content=chunks[0])]
+        sections = SectionTracker()
+        current_page = 1
+        documents = []
+        for ind, chunk in enumerate(chunks):
+            page_start, current_page = page_span(chunk, current_page)
+            metadata = {"page_start": page_start, "page_end": current_page, "chunk_index": ind,
+                        "content_type": BLOCK_TEXT, **chunk_metadata(sections.feed(chunk))}
 
-        # Add prefix to remaining chunks 
-        for chunk in chunks[1:]:
-            documents.append(Document(page_content=prefix + chunk))
+            # Add prefix to remaining chunks 
+            documents.append(Document(page_content=chunk if ind == 0 else prefix + chunk, metadata=metadata))
             
     elif splitter_type == MarkdownHeaderTextSplitter:
         # Initialize MarkdownHeaderTextSplitter
@@ -290,35 +412,67 @@ def split_text(
         
         prefix = chunks[0].page_content[:500]
 
-        documents = [chunks[0]]
+        current_page = 1
+        documents = []
+        for ind, chunk in enumerate(chunks):
+            page_start, current_page = page_span(chunk.page_content, current_page)
+            section = chunk.metadata.get("section", "")
+            metadata = {**chunk.metadata, "page_start": page_start, "page_end": current_page, "chunk_index": ind,
+                        "content_type": BLOCK_TEXT, "section": section, "section_path": section}
 
-        for chunk in chunks[1:]:
-            new_content = prefix + chunk.page_content
-            documents.append(Document(page_content=new_content, metadata=chunk.metadata))
+            new_content = chunk.page_content if ind == 0 else prefix + chunk.page_content
+            documents.append(Document(page_content=new_content, metadata=metadata))
         
 
     else:
         raise ValueError("Unsupported splitter type: Use RecursiveCharacterTextSplitter or MarkdownHeaderTextSplitter")
 
     # for debugging
-    print(f"The return type of splitter is: {type(chunks[0])}")
-    
+    logger.debug("The return type of splitter is: %s", type(chunks[0]))
 
-    # for debugging 
     logger.info(f"Total chunks: {len(documents)}")
     # for ind, doc  in enumerate(documents):
-    #     print(f"This is chunk: {ind+1}: \n {doc.page_content}\n\n")
+    #     logger.debug("This is chunk: %d:\n%s", ind + 1, doc.page_content)
 
     return documents
 
     
 
+@telemetry.traced("split")
+def split_document(parsed: ParsedDocument, chunk_size=5000, chunk_overlap=200, config: ChunkingConfig | None = None) -> List[Document]:
+    """
+    Splits a structured `ParsedDocument` into chunks that know which pages they come from.
+
+    - Text and OCR blocks are packed in reading order, across pages, into chunks of at most `chunk_size`
+      characters, with `chunk_overlap` characters carried over from one chunk to the next.
+    - Every table becomes its own chunk(s): tables are only cut between rows and repeat their header row.
+    - Like `split_text`, the first 500 characters of the first chunk are added to all the other chunks.
+
+    Other strategies (token, sentence or section based) are selected with `config`, see `utils.chunking`.
+
+    Parameters:
+        parsed (ParsedDocument): The parsed PDF.
+        chunk_size (int, optional): The maximum size of each chunk. Defaults to 5000.
+        chunk_overlap (int, optional): Number of characters repeated between consecutive text chunks. Defaults to 200.
+        config (ChunkingConfig, optional): Chunking strategy and sizes, overrides `chunk_size` and `chunk_overlap`.
+
+    Returns:
+        List[Document]: Chunks with "page_start", "page_end" and "content_type" ("text", "table" or "ocr") metadata.
+    """
+    config = config or ChunkingConfig(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    documents = chunk_document(parsed, config)
+
+    logger.info(f"Total chunks: {len(documents)} ({config.describe()})")
+    return documents
+
+
+
 def vector_store(
         chunks: List[Document], 
         filepath: str,
         persist_directory: str = "vectorestores",
         collections_name: str = "project_rfp",
-        embedding_model: str = "text-embedding-3-large") -> Chroma:
+        embedding_model: str = "text-embedding-3-large") -> "Chroma":
     
     """
     Creates a Chroma vector store from provided document chunks and returns a vector store object.
@@ -350,7 +504,9 @@ def vector_store(
     
     
     # Define and embedding model and attached to the vector store.
-    embeddings = OpenAIEmbeddings(model=embedding_model, api_key=load_config())
+    embeddings = load_embedding_model(embedding_model)
+    from langchain_community.vectorstores import Chroma
+
     vector_store = Chroma.from_documents( # Since vector store is persiting from document, use from_document
         embedding=embeddings,
         documents=chunks,
@@ -362,21 +518,73 @@ def vector_store(
 
 
 
-def create_retriever_from_store(vector_store, k: int = 4) -> BaseRetriever:
+CONTENT_TYPES = (BLOCK_TEXT, BLOCK_TABLE, BLOCK_OCR)
+SECTION_FILTER_PATTERN = re.compile(r"^(?:section|sec\.?|clause)?\s*(\d+(?:\.\d+)*)\.?$", re.IGNORECASE)
+
+
+def build_metadata_filter(page: int | None = None, section: str | None = None, content_type: str | None = None) -> dict | None:
+    """
+    Builds a Chroma `where` filter on the chunk metadata, to narrow a search before the vector search.
+
+    Parameters:
+        page (int, optional): Only chunks spanning this page.
+        section (str, optional): Only chunks of this section and its subsections, e.g. "5", "Section 5" or "5.2".
+        content_type (str, optional): Only "text", "table" or "ocr" chunks.
+
+    Returns:
+        dict | None: The filter, or None if no condition is given.
+
+    Raises:
+        ValueError: If a condition is invalid.
+    """
+    conditions = []
+    if page is not None:
+        if page < 1:
+            raise ValueError("page must be 1 or more.")
+        conditions += [{"page_start": {"$lte": page}}, {"page_end": {"$gte": page}}]
+
+    if section:
+        match = SECTION_FILTER_PATTERN.match(section.strip())
+        if not match:
+            raise ValueError(f"section must be a section number like 5 or 5.2, got {section!r}.")
+        number = match.group(1)
+        levels = number.count(".") + 1
+        if levels == 1:
+            conditions.append({"top_section": int(number)})
+        elif levels == 2:
+            conditions.append({"subsection": number})
+        else:
+            conditions.append({"section_number": number})
+
+    if content_type:
+        if content_type not in CONTENT_TYPES:
+            raise ValueError(f"content_type must be one of {', '.join(CONTENT_TYPES)}, got {content_type!r}.")
+        conditions.append({"content_type": content_type})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def create_retriever_from_store(vector_store, k: int = 4, metadata_filter: dict | None = None) -> BaseRetriever:
     """
     Creates and returns a retriever object from the provided vector store using Maximal Marginal Relevance (MMR) search.
 
     Parameters:
         vector_store (VectorStore): The vector store instance to convert into a retriever.
         k (int, optional): The number of top documents to retrieve. Defaults to 4.
+        metadata_filter (dict, optional): Chroma `where` filter applied before the vector search, see `build_metadata_filter`.
 
     Returns:
         BaseRetriever: A retriever object configured to use MMR-based semantic search with the specified number of results.
     """
+    search_kwargs = {"k": k}
+    if metadata_filter:
+        search_kwargs["filter"] = metadata_filter
    
     retriever = vector_store.as_retriever(
         search_type="mmr",
-        search_kwargs={"k": k}
+        search_kwargs=search_kwargs
         )
     return retriever
 
@@ -1,33 +1,195 @@
-import logging 
+"""
+Logging of the app: non-blocking, optionally JSON, with rotated log files.
+
+Loggers created with `setup_logger` only put their records on a queue (`QueueHandler`); a background
+thread per log file (`QueueListener`) formats them and writes them to the file and the console. A log call
+costs a few microseconds on the request thread, whatever the disk does.
+
+Every record carries the context of the request that logged it: its request id (set by the API middleware),
+the document it works on and the durations of the pipeline stages so far (see `utils.telemetry`). With
+LOG_FORMAT=json, records are written as one JSON object per line, with these fields and any `extra` given
+to the log call. Log files are rotated at LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
 
-def setup_logger(name=__name__, log_file="logs/app.log", level=logging.INFO):
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+from utils import telemetry
 
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower() # "text" or "json"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)) # 0 disables the rotation
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
-    if not logger.handlers:
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_context: contextvars.ContextVar = contextvars.ContextVar("log_context", default={})
+
+# Attributes of every LogRecord, the others come from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+@contextmanager
+def log_context(**fields) -> Iterator[None]:
+    """Adds fields, e.g. request_id or document_id, to the records logged in the `with` block (and the threads it starts)."""
+
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def get_log_context() -> dict:
+    return dict(_log_context.get())
+
+
+class LazyFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler creating its folder and opening its file on the first record, not when the logger
+    is set up. With several worker processes writing the same file, a process re-opens the file when another
+    one has rotated it, instead of writing to the rotated file.
+    """
+
+    def __init__(self, filename, mode="a", encoding=None, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, mode=mode, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+
+    def _open(self):
+        directory = os.path.dirname(self.baseFilename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return super()._open()
+
+    def emit(self, record):
+        if self.stream is not None and self.maxBytes > 0:
+            try:
+                rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+            except OSError:
+                rotated = True
+            if rotated:
+                self.stream.close()
+                self.stream = None # Re-opened by `emit`
+        super().emit(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object: time, level, logger, message, request context and `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        # The context and `extra` fields; tracebacks are part of the message, see `QueueHandler.prepare`
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                data[key] = value
+        return json.dumps(data, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context and the stage durations of the current request onto the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            setattr(record, key, value)
+        spans = telemetry.current_trace()
+        if spans:
+            record.stages = {stage: round(seconds * 1000, 1) for stage, (seconds, _) in telemetry.summarize_trace(spans).items()}
+        return True
 
 
-        # File handler 
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+class ProcessQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler starting the listener of its log file in the process that logs. Listener threads do
+    not survive a fork, so a gunicorn worker forked after the app was imported starts its own.
+    """
 
+    def __init__(self, log_file: str):
+        super().__init__(None) # The queue of the listener, set on the first record
+        self.log_file = log_file
+        self.addFilter(ContextFilter())
 
-        # Console handler 
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
+    def prepare(self, record):
+        # Like `QueueHandler.prepare`, without copying the record: loggers of `setup_logger` have only this handler
+        record.message = record.msg = self.format(record)
+        record.args = record.exc_info = record.exc_text = record.stack_info = None
+        return record
 
-        # Logger setup 
-        logger = logging.getLogger(name)
-        logger.setLevel(level)
-    
-        logger.addHandler(console_handler)
+    def enqueue(self, record):
+        # `prepare` has formatted the message (and the exception) on the calling thread, the rest is a queue put
+        self.queue = _get_listener(self.log_file).queue
+        self.queue.put_nowait(record)
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def _formatter() -> logging.Formatter:
+    return JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+def _get_listener(log_file: str) -> logging.handlers.QueueListener:
+    """Returns the running listener of `log_file` in this process, starting it on first use."""
+
+    key = (log_file, os.getpid())
+    listener = _listeners.get(key)
+    if listener is not None:
+        return listener
+
+    with _listeners_lock:
+        listener = _listeners.get(key)
+        if listener is None:
+            file_handler = LazyFileHandler(log_file)
+            console_handler = logging.StreamHandler()
+            for handler in (file_handler, console_handler):
+                handler.setFormatter(_formatter())
+            listener = logging.handlers.QueueListener(queue.SimpleQueue(), file_handler, console_handler,
+                                                      respect_handler_level=True)
+            listener.start()
+            _listeners[key] = listener
+    return listener
+
+
+def _reset_after_fork():
+    global _listeners_lock
+    _listeners_lock = threading.Lock() # Another thread of the parent may have held it during the fork
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def stop_listeners():
+    """Writes the queued records and stops the listeners of this process."""
+
+    with _listeners_lock:
+        listeners = [listener for (_, pid), listener in _listeners.items() if pid == os.getpid()]
+        _listeners.clear()
+    for listener in listeners:
+        listener.stop()
+
+
+def setup_logger(name=__name__, log_file="logs/app.log", level=logging.INFO):
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+
+    if not logger.handlers:
+        # Records go through a queue, the file and the console are written by a background thread
+        logger.addHandler(ProcessQueueHandler(log_file))
 
         # Avoid duplicate logs
-        logger.popagate = False
+        logger.propagate = False
 
-    return logger
\ No newline at end of file
+    return logger
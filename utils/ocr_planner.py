@@ -0,0 +1,208 @@
+"""
+Decides which parts of a PDF page need OCR, and caches OCR results.
+
+Pages are classified from what pdfplumber already knows about them, before anything is rendered:
+
+- text: enough native text and no image worth reading, nothing to OCR.
+- blank: (almost) no native text, no image and no vector drawing, e.g. separator pages. Skipped.
+- scanned: (almost) no native text, OCR of the images, or of the whole page if its text is drawn as vector outlines.
+- mixed: native text plus images (stamps, scanned annexes, signatures...), OCR of the image regions only.
+
+Images that are too small (logos, bullets) or already covered by a text layer (searchable scans) are
+never OCRed. Pages are rendered one at a time, and only on a cache miss.
+
+OCR results are cached on disk by image hash, since tenders often reuse identical scanned pages. The
+key of an embedded image is the hash of its raw stream, so a cache hit needs no rendering at all;
+regions without a usable stream are keyed by the hash of their rendered pixels.
+"""
+import hashlib
+import os
+import tempfile
+from typing import List, NamedTuple, Optional, Tuple
+
+from utils import telemetry
+from utils.page_model import Block, BLOCK_OCR
+
+OCR_CACHE_DIRECTORY = os.getenv("OCR_CACHE_DIRECTORY", "ocr_cache")
+
+# Bump when the OCR settings change, so stale entries are ignored
+OCR_VERSION = 1
+
+PAGE_TEXT = "text"
+PAGE_BLANK = "blank"
+PAGE_SCANNED = "scanned"
+PAGE_MIXED = "mixed"
+
+NATIVE_TEXT_MIN_WORDS = 4           # Pages with fewer words have no usable text layer
+MIN_IMAGE_AREA_RATIO = 0.02         # Images smaller than 2% of the page (logos, bullets) are ignored
+TEXT_LAYER_MIN_DENSITY = 1.0        # Chars per 1000 pt² above which an image already has a text layer
+
+BBox = Tuple[float, float, float, float]
+
+
+class OcrRegion(NamedTuple):
+    bbox: BBox
+    image_key: Optional[str] = None # Hash of the embedded image, None if the region must be rendered to be hashed
+
+
+class OcrPlan(NamedTuple):
+    kind: str
+    regions: List[OcrRegion]
+
+
+def _area(bbox: BBox) -> float:
+    x0, top, x1, bottom = bbox
+    return max(0.0, x1 - x0) * max(0.0, bottom - top)
+
+
+def _clip(obj: dict, width: float, height: float) -> BBox:
+    return (max(0.0, float(obj["x0"])), max(0.0, float(obj["top"])),
+            min(width, float(obj["x1"])), min(height, float(obj["bottom"])))
+
+
+def _image_stream_hash(image: dict) -> Optional[str]:
+    """Returns the hash of the raw data of an embedded image, or None if it is not readable."""
+
+    stream = image.get("stream")
+    try:
+        data = stream.get_rawdata() if stream is not None else None
+    except Exception:
+        return None
+    return hashlib.sha256(data).hexdigest() if data else None
+
+
+def plan_page_ocr(pdf_page, native_words: int) -> OcrPlan:
+    """
+    Classifies a pdfplumber page and lists the regions to OCR.
+
+    Parameters:
+        pdf_page: pdfplumber page.
+        native_words (int): Number of words of native text found on the page.
+
+    Returns:
+        OcrPlan: the kind of page and its regions to OCR (empty for text and blank pages).
+    """
+    width, height = float(pdf_page.width), float(pdf_page.height)
+    page_area = width * height or 1.0
+
+    images = []
+    for image in pdf_page.images:
+        bbox = _clip(image, width, height)
+        if _area(bbox) >= MIN_IMAGE_AREA_RATIO * page_area:
+            images.append((bbox, image))
+
+    has_text = native_words >= NATIVE_TEXT_MIN_WORDS
+    if not has_text and not images:
+        # Text drawn as vector outlines is only readable by OCR, lines and boxes alone are a blank page
+        if pdf_page.curves:
+            return OcrPlan(PAGE_SCANNED, [OcrRegion((0.0, 0.0, width, height))])
+        return OcrPlan(PAGE_BLANK, [])
+
+    regions = []
+    chars = pdf_page.chars
+    for bbox, image in images:
+        x0, top, x1, bottom = bbox
+        chars_inside = sum(1 for c in chars if c["x0"] >= x0 and c["x1"] <= x1 and c["top"] >= top and c["bottom"] <= bottom)
+        if chars_inside * 1000 / (_area(bbox) or 1.0) >= TEXT_LAYER_MIN_DENSITY:
+            continue # Searchable scan or background image, the text is already extracted
+
+        stream_hash = _image_stream_hash(image)
+        image_key = f"{stream_hash}-{round(x1 - x0)}x{round(bottom - top)}" if stream_hash else None
+        regions.append(OcrRegion(bbox, image_key))
+
+    if not has_text:
+        return OcrPlan(PAGE_SCANNED, regions)
+    return OcrPlan(PAGE_MIXED if regions else PAGE_TEXT, regions)
+
+
+# ---------- OCR cache ----------
+def _cache_path(key: str, dpi: int, cache_dir: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.dpi{dpi}.v{OCR_VERSION}.txt")
+
+
+def load_ocr_text(key: str, dpi: int, cache_dir: str = OCR_CACHE_DIRECTORY) -> Optional[str]:
+    """Returns the cached OCR text of an image, or None if it is not cached."""
+
+    try:
+        with open(_cache_path(key, dpi, cache_dir), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def save_ocr_text(key: str, dpi: int, text: str, cache_dir: str = OCR_CACHE_DIRECTORY):
+    """Writes the OCR text of an image to the cache, through a temporary file and an atomic rename."""
+
+    path = _cache_path(key, dpi, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def run_ocr_plan(plan: OcrPlan, filepath: str, page_number: int, dpi: int = 200,
+                 cache_dir: str = OCR_CACHE_DIRECTORY, stats: Optional[dict] = None) -> List[Block]:
+    """
+    OCRs the regions of a page plan, reading the cache first. The page is rendered at most once,
+    and only if a region is missing from the cache.
+
+    Parameters:
+        plan (OcrPlan): Plan returned by `plan_page_ocr`.
+        filepath (str): Path of the PDF file.
+        page_number (int): 1-based number of the page.
+        dpi (int): Rendering resolution.
+        cache_dir (str): Directory of the OCR cache.
+        stats (dict): Optional counters, "ocr_cache_hits" and "ocr_runs" are incremented.
+
+    Returns:
+        List[Block]: One OCR block per region with text.
+    """
+    # Imported here: only documents with pages to OCR need them
+    from pdf2image import convert_from_path
+    import pytesseract
+
+    stats = stats if stats is not None else {}
+    scale = dpi / 72
+    rendered = None
+    blocks = []
+
+    for region in plan.regions:
+        text = load_ocr_text(region.image_key, dpi, cache_dir) if region.image_key else None
+
+        if text is None:
+            if rendered is None:
+                with telemetry.span("render_page"):
+                    rendered = convert_from_path(filepath, dpi=dpi, first_page=page_number, last_page=page_number,
+                                                 poppler_path="/usr/bin")[0]
+            x0, top, x1, bottom = region.bbox
+            image = rendered.crop((int(x0 * scale), int(top * scale),
+                                   min(rendered.width, int(x1 * scale) + 1), min(rendered.height, int(bottom * scale) + 1)))
+
+            key = region.image_key or hashlib.sha256(f"{image.mode}{image.size}".encode() + image.tobytes()).hexdigest()
+            text = load_ocr_text(key, dpi, cache_dir) if not region.image_key else None
+            if text is None:
+                with telemetry.span("ocr"):
+                    text = pytesseract.image_to_string(image).strip()
+                stats["ocr_runs"] = stats.get("ocr_runs", 0) + 1
+                telemetry.record_cache("ocr", False)
+                try:
+                    save_ocr_text(key, dpi, text, cache_dir)
+                except OSError:
+                    pass # The cache is an optimization, OCR results are still returned
+            else:
+                stats["ocr_cache_hits"] = stats.get("ocr_cache_hits", 0) + 1
+                telemetry.record_cache("ocr", True)
+        else:
+            stats["ocr_cache_hits"] = stats.get("ocr_cache_hits", 0) + 1
+            telemetry.record_cache("ocr", True)
+
+        if text:
+            blocks.append(Block(BLOCK_OCR, page_number, text, tuple(region.bbox)))
+
+    return blocks
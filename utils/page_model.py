@@ -0,0 +1,120 @@
+"""
+Compact structured representation of a parsed PDF.
+
+A `ParsedDocument` holds `Page`s, each holding `Block`s of text, tables and OCR output with their page
+number and bounding box, in reading order. Chunking, metadata and caching build on it, so the PDF
+is never re-parsed to cite a page or to keep a table in one piece.
+
+All classes use `__slots__`, which keeps thousands of blocks small in memory.
+"""
+from typing import Iterator, List, Optional, Tuple
+
+BLOCK_TEXT = "text"
+BLOCK_TABLE = "table"
+BLOCK_OCR = "ocr"
+
+BBox = Tuple[float, float, float, float] # (x0, top, x1, bottom) in PDF points
+
+
+def render_table(rows: List[List[Optional[str]]]) -> str:
+    """
+    Renders table rows as a markdown table, one row per line, so text splitters cut tables
+    between rows and never in the middle of one. The first row is used as the header.
+    """
+    lines = []
+    for row_num, row in enumerate(rows):
+        clean_row = [" ".join(str(cell).split()) if cell is not None else "" for cell in row]
+        lines.append("| " + " | ".join(clean_row) + " |")
+        if row_num == 0:
+            lines.append("| " + " | ".join("---" for _ in clean_row) + " |")
+    return "\n".join(lines)
+
+
+class Block:
+    """A piece of content of a page: native text, a table or the OCR output of an image."""
+
+    __slots__ = ("kind", "page", "text", "bbox", "rows")
+
+    def __init__(self, kind: str, page: int, text: str, bbox: BBox, rows: Optional[List[List[str]]] = None):
+        self.kind = kind
+        self.page = page
+        self.text = text
+        self.bbox = bbox
+        self.rows = rows # Table cells, only for table blocks
+
+    @classmethod
+    def table(cls, page: int, rows: List[List[Optional[str]]], bbox: BBox) -> "Block":
+        rows = [[cell or "" for cell in row] for row in rows]
+        return cls(BLOCK_TABLE, page, render_table(rows), bbox, rows)
+
+    def to_dict(self) -> dict:
+        data = {"kind": self.kind, "page": self.page, "text": self.text, "bbox": list(self.bbox)}
+        if self.rows is not None:
+            data["rows"] = self.rows
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Block":
+        return cls(data["kind"], data["page"], data["text"], tuple(data["bbox"]), data.get("rows"))
+
+    def __repr__(self):
+        return f"Block({self.kind!r}, page={self.page}, chars={len(self.text)})"
+
+
+class Page:
+    """A page with its size in PDF points and its blocks in reading order."""
+
+    __slots__ = ("number", "width", "height", "blocks")
+
+    def __init__(self, number: int, width: float, height: float, blocks: Optional[List[Block]] = None):
+        self.number = number # 1-based
+        self.width = width
+        self.height = height
+        self.blocks = blocks if blocks is not None else []
+
+    def to_dict(self) -> dict:
+        return {
+            "number": self.number,
+            "width": self.width,
+            "height": self.height,
+            "blocks": [block.to_dict() for block in self.blocks],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Page":
+        return cls(data["number"], data["width"], data["height"], [Block.from_dict(b) for b in data["blocks"]])
+
+    def word_count(self) -> int:
+        return sum(len(block.text.split()) for block in self.blocks)
+
+
+class ParsedDocument:
+    """All the pages of a PDF."""
+
+    __slots__ = ("source", "pages")
+
+    def __init__(self, source: str, pages: Optional[List[Page]] = None):
+        self.source = source
+        self.pages = pages if pages is not None else []
+
+    def blocks(self) -> Iterator[Block]:
+        for page in self.pages:
+            yield from page.blocks
+
+    def to_text(self, page_markers: bool = True) -> str:
+        """
+        Flattens the document to text: blocks separated by blank lines, tables as markdown tables and,
+        optionally, a `[Page N]` line at the start of every page.
+        """
+        parts = []
+        for page in self.pages:
+            if page_markers:
+                parts.append(f"[Page {page.number}]")
+            parts.extend(block.text for block in page.blocks if block.text)
+        return "\n\n".join(parts).strip()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __repr__(self):
+        return f"ParsedDocument({self.source!r}, pages={len(self.pages)})"
@@ -0,0 +1,86 @@
+"""
+Persisted cache of parsed PDFs, keyed by the sha256 of the file content.
+
+Parsing, and OCR above all, is the most expensive step of indexing. With the parse cached, changing
+the splitter, the chunk size or the embedding model re-chunks and re-embeds from the cache instead of
+re-reading the PDF. Identical files uploaded under different names or in different workspaces share
+one entry.
+
+Format: one gzip-compressed JSON Lines file per document. The first line is a header, then one line
+per page (see `Page.to_dict`).
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from utils.page_model import Page, ParsedDocument
+
+PARSE_CACHE_DIRECTORY = os.getenv("PARSE_CACHE_DIRECTORY", "parse_cache")
+
+# Bump when the output of `parse_pdf` changes, so stale entries are ignored
+PARSER_VERSION = 2
+
+
+def file_content_hash(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the sha256 hex digest of a file, read chunk by chunk."""
+
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def cache_path(content_hash: str, dpi: int, cache_dir: str = PARSE_CACHE_DIRECTORY) -> str:
+    """Returns the cache file of a document, sharded by the first 2 characters of its hash."""
+
+    return os.path.join(cache_dir, content_hash[:2], f"{content_hash}.dpi{dpi}.v{PARSER_VERSION}.jsonl.gz")
+
+
+def load_parsed(content_hash: str, dpi: int, cache_dir: str = PARSE_CACHE_DIRECTORY) -> ParsedDocument | None:
+    """Returns the cached parse of a document, or None if it is not cached or unreadable."""
+
+    path = cache_path(content_hash, dpi, cache_dir)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            pages = [Page.from_dict(json.loads(line)) for line in f if line.strip()]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if header.get("version") != PARSER_VERSION or len(pages) != header.get("pages"):
+        return None
+
+    return ParsedDocument(source=header.get("source", ""), pages=pages)
+
+
+def save_parsed(parsed: ParsedDocument, content_hash: str, dpi: int, cache_dir: str = PARSE_CACHE_DIRECTORY) -> str:
+    """
+    Writes the parse of a document to the cache. The file is written to a temporary file and renamed,
+    so readers never see a partial entry.
+
+    Returns:
+        str: Path of the cache file.
+    """
+    path = cache_path(content_hash, dpi, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            header = {"version": PARSER_VERSION, "source": parsed.source, "pages": len(parsed.pages), "dpi": dpi}
+            f.write(json.dumps(header) + "\n")
+            for page in parsed.pages:
+                f.write(json.dumps(page.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return path
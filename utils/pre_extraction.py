@@ -0,0 +1,236 @@
+"""
+Rule-based pre-extraction of the regular fields of an RFP: document numbers, emails, phone numbers, dates
+and times.
+
+Runs once per document, on its parse (see `backend.vectorstore_chain`), with precompiled patterns. Every
+match is a candidate with its position, {"field", "value", "page", "block", "start", "end", "labelled"},
+the offsets being those of the value in the text of the block. Dates and times get their field from the
+label keyword nearest before them on the same line (or the line above, for a label and its value in two
+lines). A candidate is "labelled" when its label sits right before it: "Submission deadline: 12 March 2025
+at 10:00", "| Pre-bid meeting | 03/04/2025 |", "Tel: +1 555 0100", a short line of its own above the
+value, ... A keyword further in a sentence, as in "open competitive bidding, bids due on 12 March 2025",
+only makes a guess.
+
+`resolve_fields` turns the candidates into the fields of a schema: a field with a single distinct value and
+a labelled candidate is resolved, the others are left to the LLM, with the candidates as hints.
+"""
+import re
+from typing import Dict, List, Tuple
+
+from utils.page_model import ParsedDocument
+
+# Bump when the patterns change, so stored candidates are recomputed
+PRE_EXTRACTION_VERSION = 3
+
+LABEL_WINDOW = 120 # Characters before a value searched for its label
+MAX_LABEL_WORDS = 8 # Words of a label right before its value
+
+_MONTHS = (r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+           r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)")
+DATE_PATTERN = re.compile(
+    rf"\b\d{{1,2}}(?:st|nd|rd|th)?(?:\s+of)?[\s\-]+{_MONTHS}\.?,?[\s\-]+\d{{4}}\b" # 12 March 2025, 12th of Mar, 2025
+    rf"|\b{_MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b"                  # March 12, 2025
+    r"|\b\d{4}-\d{2}-\d{2}\b"                                                       # 2025-03-12
+    r"|\b\d{1,2}(?P<sep>[/.])\d{1,2}(?P=sep)\d{4}\b",                               # 12/03/2025, not clause 2.3.14
+    re.IGNORECASE)
+TIME_PATTERN = re.compile(
+    r"\b(?:[01]?\d|2[0-3]):[0-5]\d(?:\s*(?:[ap]\.?\s?m\b\.?|hrs\b|hours\b))?"       # 10:00, 10:00 AM, 14:30 hrs
+    r"|\b(?:[01]?\d|2[0-3])\.[0-5]\d\s*(?:[ap]\.?\s?m\b\.?|hrs\b|hours\b)"         # 10.00 a.m.
+    r"|\b(?:1[0-2]|0?[1-9])\s*(?:[ap]\.\s?m\.|[ap]m\b)",                           # 10 am, 2 p.m.
+    re.IGNORECASE)
+EMAIL_PATTERN = re.compile(r"\b[A-Za-z0-9._%+\-]+@[A-Za-z0-9\-]+(?:\.[A-Za-z0-9\-]+)*\.[A-Za-z]{2,}\b")
+PHONE_PATTERN = re.compile(r"(?<![\w/.\-])(?:\+\d{1,3}[\s.\-]?)?(?:\(\d{1,4}\)[\s.\-]?)?\d{1,8}(?:[\s.\-]\d{1,8}){0,4}(?![\w/])")
+DOC_NUM_PATTERN = re.compile(
+    r"\b(?:RFP|EOI|RFQ|RFB|ITB|IFB|Tender|Bid|Contract|Procurement|Reference|Ref)\.?\s*(?:No|Number|Num|#)\b\.?\s*[:\-]?\s*"
+    r"(?P<value>[A-Za-z0-9][A-Za-z0-9/\-_.]*\d[A-Za-z0-9/\-_.]*)",
+    re.IGNORECASE)
+
+# Labels of dates and times, the one nearest the value wins, then the first one listed
+_QUERY = re.compile(r"\b(quer(y|ies)|clarifications?|questions?)\b", re.IGNORECASE)
+_RESPONSE = re.compile(r"\b(respon\w*|repl(y|ies)|answers?)\b", re.IGNORECASE)
+DATE_LABELS = [
+    (re.compile(r"\bpre-?\s?(bid|proposal|submission)\b|\bsite visit\b", re.IGNORECASE), "prebid_meeting"),
+    (_QUERY, "queries"),
+    (re.compile(r"\bopen(ing|ed)?\b", re.IGNORECASE), "opening_date"),
+    (re.compile(r"\b(submission|submit\w*|closing|deadline|due)\b", re.IGNORECASE), "final_submission"),
+    (re.compile(r"\b(issu(e|ed|ance|ing)|publi(shed|cation)|dated)\b", re.IGNORECASE), "issued_date"),
+]
+DATE_FIELDS = {"prebid_meeting": "prebid_meeting_date", "final_submission": "final_submission_date"}
+TIME_FIELDS = {"prebid_meeting": "prebid_meeting_time", "final_submission": "Final_submission_time"}
+PHONE_LABEL = re.compile(r"\b(tel(ephone)?|phone|mobile|cell|contact)\b|\bph\b", re.IGNORECASE)
+EMAIL_LABEL = re.compile(r"\be-?\s?mail\b|\bcontact\b", re.IGNORECASE)
+_LABEL_END = re.compile(r"\s*[:\-\u2013|]\s*$") # The colon, dash or cell border between a label and its value
+_CLAUSE_BREAK = re.compile(r"[|;]|[.!?](?:\s|$)")
+_OPEN_ENDING = re.compile(r"\b(on|by|at|of|for|before|until|till|from|to|is|are|be|was|were|the|in)\s*$", re.IGNORECASE)
+
+# Schema fields of every candidate field
+SCHEMA_FIELDS: Dict[str, Dict[str, str]] = {
+    "keydates": {"document_number": "Document_num", "issued_date": "issued_date",
+                 "final_submission_date": "final_submission_date", "Final_submission_time": "Final_submission_time",
+                 "last_queries_submission_date": "last_queries_submission_date",
+                 "query_response_date": "query_response_date", "opening_date": "opening_date",
+                 "prebid_meeting_date": "prebid_meeting_date", "prebid_meeting_time": "prebid_meeting_time"},
+    "contact": {"document_number": "doc_num", "phone_number": "phone_number", "client_email": "client_email"},
+    "submission": {"document_number": "doc_num"},
+    "procurement": {"document_number": "doc_num"},
+    "project": {"document_number": "Document_num"},
+}
+
+
+def _label_text(text: str, start: int, floor: int) -> Tuple[str, bool]:
+    """
+    The text before a value that may label it: the line up to the value, or the line above if it has no
+    words, and whether it is the line above.
+    """
+    line_start = text.rfind("\n", 0, start) + 1
+    label = text[max(line_start, floor, start - LABEL_WINDOW):start]
+    if not re.search(r"[A-Za-z]{3}", label) and line_start > 0 and floor < line_start:
+        previous_start = text.rfind("\n", 0, line_start - 1) + 1
+        return text[max(previous_start, line_start - 1 - LABEL_WINDOW):line_start - 1], True
+    return label, False
+
+
+def _label_before(label: str, line_above: bool) -> str | None:
+    """
+    The label right before a value, None if there is none: the last cell or clause of the label text when
+    it ends with a colon, a dash or a cell border, or a line above of a few words that does not break off a
+    sentence ("Bids will be opened on").
+    """
+    separated = _LABEL_END.search(label)
+    if separated:
+        label = label[:separated.start()]
+    elif not line_above or _OPEN_ENDING.search(label):
+        return None
+    label = _CLAUSE_BREAK.split(label)[-1].strip()
+    return label if label and len(label.split()) <= MAX_LABEL_WORDS else None
+
+
+def _date_label(label: str) -> str | None:
+    nearest, nearest_end = None, -1
+    for pattern, name in DATE_LABELS:
+        ends = [match.end() for match in pattern.finditer(label)]
+        if ends and ends[-1] > nearest_end:
+            nearest, nearest_end = name, ends[-1]
+    if nearest == "queries":
+        return "query_response_date" if _RESPONSE.search(label) else "last_queries_submission_date"
+    return nearest
+
+
+def _candidate(field: str, value: str, page: int, block: int, start: int, end: int, labelled: bool) -> dict:
+    return {"field": field, "value": value.strip(), "page": page, "block": block, "start": start, "end": end,
+            "labelled": labelled}
+
+
+def _block_candidates(text: str, page: int, block: int) -> List[dict]:
+    candidates = []
+
+    for match in DOC_NUM_PATTERN.finditer(text):
+        value = match.group("value").rstrip("./-_")
+        # The pattern takes the label ("RFP No.:") right before the value
+        candidates.append(_candidate("document_number", value, page, block, match.start("value"),
+                                     match.start("value") + len(value), True))
+
+    emails = list(EMAIL_PATTERN.finditer(text))
+    for match in emails:
+        label = _label_before(*_label_text(text, match.start(), 0))
+        candidates.append(_candidate("client_email", match.group(), page, block, match.start(), match.end(),
+                                     bool(label and EMAIL_LABEL.search(label))))
+
+    # Dates and times in reading order, a time with no label of its own takes the one of the date before it,
+    # "Submission deadline: 12 March 2025 at 10:00"
+    dates = [(match, "date") for match in DATE_PATTERN.finditer(text)]
+    date_spans = [match.span() for match, _ in dates]
+    times = [(match, "time") for match in TIME_PATTERN.finditer(text)
+             if not any(start <= match.start() < end for start, end in date_spans)]
+    floor, line_label, line_labelled, line_start = 0, None, False, -1
+    for match, kind in sorted(dates + times, key=lambda item: item[0].start()):
+        start = match.start()
+        current_line = text.rfind("\n", 0, start)
+        if current_line != line_start:
+            line_label, line_labelled, line_start = None, False, current_line
+        label, line_above = _label_text(text, start, floor)
+        name = _date_label(label)
+        if name is None:
+            name, labelled = line_label, line_labelled
+        else:
+            label = _label_before(label, line_above)
+            labelled = label is not None and _date_label(label) == name
+        floor, line_label, line_labelled = match.end(), name, labelled
+        if name is None:
+            continue
+        field = (DATE_FIELDS if kind == "date" else TIME_FIELDS).get(name, name if kind == "date" else None)
+        if field:
+            candidates.append(_candidate(field, match.group(), page, block, start, match.end(), labelled))
+
+    # Phone numbers: numbers of 7 to 15 digits, with a phone label or an international prefix
+    taken = date_spans + [match.span() for match in emails]
+    for match in PHONE_PATTERN.finditer(text):
+        digits = sum(char.isdigit() for char in match.group())
+        if not 7 <= digits <= 15 or any(start < match.end() and match.start() < end for start, end in taken):
+            continue
+        label, line_above = _label_text(text, match.start(), 0)
+        if match.group().startswith("+") or PHONE_LABEL.search(label):
+            label = _label_before(label, line_above)
+            candidates.append(_candidate("phone_number", match.group(), page, block, match.start(), match.end(),
+                                         bool(label and PHONE_LABEL.search(label))))
+
+    return candidates
+
+
+def find_candidates(parsed: ParsedDocument) -> List[dict]:
+    """Returns the candidates of all the blocks of a document, see the module docstring."""
+
+    candidates = []
+    for page in parsed.pages:
+        for ind, block in enumerate(page.blocks):
+            if block.text:
+                candidates.extend(_block_candidates(block.text, page.number, ind))
+    return candidates
+
+
+_MONTH_NUMBERS = {name: ind for ind, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+_DAY_MONTH_YEAR = re.compile(r"(\d{1,2})(?:st|nd|rd|th)?\W+(?:of\W+)?([a-z]{3})[a-z]*\W+(\d{4})")
+_MONTH_DAY_YEAR = re.compile(r"([a-z]{3})[a-z]*\W+(\d{1,2})(?:st|nd|rd|th)?\W+(\d{4})")
+
+
+def _normalize(value: str) -> str:
+    """Compares values regardless of case and spacing, and dates with a month name regardless of their format."""
+
+    value = " ".join(value.replace(",", " ").split()).casefold()
+    for pattern, day, month in ((_DAY_MONTH_YEAR, 1, 2), (_MONTH_DAY_YEAR, 2, 1)):
+        match = pattern.fullmatch(value)
+        if match and match.group(month) in _MONTH_NUMBERS:
+            return f"{match.group(3)}-{_MONTH_NUMBERS[match.group(month)]:02d}-{int(match.group(day)):02d}"
+    return value
+
+
+def resolve_fields(candidates: List[dict], schema_name: str) -> Tuple[dict, dict]:
+    """
+    Sorts the candidates of the fields of a schema.
+
+    Parameters:
+        candidates (list): Candidates of the document, see `find_candidates`.
+        schema_name (str): Name of the schema, e.g. "keydates".
+
+    Returns:
+        (resolved, ambiguous): {field: value} of the fields with a single distinct value, labelled, and
+            {field: [candidates]} of the others, one candidate per distinct value, a labelled one if any.
+    """
+    fields = SCHEMA_FIELDS.get(schema_name.lower(), {})
+    values: Dict[str, Dict[str, dict]] = {}
+    for candidate in candidates:
+        field = fields.get(candidate["field"])
+        if field:
+            distinct = values.setdefault(field, {})
+            value = _normalize(candidate["value"])
+            if value not in distinct or candidate["labelled"] and not distinct[value]["labelled"]:
+                distinct[value] = candidate
+
+    resolved, ambiguous = {}, {}
+    for field, distinct in values.items():
+        if len(distinct) == 1 and next(iter(distinct.values()))["labelled"]:
+            resolved[field] = next(iter(distinct.values()))["value"]
+        else:
+            ambiguous[field] = list(distinct.values())
+    return resolved, ambiguous
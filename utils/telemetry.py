@@ -0,0 +1,282 @@
+"""
+Tracing and metrics of the ingest, retrieval and generation pipelines.
+
+- `span(stage)` times a stage of the pipeline (a PDF page, OCR, splitting, an embedding batch, the retriever,
+  the model call, ...). Every span is added to the `rfp_stage_duration_seconds` histogram of the process and
+  to the trace of the current request, if any, which the API returns in a `Server-Timing` header.
+- `count_tokens_used` and `record_cache` count the tokens sent to OpenAI and the hits and misses of the caches
+  (parse, OCR and vector stores). `count_message_tokens` also records which share of every prompt OpenAI
+  read from its prompt cache.
+- `render_metrics` writes all of it in the Prometheus text format, for the /metrics endpoint.
+
+Metrics are kept in memory, per process: with several gunicorn workers, every scrape of /metrics answers for
+the worker that served it. Nothing here imports a third-party package at import time, so the API can import it at startup.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterator, List, Tuple
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes") # Per-request timing headers
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATIO_BUCKETS = (0, 0.1, 0.25, 0.5, 0.75, 0.9, 1)
+METRIC_PREFIX = "rfp_"
+
+_HELP = {
+    "stage_duration_seconds": "Duration of the pipeline stages.",
+    "request_duration_seconds": "Duration of the HTTP requests.",
+    "tokens_total": "Tokens sent to and received from OpenAI.",
+    "cache_requests_total": "Lookups of the parse, OCR, vector store, extraction and pre-extraction caches.",
+    "cache_hit_ratio": "Share of the cache lookups that were hits, since the process started.",
+    "prompt_cache_ratio": "Share of the prompt tokens of a request read from the OpenAI prompt cache.",
+    "query_routes_total": "Questions by the path the query router sent them to, and the path it first picked.",
+    "pre_extracted_fields_total": "Extracted schema fields, by whether the pre-extraction rules or the LLM found them.",
+    "precomputed_extractions_total": "Extractions precomputed in the background after an upload, by result.",
+    "conversation_turns_total": "Conversation questions, by whether they re-used the chunks of the previous question.",
+    "prompt_cache_hit_ratio": "Share of all the prompt tokens read from the OpenAI prompt cache, since the process started.",
+}
+_BUCKETS = {"prompt_cache_ratio": RATIO_BUCKETS} # Histograms of other values than durations
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = {}
+_histograms: Dict[Tuple[str, tuple], list] = {} # [bucket counts..., sum, count]
+_trace: contextvars.ContextVar = contextvars.ContextVar("rfp_trace", default=None)
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Adds `value` to the counter `name` with these labels."""
+
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """Records a duration (or a ratio, for the histograms of `_BUCKETS`) in the histogram `name` with these labels."""
+
+    key = _key(name, labels)
+    buckets = _BUCKETS.get(name, DURATION_BUCKETS)
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(buckets) + 2)
+        for ind, bound in enumerate(buckets):
+            if seconds <= bound:
+                values[ind] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+
+def record_cache(cache: str, hit: bool):
+    """Counts a hit or a miss of `cache`, e.g. "parse", "ocr" or "store"."""
+
+    increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def count_tokens_used(model: str, kind: str, tokens: int):
+    """Counts tokens of `model`, `kind` is "prompt", "cached_prompt", "completion" or "embedding"."""
+
+    if tokens:
+        increment("tokens_total", tokens, model=model, kind=kind)
+
+
+def prompt_cache_usage(message) -> Tuple[int, int]:
+    """Returns the prompt tokens of a chat model answer and how many of them OpenAI read from its prompt cache."""
+
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    return usage.get("input_tokens", 0), details.get("cache_read") or 0
+
+
+def count_message_tokens(message, model: str, prompt: str | None = None):
+    """
+    Counts the prompt, cached prompt and completion tokens of a chat model answer, from its `usage_metadata`.
+    With the name of the `prompt` ("extraction", "rag", ...), also records the cached share of its tokens.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens, cached_tokens = prompt_cache_usage(message)
+    count_tokens_used(model, "prompt", input_tokens)
+    count_tokens_used(model, "cached_prompt", cached_tokens)
+    count_tokens_used(model, "completion", usage.get("output_tokens", 0))
+    if prompt and input_tokens:
+        observe("prompt_cache_ratio", cached_tokens / input_tokens, model=model, prompt=prompt)
+
+
+def start_trace() -> contextvars.Token:
+    """Starts the trace of a request in the current context, returns the token for `end_trace`."""
+
+    return _trace.set([])
+
+
+def end_trace(token: contextvars.Token) -> List[Tuple[str, float]]:
+    """Ends the trace started by `start_trace`, returns its (stage, seconds) spans in order of completion."""
+
+    spans = _trace.get() or []
+    _trace.reset(token)
+    return spans
+
+
+def current_trace() -> List[Tuple[str, float]]:
+    """Returns the spans recorded so far by the current request (empty outside a request)."""
+
+    return list(_trace.get() or [])
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[None]:
+    """
+    Times the `with` block as a stage of the pipeline.
+
+    The duration is recorded in the `rfp_stage_duration_seconds{stage=...}` histogram, with the extra labels,
+    and appended to the trace of the current request. Spans can be nested, e.g. "ocr" within "parse_page".
+    The trace is a list shared with the threads and event loops started by the request, as they copy its context.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, **labels)
+
+
+def record_span(stage: str, seconds: float, **labels):
+    """Records a stage timed by the caller, like `span` does, for loops where a `with` block does not fit."""
+
+    observe("stage_duration_seconds", seconds, stage=stage, **labels)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def traced(stage: str):
+    """Decorator timing every call of the function as a `span`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_runnable(stage: str, runnable):
+    """
+    Wraps a LangChain runnable (a retriever, a chat model, ...) so its invocations are timed as `stage`.
+    The run configuration is passed on, so callbacks and tracing of LangChain keep working.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    def invoke(value, config):
+        with span(stage):
+            return runnable.invoke(value, config)
+
+    return RunnableLambda(invoke, name=stage)
+
+
+def summarize_trace(spans: List[Tuple[str, float]]) -> Dict[str, Tuple[float, int]]:
+    """Sums the spans by stage: {stage: (seconds, calls)}, in order of first completion."""
+
+    summary = {}
+    for stage, seconds in spans:
+        total, calls = summary.get(stage, (0.0, 0))
+        summary[stage] = (total + seconds, calls + 1)
+    return summary
+
+
+def format_trace(spans: List[Tuple[str, float]]) -> str:
+    """Formats the spans for a log line, e.g. "parse_page=1.20s (12), embed=0.80s (2), llm=2.10s"."""
+
+    return ", ".join(f"{stage}={seconds:.2f}s" + (f" ({calls})" if calls > 1 else "")
+                     for stage, (seconds, calls) in summarize_trace(spans).items())
+
+
+def server_timing_header(spans: List[Tuple[str, float]], total_seconds: float | None = None) -> str:
+    """Formats the spans as a `Server-Timing` header, one entry per stage with the total in milliseconds."""
+
+    entries = [f'{stage};dur={seconds * 1000:.1f};desc="{calls} call{"s" if calls > 1 else ""}"'
+               for stage, (seconds, calls) in summarize_trace(spans).items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _header(lines: list, name: str, kind: str):
+    lines.append(f"# HELP {METRIC_PREFIX}{name} {_HELP.get(name, name)}")
+    lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+
+def render_metrics() -> str:
+    """Returns the metrics of this process in the Prometheus text exposition format."""
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        _header(lines, name, "counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+    # Hit ratio per cache, so dashboards do not need to compute it
+    caches = {}
+    for (metric, labels), value in counters.items():
+        if metric == "cache_requests_total":
+            label_map = dict(labels)
+            hits, total = caches.get(label_map["cache"], (0, 0))
+            caches[label_map["cache"]] = (hits + (value if label_map["result"] == "hit" else 0), total + value)
+    if caches:
+        _header(lines, "cache_hit_ratio", "gauge")
+        for cache, (hits, total) in sorted(caches.items()):
+            lines.append(f'{METRIC_PREFIX}cache_hit_ratio{{cache="{cache}"}} {hits / total:.4f}')
+
+    # Same for the OpenAI prompt cache, per model
+    prompts = {}
+    for (metric, labels), value in counters.items():
+        label_map = dict(labels)
+        if metric == "tokens_total" and label_map["kind"] in ("prompt", "cached_prompt"):
+            cached, total = prompts.get(label_map["model"], (0, 0))
+            prompts[label_map["model"]] = (cached + value, total) if label_map["kind"] == "cached_prompt" else (cached, total + value)
+    prompts = {model: counts for model, counts in prompts.items() if counts[1]}
+    if prompts:
+        _header(lines, "prompt_cache_hit_ratio", "gauge")
+        for model, (cached, total) in sorted(prompts.items()):
+            lines.append(f'{METRIC_PREFIX}prompt_cache_hit_ratio{{model="{model}"}} {cached / total:.4f}')
+
+    for name in sorted({name for name, _ in histograms}):
+        _header(lines, name, "histogram")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            # Bucket counts are cumulative already, see `observe`
+            for bound, count in zip(_BUCKETS.get(name, DURATION_BUCKETS), values):
+                lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {values[-2]:.6f}")
+            lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {values[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    """Clears all the metrics of the process, e.g. between benchmark runs."""
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()